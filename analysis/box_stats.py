@@ -0,0 +1,137 @@
+import csv
+import json
+import os
+from analysis.sketches import QuantileSketch
+
+
+# Metrics drawn by generate_boxplots, with their panel titles
+BOXPLOT_METRICS = [
+    ("search_depth", "Average search depth (pages)"),
+    ("search_duration", "Search duration (seconds)"),
+    ("results_pageviews", "Results pageviews per search"),
+    ("query_length", "Query length (words)"),
+]
+MAX_SEARCH_DURATION = 2000
+
+
+def box_sketches_path(csv_file_path):
+    """The box sketches of a sessions_analysis CSV are stored next to it."""
+    return f"{os.path.splitext(csv_file_path)[0]}_box_sketches.json"
+
+
+def new_box_sketches():
+    return {"order": [], "sketches": {metric: {} for metric, _ in BOXPLOT_METRICS}}
+
+
+# Function to add (sign=1) or retract (sign=-1) one sessions_analysis row in the per-session-type metric sketches
+def add_row_to_box_sketches(box_sketches, row, sign=1):
+    # Sessions above the maximum search duration are left out of every panel
+    if float(row["search_duration"]) > MAX_SEARCH_DURATION:
+        return
+    session_type = row["session_type"]
+    if session_type not in box_sketches["order"]:
+        box_sketches["order"].append(session_type)
+    for metric, sketches in box_sketches["sketches"].items():
+        if session_type not in sketches:
+            sketches[session_type] = QuantileSketch()
+        value = float(row[metric])
+        value = int(value) if value.is_integer() else value
+        if sign > 0:
+            sketches[session_type].add(value)
+        else:
+            sketches[session_type].remove(value)
+
+
+def merge_box_sketches(box_sketches, other):
+    for session_type in other["order"]:
+        if session_type not in box_sketches["order"]:
+            box_sketches["order"].append(session_type)
+    for metric, sketches in other["sketches"].items():
+        for session_type, sketch in sketches.items():
+            if session_type in box_sketches["sketches"][metric]:
+                box_sketches["sketches"][metric][session_type].merge(sketch)
+            else:
+                box_sketches["sketches"][metric][session_type] = sketch
+    return box_sketches
+
+
+def box_sketches_to_dict(box_sketches):
+    return {
+        "order": box_sketches["order"],
+        "sketches": {
+            metric: {
+                session_type: sketch.to_dict() for session_type, sketch in sketches.items()
+            }
+            for metric, sketches in box_sketches["sketches"].items()
+        },
+    }
+
+
+def box_sketches_from_dict(data):
+    return {
+        "order": data["order"],
+        "sketches": {
+            metric: {
+                session_type: QuantileSketch.from_dict(sketch)
+                for session_type, sketch in sketches.items()
+            }
+            for metric, sketches in data["sketches"].items()
+        },
+    }
+
+
+def save_box_sketches(box_sketches, file_path):
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "w") as file:
+        json.dump(box_sketches_to_dict(box_sketches), file)
+
+
+def load_box_sketches(file_path):
+    with open(file_path, "r") as file:
+        return box_sketches_from_dict(json.load(file))
+
+
+# Function to stream a sessions_analysis CSV into box sketches row by row
+def build_box_sketches_from_csv(csv_file_path):
+    box_sketches = new_box_sketches()
+    with open(csv_file_path, "r", newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            add_row_to_box_sketches(box_sketches, row)
+    return box_sketches
+
+
+def _clip(sketch, lower, upper):
+    clipped = QuantileSketch(sketch.relative_accuracy, sketch.max_exact_values)
+    for value, count in sketch.items():
+        if lower <= value <= upper:
+            clipped.add(value, count)
+    return clipped
+
+
+def box_stats(sketch, label, outlier_iqr=0.5, whisker_iqr=1.5):
+    """
+    Box statistics in the format of matplotlib's Axes.bxp.
+
+    Reproduces the previous pipeline: values outside [Q1 - 0.5·IQR,
+    Q3 + 0.5·IQR] are removed first (remove_extreme_outliers), then the box
+    and 1.5·IQR whiskers are computed on what remains, as seaborn does.
+    """
+    q1, q3 = sketch.quantile(0.25), sketch.quantile(0.75)
+    iqr = q3 - q1
+    kept = _clip(sketch, q1 - outlier_iqr * iqr, q3 + outlier_iqr * iqr)
+
+    q1, median, q3 = kept.quantile(0.25), kept.quantile(0.5), kept.quantile(0.75)
+    iqr = q3 - q1
+    values = [value for value, _ in kept.items()]
+    low = [value for value in values if value >= q1 - whisker_iqr * iqr]
+    high = [value for value in values if value <= q3 + whisker_iqr * iqr]
+    return {
+        "label": label,
+        "med": median,
+        "q1": q1,
+        "q3": q3,
+        "whislo": min(low) if low else q1,
+        "whishi": max(high) if high else q3,
+        "fliers": [],
+        "count": kept.count,
+    }
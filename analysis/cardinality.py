@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+from analysis.codec import read_session
+from analysis.sketches import HyperLogLog
+from analysis.utils import extract_docids, extract_session_queries
+
+
+CARDINALITY_FIELDS = ("users", "documents", "queries", "terms")
+
+# Time bucket -> length of the "YYYY-MM-DD HH:MM:SS" prefix that identifies it
+TIME_BUCKETS = {"month": 7, "day": 10, "hour": 13}
+
+
+def new_cardinality_sketches(precision=12, bucket="day"):
+    return {
+        "precision": precision,
+        "bucket": bucket,
+        "total": {field: HyperLogLog(precision) for field in CARDINALITY_FIELDS},
+        "buckets": {},
+    }
+
+
+# Function to extract the distinct values a session contributes to each sketch
+def session_distinct_values(session):
+    actions = session["actions"]
+    queries = extract_session_queries(actions)
+    return {
+        "users": [str(session.get("user_id", -1))],
+        "documents": extract_docids(actions),
+        "queries": {query.lower() for query in queries},
+        "terms": {term for query in queries for term in query.lower().split()},
+    }
+
+
+# Function to add one session to the dataset-wide and time-bucketed sketches
+def add_session_to_cardinalities(sketches, session):
+    add_values_to_cardinalities(
+        sketches, session_distinct_values(session), session.get("start_date")
+    )
+
+
+def add_values_to_cardinalities(sketches, values, start_date=None):
+    targets = [sketches["total"]]
+    if start_date:
+        key = start_date[: TIME_BUCKETS[sketches["bucket"]]]
+        if key not in sketches["buckets"]:
+            sketches["buckets"][key] = {
+                field: HyperLogLog(sketches["precision"]) for field in CARDINALITY_FIELDS
+            }
+        targets.append(sketches["buckets"][key])
+    for target in targets:
+        for field in CARDINALITY_FIELDS:
+            target[field].update(values[field])
+
+
+# Function to build the cardinality sketches of a session directory in one pass
+def build_cardinality_sketches(data_directory, precision=12, bucket="day"):
+    sketches = new_cardinality_sketches(precision, bucket)
+    for filename in os.listdir(data_directory):
+        if filename.endswith(".json"):
+            session = read_session(os.path.join(data_directory, filename))
+            add_session_to_cardinalities(sketches, session)
+    return sketches
+
+
+def merge_cardinality_sketches(sketches, other):
+    if (sketches["precision"], sketches["bucket"]) != (other["precision"], other["bucket"]):
+        raise ValueError("Cannot merge cardinality sketches with different settings")
+    for field, sketch in other["total"].items():
+        sketches["total"][field].merge(sketch)
+    for key, bucket_sketches in other["buckets"].items():
+        if key not in sketches["buckets"]:
+            sketches["buckets"][key] = {
+                field: HyperLogLog(sketches["precision"]) for field in CARDINALITY_FIELDS
+            }
+        for field, sketch in bucket_sketches.items():
+            sketches["buckets"][key][field].merge(sketch)
+    return sketches
+
+
+def cardinality_sketches_to_dict(sketches):
+    return {
+        "precision": sketches["precision"],
+        "bucket": sketches["bucket"],
+        "total": {field: sketch.to_dict() for field, sketch in sketches["total"].items()},
+        "buckets": {
+            key: {field: sketch.to_dict() for field, sketch in bucket_sketches.items()}
+            for key, bucket_sketches in sketches["buckets"].items()
+        },
+    }
+
+
+def cardinality_sketches_from_dict(data):
+    return {
+        "precision": data["precision"],
+        "bucket": data["bucket"],
+        "total": {
+            field: HyperLogLog.from_dict(sketch) for field, sketch in data["total"].items()
+        },
+        "buckets": {
+            key: {
+                field: HyperLogLog.from_dict(sketch)
+                for field, sketch in bucket_sketches.items()
+            }
+            for key, bucket_sketches in data["buckets"].items()
+        },
+    }
+
+
+def save_cardinality_sketches(sketches, file_path):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as file:
+        json.dump(cardinality_sketches_to_dict(sketches), file, separators=(",", ":"))
+
+
+def load_cardinality_sketches(file_path):
+    with open(file_path, "r") as file:
+        return cardinality_sketches_from_dict(json.load(file))
+
+
+# Function to write the estimated distinct counts, overall and per time bucket, to CSV
+def write_cardinality_report(sketches, output_csv_path):
+    rows = [
+        {"bucket": "all", **{field: sketches["total"][field].count() for field in CARDINALITY_FIELDS}}
+    ]
+    for key in sorted(sketches["buckets"]):
+        bucket_sketches = sketches["buckets"][key]
+        rows.append(
+            {"bucket": key, **{field: bucket_sketches[field].count() for field in CARDINALITY_FIELDS}}
+        )
+
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    with open(output_csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=["bucket", *CARDINALITY_FIELDS])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Cardinality estimates saved to {output_csv_path}")
+    return rows
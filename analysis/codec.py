@@ -0,0 +1,320 @@
+import json
+import os
+import time
+import types
+import typing
+from typing import Any, NotRequired, TypedDict
+from analysis.compression import open_input
+
+try:
+    import msgspec
+except ImportError:  # Typed decoding falls back to json plus a validation pass
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# The schemas only require what the parsers and analyses read unconditionally,
+# and accept every type those accept, so files that loaded as plain JSON still do.
+
+
+class Action(TypedDict):
+    """An action of a normalized session (SUSS, EconBiz or synthetic)."""
+
+    timestamp: str
+    action_type: str
+    action_label: str
+    action_id: NotRequired[int | float | str | None]
+    action_length: NotRequired[int | float | None]
+    params: NotRequired[Any]
+    origin_action: NotRequired[str | None]
+
+
+class Session(TypedDict):
+    """A normalized session as written to the session directories."""
+
+    session_id: NotRequired[str]
+    original_session_id: NotRequired[str]
+    session_length: NotRequired[int | float | None]
+    user_id: NotRequired[int | str | None]
+    start_date: NotRequired[str | None]
+    end_date: NotRequired[str | None]
+    has_click: NotRequired[bool | int]
+    actions: list[Action]
+
+
+class RawEvent(TypedDict):
+    """An event of a raw EconBiz session log."""
+
+    cts: int | float
+    category: str | None
+    action: str | None
+    params: NotRequired[Any]
+    data: NotRequired[dict[str, Any] | None]
+    page_view_id: NotRequired[Any]
+    origin_action: NotRequired[Any]
+
+
+class RawSession(TypedDict):
+    """
+    A raw EconBiz session: one NDJSON line, or one element of a session export file.
+
+    Raw sessions are open (see OPEN_SCHEMAS): fields beyond these, such as
+    ``user_id``, are kept for the tables built from the export files.
+    """
+
+    session_id: str
+    original_session_id: NotRequired[str]
+    has_duplicate_pids: NotRequired[bool | int]
+    supports_beacon: NotRequired[bool | int]
+    n_errors: NotRequired[int]
+    events: NotRequired[list[RawEvent]]
+
+
+class DecodeError(ValueError):
+    """Raised when data is not valid JSON or does not match its schema."""
+
+
+class SchemaError(DecodeError):
+    """Raised when valid JSON does not match its schema."""
+
+
+def _backend():
+    if orjson is not None:
+        return "orjson"
+    if msgspec is not None:
+        return "msgspec"
+    return "json"
+
+
+BACKEND = _backend()
+TYPED_BACKEND = "msgspec" if msgspec is not None else "json"
+
+
+def _check_type(expected, keep_unknown=False):
+    """
+    Compile a checker for a schema type, returning the value as msgspec decodes it.
+
+    Fields outside a TypedDict are dropped, like msgspec does, so both
+    backends give the same result; with ``keep_unknown`` they are kept and
+    only the declared fields are checked. A value that does not match raises
+    SchemaError.
+    """
+    if expected is Any:
+        return lambda value, path: value
+    origin = typing.get_origin(expected)
+    if origin in (typing.Union, types.UnionType):
+        options = [_check_type(option, keep_unknown) for option in typing.get_args(expected)]
+
+        def check_union(value, path):
+            for option in options:
+                try:
+                    return option(value, path)
+                except SchemaError:
+                    pass
+            raise SchemaError(f"Expected {expected} at {path}, got {type(value).__name__}")
+
+        return check_union
+    if origin is list:
+        (item_type,) = typing.get_args(expected)
+        check_item = _check_type(item_type, keep_unknown)
+
+        def check_list(value, path):
+            if not isinstance(value, list):
+                raise SchemaError(f"Expected array at {path}, got {type(value).__name__}")
+            return [check_item(item, f"{path}[{index}]") for index, item in enumerate(value)]
+
+        return check_list
+    if origin is dict:
+        _, value_type = typing.get_args(expected)
+        check_value = _check_type(value_type, keep_unknown)
+
+        def check_dict(value, path):
+            if not isinstance(value, dict):
+                raise SchemaError(f"Expected object at {path}, got {type(value).__name__}")
+            return {key: check_value(item, f"{path}.{key}") for key, item in value.items()}
+
+        return check_dict
+    if typing.is_typeddict(expected):
+        fields = {
+            name: _check_type(field_type, keep_unknown)
+            for name, field_type in typing.get_type_hints(expected).items()
+        }
+        required = expected.__required_keys__
+
+        def check_typeddict(value, path):
+            if not isinstance(value, dict):
+                raise SchemaError(f"Expected object at {path}, got {type(value).__name__}")
+            for name in required:
+                if name not in value:
+                    raise SchemaError(f"Object missing required field `{name}` at {path}")
+            checked = {
+                name: fields[name](item, f"{path}.{name}")
+                for name, item in value.items()
+                if name in fields
+            }
+            return {**value, **checked} if keep_unknown else checked
+
+        return check_typeddict
+    if expected is type(None):
+        accepted = (type(None),)
+    elif expected is float:
+        accepted = (int, float)
+    else:
+        accepted = (expected,)
+
+    def check_scalar(value, path):
+        # bool is an int subclass but not a JSON number
+        if not isinstance(value, accepted) or (
+            isinstance(value, bool) and expected is not bool
+        ):
+            raise SchemaError(f"Expected {expected.__name__} at {path}, got {type(value).__name__}")
+        return value
+
+    return check_scalar
+
+
+# Schemas whose fields outside the declared ones are kept. Typed msgspec decoding
+# would drop them, so these are decoded untyped and their declared fields checked.
+OPEN_SCHEMAS = (RawSession, list[RawSession])
+
+if msgspec is not None:
+    _decoders = {Session: msgspec.json.Decoder(Session)}
+    _msgspec_encoder = msgspec.json.Encoder()
+else:
+    _decoders = {}
+_checkers = {}
+
+
+def _stdlib_loads(data):
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError as error:
+        raise DecodeError(str(error)) from error
+
+
+def loads(data):
+    """Decode arbitrary JSON (str or bytes) without a schema; unknown fields are kept."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as error:
+            raise DecodeError(str(error)) from error
+    if msgspec is not None:
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as error:
+            raise DecodeError(str(error)) from error
+    return _stdlib_loads(data)
+
+
+def decode(data, schema):
+    """
+    Decode JSON into plain dicts and lists validated against a schema.
+
+    With msgspec the data is validated while it is parsed; without it the
+    stdlib result is checked in a second pass. Either way fields outside the
+    schema are dropped, so both backends return the same value. Schemas in
+    OPEN_SCHEMAS keep those fields: they are decoded without a schema (by
+    the fastest available decoder) and only their declared fields checked.
+    """
+    if schema in OPEN_SCHEMAS:
+        checker = _checkers.get(schema)
+        if checker is None:
+            checker = _checkers[schema] = _check_type(schema, keep_unknown=True)
+        return checker(loads(data), "$")
+    decoder = _decoders.get(schema)
+    if decoder is not None:
+        try:
+            return decoder.decode(data)
+        except msgspec.ValidationError as error:
+            raise SchemaError(str(error)) from error
+        except msgspec.DecodeError as error:
+            raise DecodeError(str(error)) from error
+    checker = _checkers.get(schema)
+    if checker is None:
+        checker = _checkers[schema] = _check_type(schema)
+    value = _stdlib_loads(data)
+    return checker(value, "$")
+
+
+def decode_session(data):
+    return decode(data, Session)
+
+
+def decode_raw_session(data):
+    return decode(data, RawSession)
+
+
+def decode_raw_sessions(data):
+    return decode(data, list[RawSession])
+
+
+def dumps(data, compact=True):
+    """Encode to UTF-8 JSON bytes; compact output uses the native encoder when available."""
+    if not compact:
+        return json.dumps(data, indent=4).encode("utf-8")
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    if msgspec is not None:
+        return _msgspec_encoder.encode(data)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def read_session(file_path):
+    """Read and validate a normalized session file (plain or compressed)."""
+    with open_input(file_path, "rb") as file:
+        return decode_session(file.read())
+
+
+def read_json(file_path):
+    with open_input(file_path, "rb") as file:
+        return loads(file.read())
+
+
+# Function to time decoding the session files of a directory with every available decoder
+def benchmark_decoding(directory, repeat=3, limit=None):
+    payloads = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            with open_input(os.path.join(directory, filename), "rb") as file:
+                payloads.append(file.read())
+            if limit and len(payloads) >= limit:
+                break
+    if not payloads:
+        print(f"No session files found in {directory}")
+        return {}
+
+    stdlib_checker = _check_type(Session)
+
+    def stdlib_typed(data):
+        return stdlib_checker(json.loads(data), "$")
+
+    decoders = {"json (validated)": stdlib_typed, "json (untyped)": json.loads}
+    if msgspec is not None:
+        decoders["msgspec (typed)"] = _decoders[Session].decode
+    if orjson is not None:
+        decoders["orjson (untyped)"] = orjson.loads
+
+    megabytes = sum(len(payload) for payload in payloads) / 1e6
+    timings = {}
+    for name, decoder in decoders.items():
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for payload in payloads:
+                decoder(payload)
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+
+    baseline = timings["json (validated)"]
+    print(f"Decoded {len(payloads)} session files ({megabytes:.1f} MB), best of {repeat}:")
+    for name, seconds in timings.items():
+        print(
+            f"  {name:<18} {seconds:8.3f}s  {megabytes / seconds:8.1f} MB/s  "
+            f"{baseline / seconds:5.1f}x"
+        )
+    return timings
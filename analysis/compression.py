@@ -0,0 +1,254 @@
+import gzip
+import io
+import os
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZSTD_SKIPPABLE_MASK = 0xFFFFFFF0
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A50
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+DEFAULT_THREADS = min(8, os.cpu_count() or 1)
+
+
+def detect_codec(file_path):
+    """Return "gzip", "zstd" or None by looking at the magic bytes of the file."""
+    with open(file_path, "rb") as file:
+        magic = file.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+# Function to check whether a gzip file is BGZF (independently decompressible blocks)
+def _is_bgzf(file_path):
+    with open(file_path, "rb") as file:
+        header = file.read(18)
+    return (
+        len(header) == 18
+        and header[3] & 4  # FEXTRA
+        and header[12:14] == b"BC"
+        and struct.unpack("<H", header[14:16])[0] == 2
+    )
+
+
+# Function to yield the raw deflate payload of every BGZF block
+def _iter_bgzf_blocks(file):
+    while True:
+        header = file.read(12)
+        if not header:
+            return
+        if len(header) < 12 or not header.startswith(GZIP_MAGIC):
+            raise ValueError("Corrupt BGZF block header")
+        extra_length = struct.unpack("<H", header[10:12])[0]
+        extra = file.read(extra_length)
+        block_size = None
+        position = 0
+        while position + 4 <= len(extra):
+            subfield_length = struct.unpack("<H", extra[position + 2 : position + 4])[0]
+            if extra[position : position + 2] == b"BC":
+                block_size = struct.unpack("<H", extra[position + 4 : position + 6])[0]
+            position += 4 + subfield_length
+        if block_size is None:
+            raise ValueError("BGZF block without a BC subfield")
+        payload = file.read(block_size - extra_length - 19)
+        file.read(8)  # CRC32 and ISIZE
+        yield payload
+
+
+def _decompress_bgzf_block(payload):
+    return zlib.decompress(payload, -15)
+
+
+# Function to yield every zstd frame of a (multi-frame) zstd file by walking frame and block headers
+def _iter_zstd_frames(file):
+    while True:
+        magic_bytes = file.read(4)
+        if not magic_bytes:
+            return
+        magic = struct.unpack("<I", magic_bytes)[0]
+        if magic & ZSTD_SKIPPABLE_MASK == ZSTD_SKIPPABLE_MAGIC:
+            file.seek(struct.unpack("<I", file.read(4))[0], io.SEEK_CUR)
+            continue
+        if magic_bytes != ZSTD_MAGIC:
+            raise ValueError("Corrupt zstd frame header")
+
+        frame = bytearray(magic_bytes)
+        descriptor = file.read(1)
+        frame += descriptor
+        flags = descriptor[0]
+        single_segment = flags >> 5 & 1
+        dictionary_id_size = (0, 1, 2, 4)[flags & 3]
+        content_size_size = (single_segment, 2, 4, 8)[flags >> 6]
+        header_size = (0 if single_segment else 1) + dictionary_id_size
+        frame += file.read(header_size + content_size_size)
+
+        while True:
+            block_header = file.read(3)
+            frame += block_header
+            value = int.from_bytes(block_header, "little")
+            block_type = value >> 1 & 3
+            block_size = value >> 3
+            frame += file.read(1 if block_type == 1 else block_size)
+            if value & 1:
+                break
+        if flags >> 2 & 1:
+            frame += file.read(4)  # Content checksum
+        yield bytes(frame)
+
+
+# Function to check whether a zstd file holds more than one frame (or ends with a seek table),
+# seeking over the block payloads of the first frame instead of reading them
+def _is_multi_frame_zstd(file_path):
+    with open(file_path, "rb") as file:
+        file.seek(0, io.SEEK_END)
+        size = file.tell()
+        if size >= 9:
+            file.seek(-4, io.SEEK_END)
+            if struct.unpack("<I", file.read(4))[0] == ZSTD_SEEKABLE_MAGIC:
+                return True
+        file.seek(0)
+        frames = 0
+        while file.tell() < size:
+            magic_bytes = file.read(4)
+            if len(magic_bytes) < 4:
+                return False
+            magic = struct.unpack("<I", magic_bytes)[0]
+            if magic & ZSTD_SKIPPABLE_MASK == ZSTD_SKIPPABLE_MAGIC:
+                file.seek(struct.unpack("<I", file.read(4))[0], io.SEEK_CUR)
+                continue
+            if magic_bytes != ZSTD_MAGIC:
+                return False
+            frames += 1
+            if frames > 1:
+                return True
+            flags = file.read(1)[0]
+            single_segment = flags >> 5 & 1
+            dictionary_id_size = (0, 1, 2, 4)[flags & 3]
+            content_size_size = (single_segment, 2, 4, 8)[flags >> 6]
+            header_size = (0 if single_segment else 1) + dictionary_id_size
+            file.seek(header_size + content_size_size, io.SEEK_CUR)
+            while True:
+                block_header = file.read(3)
+                if len(block_header) < 3:
+                    return False
+                value = int.from_bytes(block_header, "little")
+                block_type = value >> 1 & 3
+                file.seek(1 if block_type == 1 else value >> 3, io.SEEK_CUR)
+                if value & 1:
+                    break
+            if flags >> 2 & 1:
+                file.seek(4, io.SEEK_CUR)  # Content checksum
+    return False
+
+
+def _decompress_zstd_frame(frame):
+    import zstandard
+
+    return zstandard.ZstdDecompressor().decompressobj().decompress(frame)
+
+
+class ParallelDecompressReader(io.RawIOBase):
+    """
+    Raw reader that decompresses independent chunks (BGZF blocks or zstd frames)
+    on a thread pool while preserving their order. zlib and zstd release the
+    GIL, so decompression runs in parallel with the consumer's parsing.
+    """
+
+    def __init__(self, file, chunks, decompress, threads=DEFAULT_THREADS):
+        self._file = file
+        self._chunks = chunks
+        self._decompress = decompress
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._pending = deque()
+        self._in_flight = threads * 2
+        self._buffer = memoryview(b"")
+        self._exhausted = False
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        while not self._exhausted and len(self._pending) < self._in_flight:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._exhausted = True
+                break
+            self._pending.append(self._executor.submit(self._decompress, chunk))
+
+    def readinto(self, buffer):
+        while not self._buffer:
+            self._fill()
+            if not self._pending:
+                return 0
+            self._buffer = memoryview(self._pending.popleft().result())
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._file.close()
+        super().close()
+
+
+# Function to open a binary stream that transparently decompresses gzip/BGZF/zstd input
+def _open_binary(file_path, threads):
+    codec = detect_codec(file_path)
+    if codec is None:
+        return open(file_path, "rb")
+    if codec == "gzip":
+        if _is_bgzf(file_path) and threads > 1:
+            file = open(file_path, "rb")
+            raw = ParallelDecompressReader(
+                file, _iter_bgzf_blocks(file), _decompress_bgzf_block, threads
+            )
+            return io.BufferedReader(raw, buffer_size=1 << 20)
+        return gzip.open(file_path, "rb")
+
+    try:
+        import zstandard
+    except ImportError as error:
+        raise ImportError(
+            f"Reading {file_path} requires the 'zstandard' package "
+            "(poetry install --extras zstd)"
+        ) from error
+    # A single frame cannot be split, so only multi-frame files go through the thread pool;
+    # the stream reader decompresses a single frame without holding it in memory
+    if threads > 1 and _is_multi_frame_zstd(file_path):
+        file = open(file_path, "rb")
+        raw = ParallelDecompressReader(
+            file, _iter_zstd_frames(file), _decompress_zstd_frame, threads
+        )
+        return io.BufferedReader(raw, buffer_size=1 << 20)
+    file = open(file_path, "rb")
+    reader = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+    return io.BufferedReader(reader, buffer_size=1 << 20)
+
+
+def open_input(
+    file_path, mode="r", encoding="utf-8", newline=None, threads=DEFAULT_THREADS
+):
+    """
+    Open an input file for reading, decompressing gzip or zstd while streaming.
+
+    The codec is detected from the magic bytes, so compressed and uncompressed
+    inputs can be passed interchangeably. BGZF files and multi-frame zstd files
+    are decompressed in parallel.
+    """
+    if mode not in ("r", "rb"):
+        raise ValueError(f"Unsupported mode: {mode}")
+    if mode == "r" and detect_codec(file_path) is None:
+        return open(file_path, "r", encoding=encoding, newline=newline)
+    binary = _open_binary(file_path, threads)
+    if mode == "rb":
+        return binary
+    return io.TextIOWrapper(binary, encoding=encoding, newline=newline)
@@ -0,0 +1,288 @@
+import gzip
+import json
+import math
+import os
+from functools import lru_cache
+from analysis.codec import read_session
+from analysis.compression import open_input
+from analysis.data_processing import action_mappings, calculate_session_duration
+from analysis.session_analysis import categorize_session, count_queries
+from analysis.sketches import QuantileSketch
+
+
+CUBE_DIMENSIONS = ("dataset", "day", "hour", "session_type", "category")
+# Session-level measures are recorded in the category "*" cells only
+SESSION_MEASURES = (
+    "sessions",
+    "duration_sum",
+    "duration_sumsq",
+    "queries_sum",
+    "queries_sumsq",
+)
+ACTION_MEASURES = ("actions", "action_time")
+ADDITIVE_MEASURES = SESSION_MEASURES + ACTION_MEASURES
+ALL_CATEGORIES = "*"
+
+
+def _mean(total, count):
+    return total / count if count else 0.0
+
+
+def _sd(total, total_squares, count):
+    if count < 2:
+        return 0.0
+    return math.sqrt(max((total_squares - total * total / count) / (count - 1), 0.0))
+
+
+# Measures derived from the additive ones (and the duration sketch) at query time
+DERIVED_MEASURES = {
+    "duration_mean": lambda cell: _mean(cell["duration_sum"], cell["sessions"]),
+    "duration_sd": lambda cell: _sd(
+        cell["duration_sum"], cell["duration_sumsq"], cell["sessions"]
+    ),
+    "duration_median": lambda cell: cell["duration_sketch"].quantile(0.5),
+    "queries_mean": lambda cell: _mean(cell["queries_sum"], cell["sessions"]),
+    "queries_sd": lambda cell: _sd(
+        cell["queries_sum"], cell["queries_sumsq"], cell["sessions"]
+    ),
+    "action_time_mean": lambda cell: _mean(cell["action_time"], cell["actions"]),
+}
+
+
+def _new_cell():
+    cell = dict.fromkeys(ADDITIVE_MEASURES, 0)
+    cell["duration_sketch"] = QuantileSketch()
+    return cell
+
+
+def _merge_cell(cell, other):
+    for measure in ADDITIVE_MEASURES:
+        cell[measure] += other[measure]
+    cell["duration_sketch"].merge(other["duration_sketch"])
+
+
+# Function to add one session to the cells of its day, keyed by (hour, session_type, category)
+def add_session_to_cube(cells, session):
+    start_date = session["start_date"]
+    hour = int(start_date[11:13])
+    session_type = categorize_session(session)
+    actions = session["actions"]
+
+    session_cell = cells.setdefault((hour, session_type, ALL_CATEGORIES), _new_cell())
+    duration = calculate_session_duration(session)
+    queries = count_queries(actions)
+    session_cell["sessions"] += 1
+    session_cell["duration_sum"] += duration
+    session_cell["duration_sumsq"] += duration * duration
+    session_cell["queries_sum"] += queries
+    session_cell["queries_sumsq"] += queries * queries
+    session_cell["duration_sketch"].add(duration)
+
+    for action in actions:
+        action_time = action.get("action_length") or 0
+        session_cell["actions"] += 1
+        session_cell["action_time"] += action_time
+        category = action_mappings.get(action["action_label"])
+        if category is not None:
+            cell = cells.setdefault((hour, session_type, category), _new_cell())
+            cell["actions"] += 1
+            cell["action_time"] += action_time
+
+
+def partition_path(cube_dir, dataset_name, day):
+    return os.path.join(cube_dir, dataset_name, f"{day}.json.gz")
+
+
+# Function to write the cells of one (dataset, day) partition as dictionary-encoded columns
+def save_partition(cells, file_path):
+    keys = sorted(cells)
+    session_types = sorted({session_type for _, session_type, _ in keys})
+    categories = sorted({category for _, _, category in keys})
+    columns = {
+        "hour": [hour for hour, _, _ in keys],
+        "session_type": [session_types.index(session_type) for _, session_type, _ in keys],
+        "category": [categories.index(category) for _, _, category in keys],
+    }
+    for measure in ADDITIVE_MEASURES:
+        columns[measure] = [cells[key][measure] for key in keys]
+    columns["duration_sketch"] = [
+        cells[key]["duration_sketch"].to_dict() if cells[key]["sessions"] else None
+        for key in keys
+    ]
+    data = {
+        "dictionaries": {"session_type": session_types, "category": categories},
+        "columns": columns,
+    }
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = f"{file_path}.tmp.{os.getpid()}"
+    with gzip.open(temporary_path, "wt", encoding="utf-8") as file:
+        json.dump(data, file, separators=(",", ":"))
+    os.replace(temporary_path, file_path)
+
+
+@lru_cache(maxsize=4096)
+def _load_partition_columns(file_path, mtime_ns):
+    with open_input(file_path, "r") as file:
+        return json.load(file)
+
+
+def load_partition(file_path):
+    data = _load_partition_columns(file_path, os.stat(file_path).st_mtime_ns)
+    columns = data["columns"]
+    session_types = data["dictionaries"]["session_type"]
+    categories = data["dictionaries"]["category"]
+    cells = {}
+    for row in range(len(columns["hour"])):
+        cell = {measure: columns[measure][row] for measure in ADDITIVE_MEASURES}
+        sketch = columns["duration_sketch"][row]
+        cell["duration_sketch"] = (
+            QuantileSketch.from_dict(sketch) if sketch else QuantileSketch()
+        )
+        key = (
+            columns["hour"][row],
+            session_types[columns["session_type"][row]],
+            categories[columns["category"][row]],
+        )
+        cells[key] = cell
+    return cells
+
+
+def build_cube(data_directory, dataset_name, cube_dir="metrics/cube", rebuild=False):
+    """
+    Add the sessions of a directory to the cube of a dataset.
+
+    Session files already in the cube's manifest are skipped, so new days (or
+    late sessions of existing days) are appended by merging into the affected
+    day partitions only. ``rebuild`` drops the dataset's cube first.
+    """
+    dataset_dir = os.path.join(cube_dir, dataset_name)
+    manifest_path = os.path.join(dataset_dir, "manifest.json")
+    if rebuild and os.path.isdir(dataset_dir):
+        for filename in os.listdir(dataset_dir):
+            os.remove(os.path.join(dataset_dir, filename))
+    ingested = set()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as file:
+            ingested = set(json.load(file))
+
+    new_cells = {}
+    new_files = []
+    for filename in sorted(os.listdir(data_directory)):
+        if not filename.endswith(".json") or filename in ingested:
+            continue
+        session = read_session(os.path.join(data_directory, filename))
+        new_files.append(filename)
+        if not session.get("start_date"):
+            continue
+        add_session_to_cube(new_cells.setdefault(session["start_date"][:10], {}), session)
+
+    for day, cells in new_cells.items():
+        file_path = partition_path(cube_dir, dataset_name, day)
+        if os.path.exists(file_path):
+            existing = load_partition(file_path)
+            for key, cell in cells.items():
+                if key in existing:
+                    _merge_cell(existing[key], cell)
+                else:
+                    existing[key] = cell
+            cells = existing
+        save_partition(cells, file_path)
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    temporary_path = f"{manifest_path}.tmp.{os.getpid()}"
+    with open(temporary_path, "w") as file:
+        json.dump(sorted(ingested | set(new_files)), file)
+    os.replace(temporary_path, manifest_path)
+    print(
+        f"{dataset_name}: {len(new_files)} sessions added to {len(new_cells)} day partitions of the cube."
+    )
+    return len(new_files)
+
+
+def _matches(value, wanted):
+    if wanted is None:
+        return True
+    if isinstance(wanted, (list, tuple, set)):
+        return value in wanted
+    return value == wanted
+
+
+def query_cube(measures, group_by=(), filters=None, cube_dir="metrics/cube"):
+    """
+    Roll up or slice the cube.
+
+    Parameters:
+    - measures: Additive measures (ADDITIVE_MEASURES) and/or DERIVED_MEASURES.
+    - group_by: Dimensions (CUBE_DIMENSIONS) to keep; all others are rolled up.
+    - filters: Dimension -> value or list of values; ``day`` also accepts a
+      (first_day, last_day) range given as a dict {"from": ..., "to": ...}.
+
+    Session measures are only defined for the whole session (category "*");
+    without a category filter or grouping, only those cells are read. Grouping
+    or filtering by category reads the per-category cells, which carry the
+    action measures only.
+
+    Returns a list of dicts with the group_by dimensions and the measures.
+    """
+    filters = dict(filters or {})
+    for name in list(group_by) + list(filters):
+        if name not in CUBE_DIMENSIONS:
+            raise ValueError(f"Unknown cube dimension: {name}")
+    for measure in measures:
+        if measure not in ADDITIVE_MEASURES and measure not in DERIVED_MEASURES:
+            raise ValueError(f"Unknown cube measure: {measure}")
+    by_category = "category" in group_by or "category" in filters
+    if not by_category:
+        filters["category"] = ALL_CATEGORIES
+
+    day_filter = filters.pop("day", None)
+    groups = {}
+    if not os.path.isdir(cube_dir):
+        return []
+    for dataset_name in sorted(os.listdir(cube_dir)):
+        if not _matches(dataset_name, filters.get("dataset")):
+            continue
+        dataset_dir = os.path.join(cube_dir, dataset_name)
+        for filename in sorted(os.listdir(dataset_dir)):
+            if not filename.endswith(".json.gz"):
+                continue
+            day = filename[: -len(".json.gz")]
+            if isinstance(day_filter, dict):
+                if day < day_filter.get("from", "") or day > day_filter.get("to", "9999"):
+                    continue
+            elif not _matches(day, day_filter):
+                continue
+            for (hour, session_type, category), cell in load_partition(
+                os.path.join(dataset_dir, filename)
+            ).items():
+                values = {
+                    "dataset": dataset_name,
+                    "day": day,
+                    "hour": hour,
+                    "session_type": session_type,
+                    "category": category,
+                }
+                if by_category and category == ALL_CATEGORIES:
+                    continue
+                if not all(
+                    _matches(values[name], wanted) for name, wanted in filters.items()
+                ):
+                    continue
+                key = tuple(values[name] for name in group_by)
+                if key in groups:
+                    _merge_cell(groups[key], cell)
+                else:
+                    groups[key] = cell
+
+    rows = []
+    for key in sorted(groups):
+        cell = groups[key]
+        row = dict(zip(group_by, key))
+        for measure in measures:
+            row[measure] = (
+                DERIVED_MEASURES[measure](cell)
+                if measure in DERIVED_MEASURES
+                else cell[measure]
+            )
+        rows.append(row)
+    return rows
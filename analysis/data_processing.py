@@ -1,18 +1,53 @@
 import csv
+import re
 from tqdm import tqdm
-import json
-from datetime import datetime, timedelta
+from collections import Counter
+from datetime import timedelta
 from statistics import mean, median, stdev
 from analysis.utils import (
     extract_queries,
     standardize_query,
     rewrite_query,
     flatten_dict,
-    parse_date,
+    timestamp_to_epoch_ms,
+    epoch_ms_to_timestamp,
     calculate_session_duration,
     get_num_lines,
     minutes_to_hh_mm,
 )
+from analysis.codec import (
+    DecodeError,
+    RawSession,
+    decode,
+    decode_raw_session,
+    decode_raw_sessions,
+    dumps,
+    loads,
+    read_session,
+)
+from analysis.compression import open_input
+from analysis.quarantine import Quarantine, quarantine_path, read_quarantine
+from analysis.session_container import SessionContainer, is_container, iter_sessions
+from analysis.session_model import as_dict
+from analysis.suss_processing import parse_csv_rows
+from analysis.box_stats import (
+    add_row_to_box_sketches,
+    box_sketches_path,
+    new_box_sketches,
+    save_box_sketches,
+)
+from analysis.cardinality import (
+    add_session_to_cardinalities,
+    new_cardinality_sketches,
+    save_cardinality_sketches,
+    write_cardinality_report,
+)
+from analysis.heavy_hitters import (
+    add_session_to_heavy_hitters,
+    new_heavy_hitters,
+    save_heavy_hitters,
+    write_heavy_hitters_report,
+)
 import os
 import pandas as pd
 from analysis.session_analysis import (
@@ -91,11 +126,11 @@ action_mappings = {
 # Function to discover fields for NDJSON
 def discover_fields_ndjson(file_path):
     fields = set()
-    with open(file_path, "r", encoding="utf-8") as file:
+    with open_input(file_path, "r", encoding="utf-8") as file:
         for line in tqdm(
             file, total=get_num_lines(file_path), desc="Discovering Fields"
         ):
-            obj = json.loads(line)
+            obj = loads(line)
             flat_entry = flatten_dict(obj)
             fields.update(flat_entry.keys())
     return list(fields)
@@ -109,193 +144,337 @@ def process_large_json_to_csv_ndjson(file_path, output_csv_path):
         writer = csv.DictWriter(csvfile, fieldnames=fields)
         writer.writeheader()
 
-        with open(file_path, "r", encoding="utf-8") as file:
+        with open_input(file_path, "r", encoding="utf-8") as file:
             for line in tqdm(file, total=get_num_lines(file_path), desc="Writing CSV"):
-                obj = json.loads(line)
+                obj = loads(line)
                 flat_entry = flatten_dict(obj)
                 writer.writerow(flat_entry)
 
 
-def parse_sessions(file_path):
-    import ijson  # Import here to limit its scope to this function
+def parse_session_records(records, store=None, quarantine=None, clicks_only=True):
+    """
+    Parse EconBiz NDJSON session lines given as (byte offset, line) pairs.
 
+    With a SessionStore, sessions are built in its compact form. Lines that
+    are not valid raw sessions go to the quarantine (or raise without one).
+    Sessions without a click are dropped unless ``clicks_only`` is False.
+    """
     sessions = {}
     last_click_action_type = None
     last_action_timestamp = {}
-    print("Starting to parse sessions...")
+    # Session start and end are tracked as epoch milliseconds and only formatted for output
+    session_bounds = {}
 
-    with open(file_path, "rb") as file:
-        for line in file:
+    for offset, line in records:
+        if not line.strip():
+            continue
+        try:
+            session = decode_raw_session(line)
+        except DecodeError as error:
+            if quarantine is None:
+                raise
+            quarantine.add_error(error, line, offset=offset)
+            continue
+        session_id = session["session_id"]
 
-            session = next(ijson.items(line, ""))
-            session_id = session["session_id"]
+        if session_id not in sessions and store is not None:
+            sessions[session_id] = store.new_session(session_id)
+            last_action_timestamp[session_id] = None
+            session_bounds[session_id] = None
+            last_click_action_type = None
+        elif session_id not in sessions:
+            sessions[session_id] = {
+                "session_id": session_id,
+                "session_length": 0,
+                "user_id": -1,
+                "start_date": None,
+                "end_date": None,
+                "actions": [],
+                "has_click": False,
+            }
+            last_action_timestamp[session_id] = None
+            session_bounds[session_id] = None
+            last_click_action_type = None
 
-            if session_id not in sessions:
-                sessions[session_id] = {
-                    "session_id": session_id,
-                    "session_length": 0,
-                    "user_id": -1,
-                    "start_date": None,
-                    "end_date": None,
-                    "actions": [],
-                    "has_click": False,
-                }
-                last_action_timestamp[session_id] = None
-                last_click_action_type = None
+        for event in session.get("events", []):
+            action_timestamp = event["cts"]
+            action_formatted_timestamp = epoch_ms_to_timestamp(action_timestamp)
 
-            for event in session.get("events", []):
-                action_timestamp = datetime.utcfromtimestamp(event["cts"] / 1000)
-                action_formatted_timestamp = action_timestamp.strftime(
-                    "%Y-%m-%d %H:%M:%S"
+            if last_action_timestamp[session_id] is not None:
+                action_length = int(
+                    (action_timestamp - last_action_timestamp[session_id]) / 1000
                 )
+            else:
+                action_length = 0
+
+            action = {
+                "action_id": event.get("cts", None),
+                "timestamp": action_formatted_timestamp,
+                "action_type": event["category"],
+                "action_label": event["action"],
+                "action_length": action_length,
+                "params": event.get("params", ""),
+                "origin_action": event.get("origin_action", ""),
+            }
 
-                if last_action_timestamp[session_id] is not None:
-                    action_length = int(
-                        (
-                            action_timestamp - last_action_timestamp[session_id]
-                        ).total_seconds()
-                    )
-                else:
-                    action_length = 0
-
-                action = {
-                    "action_id": event.get("cts", None),
-                    "timestamp": action_formatted_timestamp,
-                    "action_type": event["category"],
-                    "action_label": event["action"],
-                    "action_length": action_length,
-                    "params": event.get("params", ""),
-                    "origin_action": event.get("origin_action", ""),
-                }
-
-                # Handling params for RecordMLT and PageView
-                if action["action_type"] == "RecordMLT":
-                    action["params"] = ",".join(
-                        map(str, event.get("data", {}).get("record_ids", []))
-                    )
-                elif action["action_type"] == "PageView":
-                    action["params"] = event.get("page_view_id", "")
-
-                # Handling params for AvailabilityButton with click action_label
-                if (
-                    action["action_type"] == "AvailabilityButton"
-                    and action["action_label"] == "click"
-                ):
-                    queries = extract_queries([event])
-                    standardized_queries = [
-                        standardize_query(query) for query in queries
-                    ]
-                    rewritten_queries = [
-                        rewrite_query(query) for query in standardized_queries
-                    ]
-                    action["params"] = ",".join(rewritten_queries)
-
-                if action["action_label"] == "click":
-                    sessions[session_id]["has_click"] = True
-                    if last_click_action_type is not None:
-                        action["origin_action"] = last_click_action_type
-                    last_click_action_type = action["action_type"]
-
-                sessions[session_id]["actions"].append(action)
-
-                if (
-                    not sessions[session_id]["start_date"]
-                    or action["timestamp"] < sessions[session_id]["start_date"]
-                ):
-                    sessions[session_id]["start_date"] = action["timestamp"]
-
-                if (
-                    not sessions[session_id]["end_date"]
-                    or action["timestamp"] > sessions[session_id]["end_date"]
-                ):
-                    sessions[session_id]["end_date"] = action["timestamp"]
-
-                last_action_timestamp[session_id] = action_timestamp
-
-            if sessions[session_id]["start_date"] and sessions[session_id]["end_date"]:
-                session_start = datetime.strptime(
-                    sessions[session_id]["start_date"], "%Y-%m-%d %H:%M:%S"
-                )
-                session_end = datetime.strptime(
-                    sessions[session_id]["end_date"], "%Y-%m-%d %H:%M:%S"
-                )
-                sessions[session_id]["session_length"] = int(
-                    (session_end - session_start).total_seconds()
+            # Handling params for RecordMLT and PageView
+            if action["action_type"] == "RecordMLT":
+                action["params"] = ",".join(
+                    map(str, (event.get("data") or {}).get("record_ids", []))
                 )
+            elif action["action_type"] == "PageView":
+                action["params"] = event.get("page_view_id", "")
+
+            # Handling params for AvailabilityButton with click action_label
+            if (
+                action["action_type"] == "AvailabilityButton"
+                and action["action_label"] == "click"
+            ):
+                queries = extract_queries([event])
+                standardized_queries = [
+                    standardize_query(query) for query in queries
+                ]
+                rewritten_queries = [
+                    rewrite_query(query) for query in standardized_queries
+                ]
+                action["params"] = ",".join(rewritten_queries)
+
+            if action["action_label"] == "click":
+                sessions[session_id]["has_click"] = True
+                if last_click_action_type is not None:
+                    action["origin_action"] = last_click_action_type
+                last_click_action_type = action["action_type"]
+
+            sessions[session_id]["actions"].append(action)
+
+            bounds = session_bounds[session_id]
+            if bounds is None:
+                session_bounds[session_id] = [action_timestamp, action_timestamp]
+            elif action_timestamp < bounds[0]:
+                bounds[0] = action_timestamp
+            elif action_timestamp > bounds[1]:
+                bounds[1] = action_timestamp
+
+            last_action_timestamp[session_id] = action_timestamp
+
+        if session_bounds[session_id] is not None:
+            start_ms, end_ms = session_bounds[session_id]
+            if store is not None:
+                sessions[session_id].start_ms = start_ms - start_ms % 1000
+                sessions[session_id].end_ms = end_ms - end_ms % 1000
+            else:
+                sessions[session_id]["start_date"] = epoch_ms_to_timestamp(start_ms)
+                sessions[session_id]["end_date"] = epoch_ms_to_timestamp(end_ms)
+            sessions[session_id]["session_length"] = (end_ms // 1000) - (
+                start_ms // 1000
+            )
 
-    print("Finished parsing sessions.")
+    if not clicks_only:
+        return sessions
     return {sid: sess for sid, sess in sessions.items() if sess["has_click"]}
 
 
-def process_sessions_to_csv(directory, csv_file_path):
-    session_data = []
-    for filename in os.listdir(directory):
-        if filename.endswith(".json"):
-            file_path = os.path.join(directory, filename)
-            with open(file_path, "r") as file:
-                data = json.load(file)
-            session_id = data["session_id"]
-            start_date = parse_date(data["start_date"])
-            end_date = parse_date(data["end_date"])
-            search_duration = (end_date - start_date).total_seconds()
-            session_type = categorize_session(data)
-
-            search_depth = 0
-            results_pageviews = 0
-            total_query_length = 0
-            search_actions = 0
-            search_refinements = 0
-            first_action = True
-
-            # Analyze actions to derive additional metrics
-            viewed_docs = set()
-            search_terms = []
-
-            for action in data["actions"]:
-                if action["action_label"] == "view_record":
-                    search_depth += 1
-                    viewed_docs.add(action["params"])
-                if action["action_type"] == "extraction" and action[
-                    "action_label"
-                ].startswith("searchterm_"):
-                    search_terms.append(action["params"])
-                    total_query_length += len(action["params"].split())
-                    search_actions += 1
-                if (
-                    (
-                        action["action_type"] == "action"
-                        and action["action_label"].startswith("search")
-                    )
-                    or (
-                        action["action_type"] == "action"
-                        and action["action_label"].startswith("query")
-                    )
-                ) and not first_action:
-                    search_refinements += 1
-                if action["action_label"] == "resultlistids":
-                    results_pageviews += len(action["params"].split(","))
-                first_action = False
-
-            # Calculate metrics
-            percent_search_refinements = (
-                search_refinements / search_depth if search_depth else 0
+# Function to yield (byte offset, line) pairs of a binary file
+def iter_lines_with_offsets(file):
+    offset = 0
+    for line in file:
+        yield offset, line
+        offset += len(line)
+
+
+def parse_sessions(file_path, store=None, quarantine_file=None):
+    """
+    Parse EconBiz NDJSON sessions; with a SessionStore, sessions are built in its compact form.
+
+    Malformed lines and lines missing required fields are written with their
+    byte offset and error to a quarantine file (see analysis/quarantine.py)
+    and the run continues.
+    """
+    print("Starting to parse sessions...")
+    with Quarantine(
+        quarantine_file or quarantine_path(file_path), "econbiz_ndjson", file_path
+    ) as quarantine, open_input(file_path, "rb") as file:
+        sessions = parse_session_records(
+            iter_lines_with_offsets(file), store, quarantine
+        )
+    print("Finished parsing sessions.")
+    return sessions
+
+
+# Function to add the actions of a reprocessed session to the saved session it belongs to
+def merge_session(saved, session, kind):
+    """
+    Merge the actions of ``session`` into ``saved``, a session saved by an earlier run.
+
+    Actions are ordered by action id, the CSV row id (SUSS) or the event
+    ``cts`` (EconBiz), as a full run over the fixed input would order them.
+    SUSS sessions start at the date of their first row and end at their
+    latest date; EconBiz action lengths and session bounds are recomputed
+    from the event times.
+    """
+    merged = dict(saved)
+    actions = sorted(saved["actions"] + session["actions"], key=lambda action: action["action_id"])
+    merged["actions"] = actions
+    if kind == "econbiz_ndjson":
+        previous_ms = None
+        for action in actions:
+            action_ms = action["action_id"]
+            action["action_length"] = (
+                int((action_ms - previous_ms) / 1000) if previous_ms is not None else 0
+            )
+            previous_ms = action_ms
+        start_ms, end_ms = actions[0]["action_id"], actions[-1]["action_id"]
+        merged["start_date"] = epoch_ms_to_timestamp(start_ms)
+        merged["end_date"] = epoch_ms_to_timestamp(end_ms)
+        merged["session_length"] = (end_ms // 1000) - (start_ms // 1000)
+    else:
+        merged["start_date"] = actions[0]["timestamp"]
+        merged["end_date"] = max(
+            (action["timestamp"] for action in actions), key=timestamp_to_epoch_ms
+        )
+    return merged
+
+
+def reprocess_quarantine(path, store=None, output_dir=None):
+    """
+    Parse only the records of a quarantine file, e.g. after fixing them in place.
+
+    NDJSON lines and CSV rows go through the same parsers as a full run;
+    records that still fail replace the quarantine file once parsing is
+    done. Session export file entries (load_dataset) are only reported,
+    since their sessions are read straight from the export directory.
+
+    With ``output_dir``, a session whose other records were saved there by
+    an earlier run is merged with its saved file (see merge_session) rather
+    than rebuilt from the quarantined records alone; merged sessions are
+    returned as dicts, ready to be saved over the old files.
+    """
+    entries = read_quarantine(path)
+    if not entries:
+        print(f"No quarantined records in {path}")
+        return {}
+    kind, source = entries[0]["kind"], entries[0]["source"]
+    with Quarantine(path, kind, source) as quarantine:
+        if kind == "econbiz_ndjson":
+            records = (
+                (entry["offset"], entry["record"].encode("utf-8")) for entry in entries
             )
+            sessions = parse_session_records(
+                records, store, quarantine, clicks_only=output_dir is None
+            )
+        elif kind == "suss_csv":
+            rows = ((entry["line"], entry["record"]) for entry in entries)
+            sessions = parse_csv_rows(rows, store, quarantine)
+        else:
+            for entry in entries:
+                quarantine.add(
+                    entry["error"], entry["message"], entry["record"],
+                    entry["offset"], entry["line"],
+                )
+            sessions = {}
+    merged = 0
+    if output_dir is not None:
+        for session_id in list(sessions):
+            file_path = os.path.join(output_dir, f"{session_id}.json")
+            if os.path.exists(file_path):
+                sessions[session_id] = merge_session(
+                    read_session(file_path), as_dict(sessions[session_id]), kind
+                )
+                merged += 1
+            elif kind == "econbiz_ndjson" and not sessions[session_id]["has_click"]:
+                # As in a full run, a new session without a click is not kept
+                del sessions[session_id]
+    print(f"Reprocessed {len(entries)} quarantined records into {len(sessions)} sessions.")
+    if output_dir is not None:
+        print(f"Merged {merged} sessions with their saved files in {output_dir}.")
+    return sessions
 
-            session_data.append(
-                {
-                    "session_id": session_id,
-                    "session_type": session_type,
-                    "search_depth": search_depth,
-                    "results_pageviews": results_pageviews,
-                    "search_duration": search_duration,
-                    "percent_search_refinements": percent_search_refinements,
-                    "query_length": total_query_length,
-                }
+
+# Columns of the sessions_analysis CSV, in the order of analyze_session
+SESSION_ANALYSIS_FIELDS = [
+    "session_id",
+    "session_type",
+    "search_depth",
+    "results_pageviews",
+    "search_duration",
+    "percent_search_refinements",
+    "query_length",
+]
+
+
+# Function to derive the per-session classification metrics written by process_sessions_to_csv
+def analyze_session(data):
+    start_ms = timestamp_to_epoch_ms(data["start_date"])
+    end_ms = timestamp_to_epoch_ms(data["end_date"])
+    search_duration = (end_ms - start_ms) / 1000
+    session_type = categorize_session(data)
+
+    search_depth = 0
+    results_pageviews = 0
+    total_query_length = 0
+    search_actions = 0
+    search_refinements = 0
+    first_action = True
+
+    # Analyze actions to derive additional metrics
+    viewed_docs = set()
+    search_terms = []
+
+    for action in data["actions"]:
+        if action["action_label"] == "view_record":
+            search_depth += 1
+            viewed_docs.add(action["params"])
+        if action["action_type"] == "extraction" and action["action_label"].startswith(
+            "searchterm_"
+        ):
+            search_terms.append(action["params"])
+            total_query_length += len(action["params"].split())
+            search_actions += 1
+        if (
+            (
+                action["action_type"] == "action"
+                and action["action_label"].startswith("search")
             )
+            or (
+                action["action_type"] == "action"
+                and action["action_label"].startswith("query")
+            )
+        ) and not first_action:
+            search_refinements += 1
+        if action["action_label"] == "resultlistids":
+            results_pageviews += len(action["params"].split(","))
+        first_action = False
+
+    # Calculate metrics
+    percent_search_refinements = (
+        search_refinements / search_depth if search_depth else 0
+    )
+
+    return {
+        "session_id": data.get("session_id", ""),
+        "session_type": session_type,
+        "search_depth": search_depth,
+        "results_pageviews": results_pageviews,
+        "search_duration": search_duration,
+        "percent_search_refinements": percent_search_refinements,
+        "query_length": total_query_length,
+    }
 
-    df = pd.DataFrame(session_data)
+
+def process_sessions_to_csv(directory, csv_file_path):
+    # Rows are written as they are computed; the boxplot sketches are filled in the same pass
+    box_sketches = new_box_sketches()
     os.makedirs(os.path.dirname(csv_file_path), exist_ok=True)
-    df.to_csv(csv_file_path, index=False)
+    with open(csv_file_path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = None
+        for _, data in iter_sessions(directory):
+            row = analyze_session(data)
+            if writer is None:
+                writer = csv.DictWriter(csv_file, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
+            add_row_to_box_sketches(box_sketches, row)
+    save_box_sketches(box_sketches, box_sketches_path(csv_file_path))
     print(f"CSV file has been created at {csv_file_path}")
 
 
@@ -309,12 +488,11 @@ def load_action_mappings(csv_file_path):
 
 
 def session_to_human_readable(session):
-    datetime_format = "%Y-%m-%d %H:%M:%S"
-    previous_timestamp = datetime.strptime(session["start_date"], datetime_format)
+    previous_timestamp = timestamp_to_epoch_ms(session["start_date"])
     human_readable_description = []
     for action in session["actions"]:
-        current_timestamp = datetime.strptime(action["timestamp"], datetime_format)
-        time_spent = (current_timestamp - previous_timestamp).total_seconds()
+        current_timestamp = timestamp_to_epoch_ms(action["timestamp"])
+        time_spent = (current_timestamp - previous_timestamp) / 1000
         action_description = f"Time spent: {time_spent} seconds; Action Type: {action['action_type']}; Action Label: {action['action_label']}"
         if action["params"]:
             action_description += f"; Params: {action['params']}"
@@ -323,24 +501,26 @@ def session_to_human_readable(session):
     return "\n".join(human_readable_description)
 
 
+# One action of a human-readable session, as written by session_to_human_readable
+ACTION_LINE = re.compile(
+    r"Time spent: (\d+\.\d+|\d+) seconds; Action Type: (.*?); Action Label: (.*?)(; Params: (.*))?$"
+)
+
+
 def human_readable_to_session(
-    human_readable_str, session_start_date, user_id=-1, end_date=None
+    human_readable_str, session_start_date, user_id=-1, end_date=None, store=None
 ):
-    datetime_format = "%Y-%m-%d %H:%M:%S"
-    start_datetime = datetime.strptime(session_start_date, datetime_format)
+    start_ms = timestamp_to_epoch_ms(session_start_date)
     lines = human_readable_str.strip().split("\n")
     actions = []
-    current_datetime = start_datetime
+    current_ms = start_ms
     for line in lines:
-        match = re.match(
-            r"Time spent: (\d+\.\d+|\d+) seconds; Action Type: (.*?); Action Label: (.*?)(; Params: (.*))?$",
-            line,
-        )
+        match = ACTION_LINE.match(line)
         if not match:
             continue
         time_spent, action_type, action_label, _, params_str = match.groups()
-        current_datetime += timedelta(seconds=float(time_spent))
-        timestamp = current_datetime.strftime(datetime_format)
+        current_ms += round(float(time_spent) * 1000)
+        timestamp = epoch_ms_to_timestamp(current_ms)
         params = {}
         if params_str:
             params_parts = params_str.split("; ")
@@ -355,9 +535,9 @@ def human_readable_to_session(
             "params": params,
         }
         actions.append(action_dict)
-    session_length = (current_datetime - start_datetime).total_seconds()
+    session_length = (current_ms - start_ms) / 1000
     if not end_date:
-        end_date = current_datetime.strftime(datetime_format)
+        end_date = epoch_ms_to_timestamp(current_ms)
     session_dict = {
         "session_length": session_length,
         "user_id": user_id,
@@ -365,23 +545,60 @@ def human_readable_to_session(
         "end_date": end_date,
         "actions": actions,
     }
+    if store is not None:
+        return store.session_from_dict(session_dict)
     return session_dict
 
 
-def load_dataset(directory_path):
+def load_dataset_file(file_path, quarantine):
+    """
+    Decode one session export file, keeping the valid sessions of a partly bad file.
+
+    A file that is not JSON at all is quarantined whole; otherwise every list
+    element that is not a raw session is quarantined with its index.
+    """
+    with open_input(file_path, "rb") as file:
+        file_content = file.read().strip()
+    if not file_content:
+        return []
+    try:
+        return decode_raw_sessions(file_content)
+    except DecodeError:
+        pass
+    # Slow path: only files that failed the typed decode are decoded element by element
+    try:
+        elements = loads(file_content)
+    except DecodeError as error:
+        quarantine.add_error(error, file_path)
+        return []
+    if not isinstance(elements, list):
+        elements = [elements]
+    sessions = []
+    for index, element in enumerate(elements):
+        try:
+            sessions.append(decode(dumps(element), RawSession))
+        except DecodeError as error:
+            quarantine.add(
+                "schema", f"{file_path}[{index}]: {error}", element, line=index
+            )
+    return sessions
+
+
+def load_dataset(directory_path, quarantine_file=None):
+    # A container holds one raw session per line instead of one list per file
+    if is_container(directory_path):
+        return [
+            session
+            for _, session in SessionContainer(directory_path, decode_raw_session)
+        ]
     sessions = []
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-        if os.path.isfile(file_path):
-            with open(file_path, "r", encoding="utf-8") as file:
-                file_content = file.read().strip()
-                if not file_content:
-                    continue
-                try:
-                    session_data = json.loads(file_content)
-                except json.JSONDecodeError:
-                    continue
-            sessions.extend(session_data)
+    with Quarantine(
+        quarantine_file or quarantine_path(directory_path), "dataset_file", directory_path
+    ) as quarantine:
+        for filename in os.listdir(directory_path):
+            file_path = os.path.join(directory_path, filename)
+            if os.path.isfile(file_path):
+                sessions.extend(load_dataset_file(file_path, quarantine))
     return sessions
 
 
@@ -415,8 +632,43 @@ def extract_table_data(data):
     return pd.DataFrame(data)
 
 
+# Function to compute the per-session values aggregated by process_sessions
+def compute_session_metrics(session):
+    actions = session["actions"]
+    lengths_chars, lengths_terms = calculate_query_lengths(actions)
+    query_count = count_queries(actions)
+
+    # Calculate the total number of tokens (terms)
+    total_tokens = sum(
+        len(action["params"].split())
+        for action in actions
+        if action["action_label"]
+        in [
+            "query_form",
+            "searchterm_1",
+            "searchterm_2",
+            "searchterm_3",
+            "searchterm_4",
+        ]
+    )
+
+    return {
+        "session_duration": calculate_session_duration(session),
+        "query_count": query_count,
+        "query_lengths_chars": lengths_chars,
+        "query_lengths_terms": lengths_terms,
+        "term_diversity": calculate_term_diversity(actions),
+        "search_operators_share": calculate_search_operators_share(actions),
+        "query_tokens": calculate_query_tokens(actions),
+        # Ratio of queries to tokens, only defined if total_tokens is not zero
+        "queries_to_tokens_ratio": (
+            query_count / total_tokens if total_tokens > 0 else None
+        ),
+    }
+
+
 # Function to process all sessions and compute statistics
-def process_sessions(data_directory, dataset_name):
+def process_sessions(data_directory, dataset_name, session_ids=None):
     output_file = f"metrics/{dataset_name}/session_metrics_{dataset_name}.txt"
 
     session_durations = []
@@ -426,49 +678,30 @@ def process_sessions(data_directory, dataset_name):
     term_diversities = []
     search_operators_shares = []
     queries_to_tokens_ratios = []
-    all_query_tokens = []
-    query_counts_per_session = []
-
-    for filename in os.listdir(data_directory):
-        if filename.endswith(".json"):
-            with open(os.path.join(data_directory, filename), "r") as file:
-                session = json.load(file)
-                session_durations.append(calculate_session_duration(session))
-                query_counts.append(count_queries(session["actions"]))
-                lengths_chars, lengths_terms = calculate_query_lengths(
-                    session["actions"]
-                )
-                query_lengths_chars.extend(lengths_chars)
-                query_lengths_terms.extend(lengths_terms)
-                term_diversities.append(calculate_term_diversity(session["actions"]))
-                search_operators_shares.append(
-                    calculate_search_operators_share(session["actions"])
-                )
-                query_tokens = calculate_query_tokens(session["actions"])
-                all_query_tokens.extend(query_tokens)
-                query_count = count_queries(session["actions"])
-                query_counts_per_session.append(query_count)
-
-                # Calculate the total number of tokens (terms)
-                total_tokens = sum(
-                    len(action["params"].split())
-                    for action in session["actions"]
-                    if action["action_label"]
-                    in [
-                        "query_form",
-                        "searchterm_1",
-                        "searchterm_2",
-                        "searchterm_3",
-                        "searchterm_4",
-                    ]
-                )
-                # Calculate the ratio of queries to tokens if total_tokens is not zero
-                if total_tokens > 0:
-                    ratio = query_count / total_tokens
-                    queries_to_tokens_ratios.append(ratio)
-
-    capped_query_counts = [min(count, 10) for count in query_counts_per_session]
-    capped_tokens_per_query = [min(tokens, 20) for tokens in all_query_tokens]
+    # Pre-binned histograms of the capped query counts and tokens per query
+    capped_query_counts = Counter()
+    capped_tokens_per_query = Counter()
+    cardinalities = new_cardinality_sketches()
+    heavy_hitters = new_heavy_hitters()
+
+    for _, session in iter_sessions(data_directory, session_ids=session_ids):
+        add_session_to_cardinalities(cardinalities, session)
+        add_session_to_heavy_hitters(heavy_hitters, session)
+        session_metrics = compute_session_metrics(session)
+        session_durations.append(session_metrics["session_duration"])
+        query_counts.append(session_metrics["query_count"])
+        query_lengths_chars.extend(session_metrics["query_lengths_chars"])
+        query_lengths_terms.extend(session_metrics["query_lengths_terms"])
+        term_diversities.append(session_metrics["term_diversity"])
+        search_operators_shares.append(session_metrics["search_operators_share"])
+        capped_tokens_per_query.update(
+            min(tokens, 20) for tokens in session_metrics["query_tokens"]
+        )
+        capped_query_counts[min(session_metrics["query_count"], 10)] += 1
+        if session_metrics["queries_to_tokens_ratio"] is not None:
+            queries_to_tokens_ratios.append(
+                session_metrics["queries_to_tokens_ratio"]
+            )
 
     # Calculate mean, median, and standard deviation for each metric
     metrics = {
@@ -514,31 +747,47 @@ def process_sessions(data_directory, dataset_name):
     # Convert the average duration to "hh:mm" format
     average_duration_hh_mm = minutes_to_hh_mm(average_duration_minutes)
 
-    # Check if the output file already exists before writing
-    if not os.path.exists(output_file):
-        with open(output_file, "w") as f:
-            f.write("Session Metrics Summary:\n")
-            f.write("========================\n")
-            f.write(f"Average Session Duration (hh:mm): {average_duration_hh_mm}\n\n")
-
-            for metric, values in metrics.items():
-                f.write(f"{metric}:\n")
-                if isinstance(values, dict):  # For metrics stored as dictionaries
-                    f.write(f"  Mean    = {values.get('Mean', 0):.2f}\n")
-                    f.write(f"  Median  = {values.get('Median', 0):.2f}\n")
-                    f.write(f"  SD      = {values.get('SD', 0):.2f}\n\n")
-                else:
-                    f.write(
-                        f"  Value   = {values}\n\n"
-                    )  # For metrics stored as single values
-    else:
-        print(f"Skipping writing as {output_file} already exists.")
+    # The summary is rewritten on every run, like the other outputs of this pass
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    write_session_metrics(output_file, metrics, average_duration_hh_mm)
+
+    save_cardinality_sketches(
+        cardinalities, f"metrics/{dataset_name}/cardinality_sketches_{dataset_name}.json"
+    )
+    write_cardinality_report(
+        cardinalities, f"metrics/{dataset_name}/cardinalities_{dataset_name}.csv"
+    )
+    save_heavy_hitters(
+        heavy_hitters, f"metrics/{dataset_name}/heavy_hitters_{dataset_name}.json"
+    )
+    write_heavy_hitters_report(
+        heavy_hitters, f"metrics/{dataset_name}/top_items_{dataset_name}.csv"
+    )
 
     return capped_query_counts, capped_tokens_per_query
 
 
-def categorize_and_compute_stats(data_directory, dataset_name):
-    stats = {
+# Function to write the session metrics summary produced by process_sessions
+def write_session_metrics(output_file, metrics, average_duration_hh_mm):
+    with open(output_file, "w") as f:
+        f.write("Session Metrics Summary:\n")
+        f.write("========================\n")
+        f.write(f"Average Session Duration (hh:mm): {average_duration_hh_mm}\n\n")
+
+        for metric, values in metrics.items():
+            f.write(f"{metric}:\n")
+            if isinstance(values, dict):  # For metrics stored as dictionaries
+                f.write(f"  Mean    = {values.get('Mean', 0):.2f}\n")
+                f.write(f"  Median  = {values.get('Median', 0):.2f}\n")
+                f.write(f"  SD      = {values.get('SD', 0):.2f}\n\n")
+            else:
+                f.write(
+                    f"  Value   = {values}\n\n"
+                )  # For metrics stored as single values
+
+
+def new_topology_stats():
+    return {
         action: {
             "Page Views": 0,
             "Total Time": timedelta(),
@@ -550,36 +799,37 @@ def categorize_and_compute_stats(data_directory, dataset_name):
         for action in action_mappings.keys()
     }
 
-    for filename in sorted(os.listdir(data_directory)):
-
-        if filename.endswith(".json"):
-            with open(os.path.join(data_directory, filename), "r") as file:
-                session_data = json.load(file)
-                actions_in_session = set()
-
-                # Track if the session is a bounce (only one action in the session)
-                is_bounce = len(session_data["actions"]) == 1
-
-                for action in session_data["actions"]:
-                    action_label = action["action_label"]
-                    if action_label in action_mappings:
-                        actions_in_session.add(action_label)
-                        action_length = timedelta(seconds=action["action_length"])
-                        stats[action_label]["Total Time"] += action_length
-                        if action["origin_action"] == "":
-                            stats[action_label]["Entrances"] += 1
-                            stats[action_label][
-                                "Sessions"
-                            ] += 1  # Increment session count for this action
-                        if is_bounce:
-                            stats[action_label]["Bounces"] += 1
-                        # Check if the action is the last in the session for % Exit calculation
-                        if action == session_data["actions"][-1]:
-                            stats[action_label]["Exits"] += 1
-
-                for action_label in actions_in_session:
-                    stats[action_label]["Page Views"] += 1
 
+# Function to add one session's actions to the per-action topology statistics
+def add_session_to_topology_stats(stats, session_data):
+    actions_in_session = set()
+
+    # Track if the session is a bounce (only one action in the session)
+    is_bounce = len(session_data["actions"]) == 1
+
+    for action in session_data["actions"]:
+        action_label = action["action_label"]
+        if action_label in action_mappings:
+            actions_in_session.add(action_label)
+            action_length = timedelta(seconds=action["action_length"])
+            stats[action_label]["Total Time"] += action_length
+            if action["origin_action"] == "":
+                stats[action_label]["Entrances"] += 1
+                stats[action_label][
+                    "Sessions"
+                ] += 1  # Increment session count for this action
+            if is_bounce:
+                stats[action_label]["Bounces"] += 1
+            # Check if the action is the last in the session for % Exit calculation
+            if action == session_data["actions"][-1]:
+                stats[action_label]["Exits"] += 1
+
+    for action_label in actions_in_session:
+        stats[action_label]["Page Views"] += 1
+
+
+# Function to turn the per-action topology statistics into the topology interaction table
+def topology_stats_to_dataframe(stats):
     calculate_bounce_rate(stats)
     # Convert the stats dictionary to a list of dictionaries for DataFrame creation
     stats_list = []
@@ -600,3 +850,12 @@ def categorize_and_compute_stats(data_directory, dataset_name):
         )
 
     return pd.DataFrame(stats_list)
+
+
+def categorize_and_compute_stats(data_directory, dataset_name, session_ids=None):
+    stats = new_topology_stats()
+
+    for _, session_data in iter_sessions(data_directory, session_ids=session_ids):
+        add_session_to_topology_stats(stats, session_data)
+
+    return topology_stats_to_dataframe(stats)
@@ -0,0 +1,312 @@
+import csv
+import json
+import os
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+from analysis.data_processing import action_mappings
+from analysis.session_analysis import categorize_session, count_queries
+from analysis.session_container import SessionContainer, is_container, iter_sessions
+from analysis.utils import (
+    calculate_session_duration,
+    extract_docids,
+    extract_search_terms,
+    extract_session_queries,
+)
+
+OTHER = "other"
+SESSION_FEATURES = (
+    "duration",
+    "actions",
+    "action_time_mean",
+    "queries",
+    "unique_queries",
+    "query_terms_mean",
+    "unique_terms",
+    "unique_docs",
+    "distinct_categories",
+    "category_switches",
+    "exploratory",
+)
+CHUNK_ROWS = 8192  # Rows buffered per write, and per pass when scanning the matrix
+
+
+def feature_columns():
+    """
+    Column names of the feature matrix.
+
+    Session measures, then per-label counts (the labels of action_mappings),
+    per-topology-category counts and category-to-category transition counts.
+    Actions without a topology category count as "other". The columns only
+    depend on action_mappings, so matrices of different datasets line up.
+    """
+    labels = sorted(action_mappings) + [OTHER]
+    categories = sorted(set(action_mappings.values())) + [OTHER]
+    return (
+        list(SESSION_FEATURES)
+        + [f"label:{label}" for label in labels]
+        + [f"category:{category}" for category in categories]
+        + [f"transition:{a}>{b}" for a in categories for b in categories]
+    )
+
+
+def session_features(session, positions, row):
+    """Fill a zeroed row with the features of a session; positions maps column names to indices."""
+    actions = session["actions"]
+    queries = extract_session_queries(actions)
+    categories = [action_mappings.get(action["action_label"], OTHER) for action in actions]
+
+    row[positions["duration"]] = calculate_session_duration(session)
+    row[positions["actions"]] = len(actions)
+    if actions:
+        row[positions["action_time_mean"]] = sum(
+            action.get("action_length") or 0 for action in actions
+        ) / len(actions)
+    row[positions["queries"]] = count_queries(actions)
+    row[positions["unique_queries"]] = len(set(queries))
+    if queries:
+        row[positions["query_terms_mean"]] = sum(len(query.split()) for query in queries) / len(
+            queries
+        )
+    row[positions["unique_terms"]] = len(extract_search_terms(actions))
+    row[positions["unique_docs"]] = len(extract_docids(actions))
+    row[positions["distinct_categories"]] = len(set(categories))
+    row[positions["exploratory"]] = categorize_session(session) == "Exploratory"
+
+    for action in actions:
+        label = action["action_label"]
+        row[positions[f"label:{label if label in action_mappings else OTHER}"]] += 1
+    for category in categories:
+        row[positions[f"category:{category}"]] += 1
+    for previous, current in zip(categories, categories[1:]):
+        row[positions[f"transition:{previous}>{current}"]] += 1
+        if previous != current:
+            row[positions["category_switches"]] += 1
+
+
+def _count_sessions(source):
+    if is_container(source):
+        return len(SessionContainer(source))
+    return sum(1 for filename in os.listdir(source) if filename.endswith(".json"))
+
+
+# Function to extract the feature matrix of a session directory or container in one streaming pass
+def build_features(source, directory, session_ids=None):
+    """
+    Write the feature matrix of a dataset to ``directory``.
+
+    - ``features.npy``: float32 matrix, one row per session, written through
+      a memory map so the matrix is never held in memory,
+    - ``ids.txt``: the session id of every row, in row order,
+    - ``features.json``: the column names and the number of sessions.
+
+    The files are replaced only once the pass has finished.
+    """
+    columns = feature_columns()
+    positions = {column: index for index, column in enumerate(columns)}
+    count = len(session_ids) if session_ids is not None else _count_sessions(source)
+    os.makedirs(directory, exist_ok=True)
+    matrix_path = os.path.join(directory, "features.npy")
+    temporary_path = f"{matrix_path}.tmp.{os.getpid()}.npy"
+    matrix = open_memmap(temporary_path, mode="w+", dtype=np.float32, shape=(count, len(columns)))
+
+    started = time.perf_counter()
+    buffer = np.zeros((CHUNK_ROWS, len(columns)), dtype=np.float32)
+    ids = []
+    filled = 0
+    for session_id, session in iter_sessions(source, session_ids=session_ids):
+        session_features(session, positions, buffer[len(ids) - filled])
+        ids.append(session_id)
+        if len(ids) - filled == CHUNK_ROWS:
+            matrix[filled : len(ids)] = buffer
+            buffer.fill(0)
+            filled = len(ids)
+    matrix[filled : len(ids)] = buffer[: len(ids) - filled]
+    matrix.flush()
+    del matrix
+    if len(ids) != count:
+        # Files added or removed while the pass ran
+        os.remove(temporary_path)
+        raise RuntimeError(f"Expected {count} sessions in {source}, read {len(ids)}")
+
+    os.replace(temporary_path, matrix_path)
+    with open(os.path.join(directory, "ids.txt"), "w", encoding="utf-8") as file:
+        file.writelines(f"{session_id}\n" for session_id in ids)
+    with open(os.path.join(directory, "features.json"), "w") as file:
+        json.dump({"format": 1, "source": source, "sessions": count, "columns": columns}, file)
+    print(
+        f"Extracted {len(columns)} features of {count} sessions to {matrix_path} "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return count
+
+
+class FeatureMatrix:
+    """Read-only access to a feature matrix written by build_features, memory-mapped."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "features.json"), "r") as file:
+            meta = json.load(file)
+        self.columns = meta["columns"]
+        self.matrix = np.load(os.path.join(directory, "features.npy"), mmap_mode="r")
+        self._ids = None
+        self._rows = None
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            with open(os.path.join(self.directory, "ids.txt"), "r", encoding="utf-8") as file:
+                self._ids = file.read().split("\n")[:-1]
+        return self._ids
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def row(self, session_id):
+        if self._rows is None:
+            self._rows = {session_id: row for row, session_id in enumerate(self.ids)}
+        return self.matrix[self._rows[str(session_id)]]
+
+    def column(self, name):
+        return self.matrix[:, self.columns.index(name)]
+
+    def select(self, prefixes=None):
+        """Indices of the columns starting with one of the prefixes (all columns without prefixes)."""
+        if not prefixes:
+            return list(range(len(self.columns)))
+        return [
+            index
+            for index, column in enumerate(self.columns)
+            if any(column.startswith(prefix) for prefix in prefixes)
+        ]
+
+
+def _chunks(count, size=CHUNK_ROWS):
+    for start in range(0, count, size):
+        yield start, min(start + size, count)
+
+
+def _nearest(points, centers):
+    # Squared distances without the |x|^2 term, which does not change the argmin
+    distances = (centers * centers).sum(axis=1) - 2 * points @ centers.T
+    return distances.argmin(axis=1)
+
+
+def minibatch_kmeans(
+    features, k, column_indices=None, batch_size=1024, iterations=100, seed=0, log_scale=True
+):
+    """
+    Cluster the rows of a FeatureMatrix with mini-batch k-means, reading it in chunks.
+
+    Counts are log1p-scaled (``log_scale``) and every column standardized,
+    with means and deviations from one chunked pass. Centers start from
+    k-means++ on a sample and are updated per batch with a per-center learning
+    rate of 1 / (rows assigned so far), as in Sculley's web-scale k-means.
+
+    Returns (labels, centers, inertia); labels is an int32 array with one
+    cluster per row and centers are in the scaled space.
+    """
+    matrix = features.matrix
+    count = matrix.shape[0]
+    if column_indices is None:
+        column_indices = list(range(matrix.shape[1]))
+    if count < k:
+        raise ValueError(f"Cannot form {k} clusters from {count} sessions")
+    rng = np.random.default_rng(seed)
+
+    def transform(rows):
+        values = np.asarray(rows[:, column_indices], dtype=np.float64)
+        return np.log1p(np.maximum(values, 0)) if log_scale else values
+
+    total = np.zeros(len(column_indices))
+    total_squares = np.zeros(len(column_indices))
+    for start, end in _chunks(count):
+        values = transform(matrix[start:end])
+        total += values.sum(axis=0)
+        total_squares += (values * values).sum(axis=0)
+    mean = total / count
+    scale = np.sqrt(np.maximum(total_squares / count - mean * mean, 0))
+    scale[scale == 0] = 1
+
+    def scaled(rows):
+        return (transform(rows) - mean) / scale
+
+    def sample(size):
+        # Sorted indices keep the reads of the memory map in file order
+        return scaled(matrix[np.sort(rng.choice(count, size=min(size, count), replace=False))])
+
+    # k-means++ seeding
+    points = sample(max(10 * k, batch_size))
+    centers = [points[rng.integers(len(points))]]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        weights = closest / closest.sum() if closest.sum() > 0 else None
+        centers.append(points[rng.choice(len(points), p=weights)])
+        closest = np.minimum(closest, ((points - centers[-1]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    assigned = np.zeros(k)
+    for _ in range(iterations):
+        batch = sample(batch_size)
+        nearest = _nearest(batch, centers)
+        for cluster in np.unique(nearest):
+            members = batch[nearest == cluster]
+            # Equivalent to applying the 1 / count updates one row at a time
+            centers[cluster] = (assigned[cluster] * centers[cluster] + members.sum(axis=0)) / (
+                assigned[cluster] + len(members)
+            )
+            assigned[cluster] += len(members)
+
+    labels = np.empty(count, dtype=np.int32)
+    inertia = 0.0
+    for start, end in _chunks(count):
+        points = scaled(matrix[start:end])
+        labels[start:end] = _nearest(points, centers)
+        inertia += ((points - centers[labels[start:end]]) ** 2).sum()
+    return labels, centers, inertia
+
+
+# Function to cluster the sessions of a feature matrix and report the clusters in feature units
+def cluster_sessions(
+    directory,
+    k,
+    report_path,
+    prefixes=None,
+    batch_size=1024,
+    iterations=100,
+    seed=0,
+):
+    features = FeatureMatrix(directory)
+    column_indices = features.select(prefixes)
+    started = time.perf_counter()
+    labels, _, inertia = minibatch_kmeans(
+        features, k, column_indices, batch_size, iterations, seed
+    )
+    elapsed = time.perf_counter() - started
+
+    # Cluster means over all columns, so clusters can be read against every feature
+    sums = np.zeros((k, len(features.columns)))
+    for start, end in _chunks(len(features)):
+        rows, chunk_labels = features.matrix[start:end], labels[start:end]
+        for cluster in range(k):
+            sums[cluster] += rows[chunk_labels == cluster].sum(axis=0)
+    sizes = np.bincount(labels, minlength=k)
+    means = sums / np.maximum(sizes, 1)[:, None]
+
+    labels_path = os.path.join(directory, f"clusters_k{k}.npy")
+    np.save(labels_path, labels)
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["cluster", "sessions"] + features.columns)
+        for cluster in range(k):
+            writer.writerow(
+                [cluster, int(sizes[cluster])] + [f"{value:.4g}" for value in means[cluster]]
+            )
+    print(
+        f"Clustered {len(features)} sessions on {len(column_indices)} features into {k} clusters "
+        f"in {elapsed:.1f}s (inertia {inertia:.1f}); labels saved to {labels_path}, "
+        f"cluster means to {report_path}"
+    )
+    return labels
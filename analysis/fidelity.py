@@ -0,0 +1,146 @@
+import csv
+import hashlib
+import json
+import os
+from analysis.codec import read_session
+from analysis.data_processing import analyze_session, compute_session_metrics
+from analysis.sketches import (
+    QuantileSketch,
+    kl_divergence,
+    js_divergence,
+    wasserstein_distance,
+    ks_statistic,
+)
+
+
+# Metrics of process_sessions, keyed by report name -> compute_session_metrics field
+SESSION_METRICS = {
+    "Session Duration (minutes)": "session_duration",
+    "Query Count": "query_count",
+    "Query Length (#chars)": "query_lengths_chars",
+    "Query Length (#terms)": "query_lengths_terms",
+    "Term Diversity": "term_diversity",
+    "Search Operators Share": "search_operators_share",
+    "Tokens per Query": "query_tokens",
+    "Queries to Tokens Ratio": "queries_to_tokens_ratio",
+}
+
+# Metrics of process_sessions_to_csv, keyed by CSV column
+CLASSIFICATION_METRICS = [
+    "search_depth",
+    "results_pageviews",
+    "search_duration",
+    "percent_search_refinements",
+    "query_length",
+]
+
+
+def new_metric_sketches(relative_accuracy=0.01):
+    return {
+        name: QuantileSketch(relative_accuracy)
+        for name in list(SESSION_METRICS) + CLASSIFICATION_METRICS
+    }
+
+
+# Function to add one session's metrics to the per-metric sketches
+def add_session_to_sketches(sketches, session):
+    session_metrics = compute_session_metrics(session)
+    for name, field in SESSION_METRICS.items():
+        value = session_metrics[field]
+        if isinstance(value, list):
+            sketches[name].update(value)
+        elif value is not None:
+            sketches[name].add(value)
+    row = analyze_session(session)
+    for name in CLASSIFICATION_METRICS:
+        sketches[name].add(row[name])
+
+
+# Function to build metric sketches for a directory of session JSON files in one pass
+def build_metric_sketches(data_directory, relative_accuracy=0.01):
+    sketches = new_metric_sketches(relative_accuracy)
+    for filename in os.listdir(data_directory):
+        if filename.endswith(".json"):
+            session = read_session(os.path.join(data_directory, filename))
+            add_session_to_sketches(sketches, session)
+    return sketches
+
+
+def merge_metric_sketches(sketches, other):
+    for name, sketch in other.items():
+        if name in sketches:
+            sketches[name].merge(sketch)
+        else:
+            sketches[name] = sketch
+    return sketches
+
+
+def directory_fingerprint(data_directory):
+    """Hash of the names, sizes and mtimes of the session files of a directory."""
+    digest = hashlib.sha1()
+    for entry in sorted(os.scandir(data_directory), key=lambda entry: entry.name):
+        if entry.name.endswith(".json") and entry.is_file():
+            stat = entry.stat()
+            digest.update(f"{entry.name}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def save_metric_sketches(sketches, file_path, fingerprint=None):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as file:
+        json.dump(
+            {
+                "fingerprint": fingerprint,
+                "sketches": {name: sketch.to_dict() for name, sketch in sketches.items()},
+            },
+            file,
+        )
+
+
+def load_metric_sketches(file_path, fingerprint=None):
+    """
+    Load saved metric sketches; with a fingerprint, return None unless they
+    were built from a directory with the same fingerprint.
+    """
+    with open(file_path, "r") as file:
+        data = json.load(file)
+    # Files written before fingerprints were stored hold the sketches at the top level
+    if "sketches" not in data:
+        return None if fingerprint is not None else {
+            name: QuantileSketch.from_dict(sketch) for name, sketch in data.items()
+        }
+    if fingerprint is not None and data["fingerprint"] != fingerprint:
+        return None
+    return {
+        name: QuantileSketch.from_dict(sketch) for name, sketch in data["sketches"].items()
+    }
+
+
+# Function to compare two datasets metric by metric and write the distances to CSV
+def write_fidelity_report(reference_sketches, candidate_sketches, output_csv_path):
+    rows = []
+    for name, reference in reference_sketches.items():
+        candidate = candidate_sketches.get(name)
+        if candidate is None:
+            continue
+        rows.append(
+            {
+                "Metric": name,
+                "Reference N": reference.count,
+                "Candidate N": candidate.count,
+                "Reference Median": f"{reference.quantile(0.5):.2f}",
+                "Candidate Median": f"{candidate.quantile(0.5):.2f}",
+                "KL Divergence": f"{kl_divergence(candidate, reference):.4f}",
+                "JS Divergence": f"{js_divergence(reference, candidate):.4f}",
+                "Wasserstein": f"{wasserstein_distance(reference, candidate):.4f}",
+                "KS Statistic": f"{ks_statistic(reference, candidate):.4f}",
+            }
+        )
+
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    with open(output_csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]) if rows else ["Metric"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Fidelity report saved to {output_csv_path}")
+    return rows
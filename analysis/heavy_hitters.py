@@ -0,0 +1,96 @@
+import csv
+import json
+import os
+from analysis.sketches import SpaceSaving
+from analysis.utils import action_docid, action_queries, rewrite_query
+
+
+HEAVY_HITTER_FIELDS = ("queries", "documents", "labels", "resultlistids")
+
+
+def new_heavy_hitters(capacity=1000):
+    return {field: SpaceSaving(capacity) for field in HEAVY_HITTER_FIELDS}
+
+
+# Function to normalize a query the way EconBiz queries are rewritten in parse_sessions
+def normalize_query(query):
+    return rewrite_query(query).lower()
+
+
+# Function to extract the queries, documents, labels and result list ids of one session
+def session_heavy_hitter_items(session):
+    items = {field: [] for field in HEAVY_HITTER_FIELDS}
+    for action in session["actions"]:
+        items["labels"].append(action["action_label"])
+        for query in action_queries(action):
+            query = normalize_query(query)
+            if query:
+                items["queries"].append(query)
+        docid = action_docid(action)
+        if docid is not None:
+            items["documents"].append(docid)
+        params = action.get("params", "")
+        if action["action_label"] == "resultlistids" and isinstance(params, str):
+            items["resultlistids"].extend(item for item in params.split(",") if item)
+    return items
+
+
+def add_items_to_heavy_hitters(heavy_hitters, items):
+    for field, values in items.items():
+        heavy_hitters[field].update(values)
+
+
+def add_session_to_heavy_hitters(heavy_hitters, session):
+    add_items_to_heavy_hitters(heavy_hitters, session_heavy_hitter_items(session))
+
+
+def merge_heavy_hitters(heavy_hitters, other):
+    for field, sketch in other.items():
+        heavy_hitters[field].merge(sketch)
+    return heavy_hitters
+
+
+def save_heavy_hitters(heavy_hitters, file_path):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as file:
+        json.dump(
+            {field: sketch.to_dict() for field, sketch in heavy_hitters.items()},
+            file,
+            separators=(",", ":"),
+        )
+
+
+def load_heavy_hitters(file_path):
+    with open(file_path, "r") as file:
+        return {
+            field: SpaceSaving.from_dict(data) for field, data in json.load(file).items()
+        }
+
+
+# Function to write the top-N items of every field with their error bounds to CSV
+def write_heavy_hitters_report(heavy_hitters, output_csv_path, top_n=50):
+    rows = []
+    for field, sketch in heavy_hitters.items():
+        for rank, (item, count, error) in enumerate(sketch.top(top_n), start=1):
+            rows.append(
+                {
+                    "field": field,
+                    "rank": rank,
+                    "item": item,
+                    "count": count,
+                    "error": error,
+                    "guaranteed_count": count - error,
+                    "share": f"{count / sketch.total:.4f}" if sketch.total else "0",
+                }
+            )
+
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    with open(output_csv_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(
+            file,
+            fieldnames=["field", "rank", "item", "count", "error", "guaranteed_count", "share"],
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Heavy hitters saved to {output_csv_path}")
+    return rows
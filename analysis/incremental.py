@@ -0,0 +1,297 @@
+import csv
+import hashlib
+import json
+import os
+from collections import Counter
+from datetime import timedelta
+from analysis.codec import read_session
+from analysis.box_stats import add_row_to_box_sketches
+from analysis.cardinality import (
+    add_values_to_cardinalities,
+    new_cardinality_sketches,
+    session_distinct_values,
+)
+from analysis.data_processing import (
+    SESSION_ANALYSIS_FIELDS,
+    add_session_to_topology_stats,
+    analyze_session,
+    compute_session_metrics,
+    new_topology_stats,
+)
+from analysis.heavy_hitters import (
+    add_items_to_heavy_hitters,
+    new_heavy_hitters,
+    session_heavy_hitter_items,
+)
+from analysis.mapreduce import (
+    load_partial,
+    new_partial,
+    partition_of,
+    save_partial,
+    session_analysis_csv_path,
+    write_partial_outputs,
+)
+
+CONTRIBUTION_SHARDS = 256
+
+
+def content_hash(file_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Function to compute everything one session file contributes to the aggregates
+def session_contribution(session):
+    session_metrics = compute_session_metrics(session)
+    stats = new_topology_stats()
+    add_session_to_topology_stats(stats, session)
+    topology = {}
+    for action, data in stats.items():
+        delta = {
+            key: value.total_seconds() if key == "Total Time" else value
+            for key, value in data.items()
+            if value
+        }
+        if delta:
+            topology[action] = delta
+    return {
+        "metrics": session_metrics,
+        "topology": topology,
+        "row": analyze_session(session),
+        "start_date": session.get("start_date"),
+        "distinct": {
+            field: sorted(values)
+            for field, values in session_distinct_values(session).items()
+        },
+        "items": session_heavy_hitter_items(session),
+    }
+
+
+# Function to add (sign=1) or retract (sign=-1) a contribution from the retractable aggregates
+def apply_contribution(partial, contribution, sign):
+    partial["sessions"] += sign
+    session_metrics = contribution["metrics"]
+    for field, sketch in partial["session_metrics"].items():
+        value = session_metrics[field]
+        values = value if isinstance(value, list) else [value]
+        for value in values:
+            if sign > 0:
+                sketch.add(value)
+            else:
+                sketch.remove(value)
+    partial["capped_query_counts"][min(session_metrics["query_count"], 10)] += sign
+    for tokens in session_metrics["query_tokens"]:
+        partial["capped_tokens_per_query"][min(tokens, 20)] += sign
+    for action, delta in contribution["topology"].items():
+        for name, value in delta.items():
+            if name == "Total Time":
+                value = timedelta(seconds=value)
+            partial["topology"][action][name] += value * sign
+    add_row_to_box_sketches(partial["box_sketches"], contribution["row"], sign)
+    if sign > 0:
+        add_values_to_cardinalities(
+            partial["cardinalities"], contribution["distinct"], contribution["start_date"]
+        )
+        add_items_to_heavy_hitters(partial["heavy_hitters"], contribution["items"])
+
+
+def _shard_path(state_dir, shard):
+    return os.path.join(state_dir, "contributions", f"{shard:03d}.json")
+
+
+def _load_json(file_path, default):
+    if not os.path.exists(file_path):
+        return default
+    with open(file_path, "r") as file:
+        return json.load(file)
+
+
+def _save_json(data, file_path):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = f"{file_path}.tmp.{os.getpid()}"
+    with open(temporary_path, "w") as file:
+        json.dump(data, file, separators=(",", ":"))
+    os.replace(temporary_path, file_path)
+
+
+def _csv_state_path(state_dir):
+    return os.path.join(state_dir, "csv_state.json")
+
+
+# Function to check that the sessions analysis CSV still holds the rows of the stored contributions
+def _csv_in_sync(csv_file_path, state_dir):
+    """
+    The CSV is out of sync when it is missing, was rewritten by another command
+    (its size or mtime changed) or an incremental run stopped between saving
+    its state and updating the CSV (the state is still pending).
+    """
+    csv_state = _load_json(_csv_state_path(state_dir), None)
+    if csv_state is None or csv_state["pending"] or not os.path.exists(csv_file_path):
+        return False
+    stat = os.stat(csv_file_path)
+    return [stat.st_size, stat.st_mtime_ns] == [csv_state["size"], csv_state["mtime_ns"]]
+
+
+def _save_csv_state(csv_file_path, state_dir, pending):
+    stat = os.stat(csv_file_path) if os.path.exists(csv_file_path) else None
+    _save_json(
+        {
+            "size": stat.st_size if stat else None,
+            "mtime_ns": stat.st_mtime_ns if stat else None,
+            "pending": pending,
+        },
+        _csv_state_path(state_dir),
+    )
+
+
+# Function to bring the sessions analysis CSV up to date with the added and retracted rows
+def _update_rows_csv(csv_file_path, in_sync, added_rows, retracted_rows, all_rows):
+    """
+    Added rows are appended and retracted rows are filtered out of the existing
+    CSV, so the contribution shards are only read back when it is out of sync.
+    """
+    os.makedirs(os.path.dirname(csv_file_path), exist_ok=True)
+    if not in_sync:
+        with open(csv_file_path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=SESSION_ANALYSIS_FIELDS)
+            writer.writeheader()
+            writer.writerows(all_rows())
+    elif retracted_rows:
+        # One row is dropped per retracted row, as two files may hold the same session id
+        retracted = Counter(row["session_id"] for row in retracted_rows)
+        temporary_path = f"{csv_file_path}.tmp.{os.getpid()}"
+        with open(csv_file_path, "r", newline="", encoding="utf-8") as source, open(
+            temporary_path, "w", newline="", encoding="utf-8"
+        ) as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target)
+            writer.writerow(next(reader))
+            for row in reader:
+                if retracted[row[0]] > 0:
+                    retracted[row[0]] -= 1
+                    continue
+                writer.writerow(row)
+            csv.DictWriter(target, fieldnames=SESSION_ANALYSIS_FIELDS).writerows(added_rows)
+        os.replace(temporary_path, csv_file_path)
+    else:
+        with open(csv_file_path, "a", newline="", encoding="utf-8") as csv_file:
+            csv.DictWriter(csv_file, fieldnames=SESSION_ANALYSIS_FIELDS).writerows(added_rows)
+    print(f"CSV file has been updated at {csv_file_path}")
+
+
+def run_incremental(data_directory, dataset_name, state_dir=None):
+    """
+    Update the metric outputs of a dataset for the session files changed since the last run.
+
+    The state directory keeps a manifest of the input files (size, mtime,
+    content hash), the persisted aggregate and every file's contribution,
+    sharded by session id. New files are added, deleted files are retracted
+    and changed files are both. Quantile sketches, counters and topology stats
+    are updated in place; the distinct-count and heavy-hitter sketches cannot
+    retract, so they are rebuilt from the stored contributions when a file was
+    removed or changed. That rebuild reads every contribution shard (not the
+    session files), so a run with retractions costs a pass over the state
+    directory. The sessions analysis CSV is appended to, and filtered in a
+    single pass when rows were retracted.
+    """
+    state_dir = state_dir or f"logs/{dataset_name}/incremental/"
+    manifest_path = os.path.join(state_dir, "manifest.json")
+    partial_file = os.path.join(state_dir, "aggregate.json")
+    manifest = _load_json(manifest_path, {})
+    if os.path.exists(partial_file):
+        partial = load_partial(partial_file)
+    else:
+        partial = new_partial()
+
+    current = {
+        entry.name: entry.stat()
+        for entry in os.scandir(data_directory)
+        if entry.name.endswith(".json") and entry.is_file()
+    }
+    retract = [filename for filename in manifest if filename not in current]
+    add = []
+    for filename, stat in current.items():
+        known = manifest.get(filename)
+        if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            continue
+        file_hash = content_hash(os.path.join(data_directory, filename))
+        if known and known["hash"] == file_hash:
+            known["mtime_ns"] = stat.st_mtime_ns
+            continue
+        if known:
+            retract.append(filename)
+        add.append((filename, stat, file_hash))
+
+    shards = {}
+
+    def shard_of(filename):
+        shard = partition_of(filename[: -len(".json")], CONTRIBUTION_SHARDS)
+        if shard not in shards:
+            shards[shard] = _load_json(_shard_path(state_dir, shard), {})
+        return shards[shard]
+
+    retracted_rows = []
+    for filename in retract:
+        contribution = shard_of(filename).pop(filename, None)
+        if contribution is not None:
+            apply_contribution(partial, contribution, -1)
+            retracted_rows.append(contribution["row"])
+        manifest.pop(filename, None)
+
+    added_rows = []
+
+    for filename, stat, file_hash in add:
+        session = read_session(os.path.join(data_directory, filename))
+        contribution = session_contribution(session)
+        apply_contribution(partial, contribution, 1)
+        shard_of(filename)[filename] = contribution
+        added_rows.append(contribution["row"])
+        manifest[filename] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": file_hash,
+        }
+
+    if retract:
+        partial["cardinalities"] = new_cardinality_sketches()
+        partial["heavy_hitters"] = new_heavy_hitters()
+        for shard in range(CONTRIBUTION_SHARDS):
+            contributions = shards.get(shard)
+            if contributions is None:
+                contributions = _load_json(_shard_path(state_dir, shard), {})
+            for contribution in contributions.values():
+                add_values_to_cardinalities(
+                    partial["cardinalities"],
+                    contribution["distinct"],
+                    contribution["start_date"],
+                )
+                add_items_to_heavy_hitters(partial["heavy_hitters"], contribution["items"])
+
+    csv_file_path = session_analysis_csv_path(dataset_name)
+    csv_in_sync = _csv_in_sync(csv_file_path, state_dir)
+    _save_csv_state(csv_file_path, state_dir, pending=True)
+    for shard, contributions in shards.items():
+        _save_json(contributions, _shard_path(state_dir, shard))
+    save_partial(partial, partial_file)
+    _save_json(manifest, manifest_path)
+    print(
+        f"{dataset_name}: {len(add)} session files added or changed, "
+        f"{len(retract)} retracted, {partial['sessions']} sessions in total."
+    )
+
+    def rows():
+        # The rows are streamed shard by shard from the stored contributions
+        for shard in range(CONTRIBUTION_SHARDS):
+            contributions = shards.get(shard)
+            if contributions is None:
+                contributions = _load_json(_shard_path(state_dir, shard), {})
+            for key in sorted(contributions):
+                yield contributions[key]["row"]
+
+    write_partial_outputs(partial, dataset_name, rows=None)
+    _update_rows_csv(csv_file_path, csv_in_sync, added_rows, retracted_rows, rows)
+    _save_csv_state(csv_file_path, state_dir, pending=False)
+    return +partial["capped_query_counts"], +partial["capped_tokens_per_query"]
@@ -0,0 +1,412 @@
+import bisect
+import heapq
+import json
+import mmap
+import os
+import re
+import zlib
+from array import array
+from itertools import accumulate
+from analysis.codec import read_session
+from analysis.utils import extract_docids, extract_search_terms, rewrite_query
+
+INDEX_FIELDS = ("term", "doc")
+TERMS_INDEX_INTERVAL = 128  # Every n-th key of a segment is kept in memory
+QUERY_TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+def session_keys(session):
+    """The index keys of a session: its normalized search terms and viewed document ids."""
+    actions = session["actions"]
+    keys = {f"term:{term}" for term in extract_search_terms(actions)}
+    keys.update(f"doc:{docid}" for docid in extract_docids(actions))
+    # Keys are stored one per line with tab separators
+    return {key for key in keys if not set(key) & {"\t", "\n", "\r"}}
+
+
+def encode_postings(docnums):
+    """Delta-encode sorted session numbers as uint32 gaps and compress them."""
+    gaps = array("I", [docnums[0]])
+    gaps.extend(current - previous for previous, current in zip(docnums, docnums[1:]))
+    return zlib.compress(gaps.tobytes())
+
+
+def decode_postings(data):
+    gaps = array("I")
+    gaps.frombytes(zlib.decompress(data))
+    return list(accumulate(gaps))
+
+
+class Segment:
+    """
+    An immutable index segment.
+
+    ``<name>.post`` holds the compressed posting lists back to back and
+    ``<name>.terms`` lists ``key<TAB>offset<TAB>length<TAB>count`` in key
+    order. Every TERMS_INDEX_INTERVAL-th key and its line offset are kept in
+    memory, so a lookup bisects that sample and scans one block of the
+    memory-mapped terms file.
+    """
+
+    def __init__(self, directory, name, sample):
+        self.directory = directory
+        self.name = name
+        self.sample_keys = [key for key, _ in sample]
+        self.sample_offsets = [offset for _, offset in sample]
+        self._terms = None
+        self._postings = None
+
+    def _map(self, suffix):
+        with open(os.path.join(self.directory, f"{self.name}.{suffix}"), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def terms(self):
+        if self._terms is None:
+            self._terms = self._map("terms")
+        return self._terms
+
+    @property
+    def postings_data(self):
+        if self._postings is None:
+            self._postings = self._map("post")
+        return self._postings
+
+    def entry(self, key):
+        """Return (offset, length, count) of a key, or None."""
+        block = bisect.bisect_right(self.sample_keys, key) - 1
+        if block < 0:
+            return None
+        start = self.sample_offsets[block]
+        end = (
+            self.sample_offsets[block + 1]
+            if block + 1 < len(self.sample_offsets)
+            else len(self.terms)
+        )
+        encoded = key.encode("utf-8")
+        for line in self.terms[start:end].splitlines():
+            line_key, offset, length, count = line.split(b"\t")
+            if line_key == encoded:
+                return int(offset), int(length), int(count)
+            if line_key > encoded:
+                return None
+        return None
+
+    def postings(self, key):
+        entry = self.entry(key)
+        if entry is None:
+            return []
+        offset, length, _ = entry
+        return decode_postings(self.postings_data[offset : offset + length])
+
+    def items(self):
+        """Yield (key, docnums) in key order."""
+        for line in self.terms[:].splitlines():
+            key, offset, length, _ = line.split(b"\t")
+            offset, length = int(offset), int(length)
+            yield key.decode("utf-8"), decode_postings(
+                self.postings_data[offset : offset + length]
+            )
+
+    def close(self):
+        for mapped in (self._terms, self._postings):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._terms = self._postings = None
+
+
+def write_segment(directory, name, postings):
+    """Write (key, sorted docnums) pairs in key order as a segment and return its metadata."""
+    sample = []
+    offset = 0
+    line_offset = 0
+    keys = 0
+    with open(os.path.join(directory, f"{name}.post"), "wb") as post_file, open(
+        os.path.join(directory, f"{name}.terms"), "wb"
+    ) as terms_file:
+        for key, docnums in postings:
+            data = encode_postings(docnums)
+            post_file.write(data)
+            line = f"{key}\t{offset}\t{len(data)}\t{len(docnums)}\n".encode("utf-8")
+            if keys % TERMS_INDEX_INTERVAL == 0:
+                sample.append((key, line_offset))
+            terms_file.write(line)
+            line_offset += len(line)
+            offset += len(data)
+            keys += 1
+    return {"name": name, "keys": keys, "sample": sample}
+
+
+class InvertedIndex:
+    """
+    On-disk inverted index from normalized query terms and document ids to sessions.
+
+    Sessions are numbered in ingest order (``ids.txt``). Each update writes
+    new segments with the postings of the added session files; removed or
+    changed files are tombstoned and dropped from the postings when segments
+    are merged. While more than ``merge_factor`` segments exist, the newest
+    ones are merged into one, so a lookup reads at most ``merge_factor``
+    segments.
+    """
+
+    def __init__(self, directory, merge_factor=8):
+        self.directory = directory
+        self.merge_factor = merge_factor
+        os.makedirs(directory, exist_ok=True)
+        state = self._load("state.json", {"segments": [], "deleted": [], "next_segment": 0})
+        self.segment_meta = state["segments"]
+        self.deleted = set(state["deleted"])
+        self.next_segment = state["next_segment"]
+        self._manifest = None
+        self.segments = [
+            Segment(directory, meta["name"], meta["sample"]) for meta in self.segment_meta
+        ]
+        self._ids = None
+
+    def _load(self, filename, default):
+        file_path = os.path.join(self.directory, filename)
+        if not os.path.exists(file_path):
+            return default
+        with open(file_path, "r") as file:
+            return json.load(file)
+
+    def _save(self, filename, data):
+        file_path = os.path.join(self.directory, filename)
+        temporary_path = f"{file_path}.tmp.{os.getpid()}"
+        with open(temporary_path, "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+        os.replace(temporary_path, file_path)
+
+    def _save_state(self):
+        self._save(
+            "state.json",
+            {
+                "segments": self.segment_meta,
+                "deleted": sorted(self.deleted),
+                "next_segment": self.next_segment,
+            },
+        )
+
+    @property
+    def manifest(self):
+        # Only needed to update the index and to evaluate NOT
+        if self._manifest is None:
+            self._manifest = self._load("manifest.json", {})
+        return self._manifest
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            ids_path = os.path.join(self.directory, "ids.txt")
+            if os.path.exists(ids_path):
+                with open(ids_path, "r", encoding="utf-8") as file:
+                    self._ids = file.read().split("\n")[:-1]
+            else:
+                self._ids = []
+        return self._ids
+
+    def __len__(self):
+        return len(self.manifest)
+
+    def _flush(self, postings):
+        if not postings:
+            return
+        name = f"segment-{self.next_segment:05d}"
+        self.next_segment += 1
+        meta = write_segment(self.directory, name, sorted(postings.items()))
+        self.segment_meta.append(meta)
+        self.segments.append(Segment(self.directory, name, meta["sample"]))
+
+    def update(self, data_directory, segment_sessions=100_000):
+        """Index new and changed session files of a directory and tombstone removed ones."""
+        current = {
+            entry.name: entry.stat()
+            for entry in os.scandir(data_directory)
+            if entry.name.endswith(".json") and entry.is_file()
+        }
+        removed = 0
+        for filename in list(self.manifest):
+            stat = current.get(filename)
+            size, mtime_ns, docnum = self.manifest[filename]
+            if stat is None or (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.deleted.add(docnum)
+                del self.manifest[filename]
+                removed += 1
+
+        ids = self.ids
+        added = 0
+        postings = {}
+        with open(os.path.join(self.directory, "ids.txt"), "a", encoding="utf-8") as ids_file:
+            for filename in sorted(current):
+                if filename in self.manifest:
+                    continue
+                session = read_session(os.path.join(data_directory, filename))
+                session_id = filename[: -len(".json")]
+                docnum = len(ids)
+                ids.append(session_id)
+                ids_file.write(f"{session_id}\n")
+                for key in session_keys(session):
+                    postings.setdefault(key, []).append(docnum)
+                stat = current[filename]
+                self.manifest[filename] = [stat.st_size, stat.st_mtime_ns, docnum]
+                added += 1
+                if added % segment_sessions == 0:
+                    ids_file.flush()
+                    self._flush(postings)
+                    postings = {}
+        self._flush(postings)
+        while len(self.segments) > self.merge_factor:
+            self.merge(self.merge_factor)
+        self._save("manifest.json", self.manifest)
+        self._save_state()
+        print(
+            f"Indexed {added} sessions, removed {removed}; "
+            f"{len(self.manifest)} sessions in {len(self.segments)} segments."
+        )
+        return added, removed
+
+    def merge(self, count=None):
+        """
+        Merge the newest ``count`` segments (all by default) into one segment.
+
+        Session numbers grow with ingest order and every segment covers a later
+        range than the ones before it, so posting lists of consecutive segments
+        are concatenated without re-sorting. Tombstoned sessions are dropped.
+        """
+        count = len(self.segments) if count is None else count
+        if count < 2 or len(self.segments) < 2:
+            return
+        full_merge = count >= len(self.segments)
+        merged = self.segments[-count:]
+        deleted = self.deleted
+
+        def merged_items():
+            streams = [segment.items() for segment in merged]
+            current_key, current = None, []
+            for key, docnums in heapq.merge(*streams, key=lambda item: item[0]):
+                if key != current_key:
+                    if current:
+                        yield current_key, current
+                    current_key, current = key, []
+                current.extend(docnum for docnum in docnums if docnum not in deleted)
+            if current:
+                yield current_key, current
+
+        name = f"segment-{self.next_segment:05d}"
+        self.next_segment += 1
+        meta = write_segment(self.directory, name, merged_items())
+        for segment in merged:
+            segment.close()
+            for suffix in ("post", "terms"):
+                os.remove(os.path.join(self.directory, f"{segment.name}.{suffix}"))
+        self.segment_meta = self.segment_meta[:-count] + [meta]
+        self.segments = self.segments[:-count] + [Segment(self.directory, name, meta["sample"])]
+        if full_merge:
+            # No segment refers to a tombstoned session any more
+            self.deleted = set()
+        self._save_state()
+
+    def postings(self, key):
+        """Sorted session numbers of the live sessions with a key."""
+        docnums = []
+        for segment in self.segments:
+            docnums.extend(segment.postings(key))
+        if self.deleted:
+            docnums = [docnum for docnum in docnums if docnum not in self.deleted]
+        return docnums
+
+    def _key(self, token):
+        field, separator, value = token.partition(":")
+        if not separator or field not in INDEX_FIELDS:
+            field, value = "term", token
+        if field == "term":
+            value = value.lower()
+        return f"{field}:{value}"
+
+    def _all(self):
+        return {docnum for _, _, docnum in self.manifest.values()}
+
+    def search_numbers(self, query):
+        """
+        Evaluate a boolean query to a set of session numbers.
+
+        Operands are ``term:<term>``, ``doc:<docid>`` or a bare term; they
+        combine with AND, OR, NOT and parentheses, and adjacent operands are
+        ANDed.
+        """
+        tokens = QUERY_TOKEN.findall(query)
+        position = 0
+
+        def peek():
+            return tokens[position] if position < len(tokens) else None
+
+        def take():
+            nonlocal position
+            position += 1
+            return tokens[position - 1]
+
+        def parse_or():
+            result = parse_and()
+            while peek() == "OR":
+                take()
+                result = result | parse_and()
+            return result
+
+        def parse_and():
+            result = parse_not()
+            while peek() not in (None, "OR", ")"):
+                if peek() == "AND":
+                    take()
+                result = result & parse_not()
+            return result
+
+        def parse_not():
+            if peek() == "NOT":
+                take()
+                return self._all() - parse_not()
+            return parse_atom()
+
+        def parse_atom():
+            token = peek()
+            if token is None or token in ("AND", "OR", ")"):
+                raise ValueError(f"Unexpected end of query or operator in: {query}")
+            take()
+            if token == "(":
+                result = parse_or()
+                if peek() != ")":
+                    raise ValueError(f"Missing closing parenthesis in: {query}")
+                take()
+                return result
+            return set(self.postings(self._key(token)))
+
+        result = parse_or()
+        if position != len(tokens):
+            raise ValueError(f"Unexpected token {tokens[position]!r} in: {query}")
+        return result
+
+    def search(self, query):
+        """Session ids matching a boolean query, in ingest order."""
+        ids = self.ids
+        return [ids[docnum] for docnum in sorted(self.search_numbers(query))]
+
+    def sessions_with_term(self, term):
+        ids = self.ids
+        return [ids[docnum] for docnum in self.postings(self._key(f"term:{term}"))]
+
+    def sessions_with_document(self, docid):
+        ids = self.ids
+        return [ids[docnum] for docnum in self.postings(f"doc:{docid}")]
+
+    def topic_support(self, topic):
+        """Number of indexed sessions searching for any content word of a topic."""
+        terms = set(rewrite_query(" ".join(topic.split())).lower().split())
+        matches = set()
+        for term in terms:
+            matches.update(self.postings(f"term:{term}"))
+        return len(matches)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
@@ -0,0 +1,315 @@
+import csv
+import json
+import os
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from analysis.codec import read_session
+from analysis.data_processing import (
+    SESSION_ANALYSIS_FIELDS,
+    analyze_session,
+    compute_session_metrics,
+    add_session_to_topology_stats,
+    new_topology_stats,
+    topology_stats_to_dataframe,
+    write_session_metrics,
+)
+from analysis.box_stats import (
+    add_row_to_box_sketches,
+    box_sketches_from_dict,
+    box_sketches_path,
+    box_sketches_to_dict,
+    merge_box_sketches,
+    new_box_sketches,
+    save_box_sketches,
+)
+from analysis.cardinality import (
+    add_session_to_cardinalities,
+    cardinality_sketches_from_dict,
+    cardinality_sketches_to_dict,
+    merge_cardinality_sketches,
+    new_cardinality_sketches,
+    save_cardinality_sketches,
+    write_cardinality_report,
+)
+from analysis.heavy_hitters import (
+    add_session_to_heavy_hitters,
+    merge_heavy_hitters,
+    new_heavy_hitters,
+    save_heavy_hitters,
+    write_heavy_hitters_report,
+)
+from analysis.sketches import QuantileSketch, SpaceSaving
+from analysis.utils import minutes_to_hh_mm
+
+
+# Metrics of session_metrics_*.txt, keyed by report name -> compute_session_metrics field
+SESSION_METRIC_FIELDS = {
+    "Session Duration (hh:mm)": "session_duration",
+    "Query Count": "query_count",
+    "Query Length (#chars)": "query_lengths_chars",
+    "Query Length (#terms)": "query_lengths_terms",
+    "Term Diversity": "term_diversity",
+    "Search Operators Share": "search_operators_share",
+}
+
+
+def partition_of(session_id, num_partitions):
+    """Assign a session to a partition by a stable hash of its id."""
+    return zlib.crc32(session_id.encode("utf-8")) % num_partitions
+
+
+def partial_path(work_dir, dataset_name, partition, num_partitions):
+    return os.path.join(
+        work_dir, f"{dataset_name}_partial_{partition:04d}_of_{num_partitions:04d}.json"
+    )
+
+
+def rows_path(partial_file):
+    """The per-session sessions_analysis rows of a partition are streamed next to its partial."""
+    return f"{os.path.splitext(partial_file)[0]}_rows.csv"
+
+
+def new_partial():
+    return {
+        "sessions": 0,
+        "session_metrics": {
+            field: QuantileSketch() for field in SESSION_METRIC_FIELDS.values()
+        },
+        "capped_query_counts": Counter(),
+        "capped_tokens_per_query": Counter(),
+        "topology": new_topology_stats(),
+        "cardinalities": new_cardinality_sketches(),
+        "heavy_hitters": new_heavy_hitters(),
+        "box_sketches": new_box_sketches(),
+    }
+
+
+# Function to add one session to a partial aggregate; its sessions_analysis row goes to rows_writer
+def add_session_to_partial(partial, session, rows_writer=None):
+    partial["sessions"] += 1
+    session_metrics = compute_session_metrics(session)
+    for field, sketch in partial["session_metrics"].items():
+        value = session_metrics[field]
+        if isinstance(value, list):
+            sketch.update(value)
+        else:
+            sketch.add(value)
+    partial["capped_query_counts"][min(session_metrics["query_count"], 10)] += 1
+    partial["capped_tokens_per_query"].update(
+        min(tokens, 20) for tokens in session_metrics["query_tokens"]
+    )
+    add_session_to_topology_stats(partial["topology"], session)
+    add_session_to_cardinalities(partial["cardinalities"], session)
+    add_session_to_heavy_hitters(partial["heavy_hitters"], session)
+    row = analyze_session(session)
+    add_row_to_box_sketches(partial["box_sketches"], row)
+    if rows_writer is not None:
+        rows_writer.writerow(row)
+
+
+def merge_partials(partial, other):
+    partial["sessions"] += other["sessions"]
+    for field, sketch in other["session_metrics"].items():
+        partial["session_metrics"][field].merge(sketch)
+    partial["capped_query_counts"].update(other["capped_query_counts"])
+    partial["capped_tokens_per_query"].update(other["capped_tokens_per_query"])
+    for action, data in other["topology"].items():
+        for key, value in data.items():
+            partial["topology"][action][key] += value
+    merge_cardinality_sketches(partial["cardinalities"], other["cardinalities"])
+    merge_heavy_hitters(partial["heavy_hitters"], other["heavy_hitters"])
+    merge_box_sketches(partial["box_sketches"], other["box_sketches"])
+    return partial
+
+
+def save_partial(partial, file_path):
+    data = {
+        "sessions": partial["sessions"],
+        "session_metrics": {
+            field: sketch.to_dict()
+            for field, sketch in partial["session_metrics"].items()
+        },
+        "capped_query_counts": partial["capped_query_counts"],
+        "capped_tokens_per_query": partial["capped_tokens_per_query"],
+        "topology": {
+            action: dict(stats, **{"Total Time": stats["Total Time"].total_seconds()})
+            for action, stats in partial["topology"].items()
+        },
+        "cardinalities": cardinality_sketches_to_dict(partial["cardinalities"]),
+        "heavy_hitters": {
+            field: sketch.to_dict() for field, sketch in partial["heavy_hitters"].items()
+        },
+        "box_sketches": box_sketches_to_dict(partial["box_sketches"]),
+    }
+    # Write to a temporary file first so readers on a shared filesystem never see partial writes
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_path = f"{file_path}.tmp.{os.getpid()}"
+    with open(temporary_path, "w") as file:
+        json.dump(data, file, separators=(",", ":"))
+    os.replace(temporary_path, file_path)
+
+
+def load_partial(file_path):
+    with open(file_path, "r") as file:
+        data = json.load(file)
+    return {
+        "sessions": data["sessions"],
+        "session_metrics": {
+            field: QuantileSketch.from_dict(sketch)
+            for field, sketch in data["session_metrics"].items()
+        },
+        "capped_query_counts": Counter(
+            {int(key): count for key, count in data["capped_query_counts"].items()}
+        ),
+        "capped_tokens_per_query": Counter(
+            {int(key): count for key, count in data["capped_tokens_per_query"].items()}
+        ),
+        "topology": {
+            action: dict(stats, **{"Total Time": timedelta(seconds=stats["Total Time"])})
+            for action, stats in data["topology"].items()
+        },
+        "cardinalities": cardinality_sketches_from_dict(data["cardinalities"]),
+        "heavy_hitters": {
+            field: SpaceSaving.from_dict(sketch)
+            for field, sketch in data["heavy_hitters"].items()
+        },
+        "box_sketches": _load_box_sketches(data),
+    }
+
+
+def _load_box_sketches(data):
+    if "box_sketches" in data:
+        return box_sketches_from_dict(data["box_sketches"])
+    # Partials written before the rows moved out held every sessions_analysis row
+    rows = data.get("sessions_analysis", [])
+    box_sketches = new_box_sketches()
+    for row in rows.values() if isinstance(rows, dict) else rows:
+        add_row_to_box_sketches(box_sketches, row)
+    return box_sketches
+
+
+# Function to run the map step for one partition of a session directory
+def map_partition(data_directory, dataset_name, partition, num_partitions, work_dir):
+    partial = new_partial()
+    file_path = partial_path(work_dir, dataset_name, partition, num_partitions)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    temporary_rows = f"{rows_path(file_path)}.tmp.{os.getpid()}"
+    with open(temporary_rows, "w", newline="", encoding="utf-8") as rows_file:
+        rows_writer = csv.DictWriter(rows_file, fieldnames=SESSION_ANALYSIS_FIELDS)
+        rows_writer.writeheader()
+        for filename in os.listdir(data_directory):
+            if not filename.endswith(".json"):
+                continue
+            session_id = filename[: -len(".json")]
+            if partition_of(session_id, num_partitions) != partition:
+                continue
+            session = read_session(os.path.join(data_directory, filename))
+            add_session_to_partial(partial, session, rows_writer)
+
+    # The rows are in place before the partial, whose presence marks the partition as done
+    os.replace(temporary_rows, rows_path(file_path))
+    save_partial(partial, file_path)
+    print(
+        f"Partition {partition + 1}/{num_partitions}: {partial['sessions']} sessions written to {file_path}"
+    )
+    return file_path
+
+
+# Function to stream the sessions_analysis rows of partition files
+def read_rows(file_paths):
+    for file_path in file_paths:
+        with open(file_path, "r", newline="", encoding="utf-8") as file:
+            yield from csv.DictReader(file)
+
+
+# Function to write the outputs of a merged partial aggregate; rows are its sessions_analysis rows
+def session_analysis_csv_path(dataset_name):
+    return f"logs/{dataset_name}/sessions_analysis.csv"
+
+
+def write_partial_outputs(partial, dataset_name, rows=()):
+    sketches = partial["session_metrics"]
+    metrics = {
+        name: {
+            "Mean": sketches[field].mean(),
+            "Median": sketches[field].quantile(0.5),
+            "SD": sketches[field].stdev(),
+        }
+        for name, field in SESSION_METRIC_FIELDS.items()
+    }
+    average_duration_hh_mm = minutes_to_hh_mm(sketches["session_duration"].mean())
+
+    output_directory = f"metrics/{dataset_name}/"
+    os.makedirs(output_directory, exist_ok=True)
+    metrics_file = f"{output_directory}session_metrics_{dataset_name}.txt"
+    write_session_metrics(metrics_file, metrics, average_duration_hh_mm)
+    print(f"Session metrics saved to {metrics_file}")
+
+    topology_file = f"{output_directory}topology_interaction_{dataset_name}.csv"
+    topology_stats_to_dataframe(partial["topology"]).to_csv(topology_file, index=False)
+    print(f"Data saved to {topology_file}")
+
+    save_cardinality_sketches(
+        partial["cardinalities"],
+        f"{output_directory}cardinality_sketches_{dataset_name}.json",
+    )
+    write_cardinality_report(
+        partial["cardinalities"], f"{output_directory}cardinalities_{dataset_name}.csv"
+    )
+    save_heavy_hitters(
+        partial["heavy_hitters"], f"{output_directory}heavy_hitters_{dataset_name}.json"
+    )
+    write_heavy_hitters_report(
+        partial["heavy_hitters"], f"{output_directory}top_items_{dataset_name}.csv"
+    )
+
+    csv_file_path = session_analysis_csv_path(dataset_name)
+    os.makedirs(os.path.dirname(csv_file_path), exist_ok=True)
+    # Callers that maintain the CSV themselves pass rows=None
+    if rows is not None:
+        with open(csv_file_path, "w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=SESSION_ANALYSIS_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"CSV file has been created at {csv_file_path}")
+    save_box_sketches(partial["box_sketches"], box_sketches_path(csv_file_path))
+
+
+# Function to run the reduce step over the partial aggregates of all partitions
+def reduce_partitions(dataset_name, num_partitions, work_dir):
+    partial = new_partial()
+    row_files = []
+    for partition in range(num_partitions):
+        file_path = partial_path(work_dir, dataset_name, partition, num_partitions)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(
+                f"Missing partial aggregate for partition {partition}: {file_path}"
+            )
+        merge_partials(partial, load_partial(file_path))
+        row_files.append(rows_path(file_path))
+
+    write_partial_outputs(partial, dataset_name, read_rows(row_files))
+    return +partial["capped_query_counts"], +partial["capped_tokens_per_query"]
+
+
+# Function to run all map steps in a local process pool followed by the reduce step
+def run_map_reduce(
+    data_directory, dataset_name, num_partitions, work_dir, max_workers=None
+):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                map_partition,
+                data_directory,
+                dataset_name,
+                partition,
+                num_partitions,
+                work_dir,
+            )
+            for partition in range(num_partitions)
+        ]
+        for future in futures:
+            future.result()
+    return reduce_partitions(dataset_name, num_partitions, work_dir)
@@ -0,0 +1,330 @@
+import csv
+import hashlib
+import json
+import os
+import random
+from array import array
+from collections import defaultdict
+from analysis.codec import read_session
+from analysis.utils import action_queries
+
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+MAX_BUCKET_SIZE = 1000
+
+
+# Function to hash a shingle into a stable 64-bit integer (independent of PYTHONHASHSEED)
+def _shingle_hash(shingle):
+    return int.from_bytes(
+        hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def session_shingles(session, ngram=3):
+    """
+    Build the shingle set of a session.
+
+    Action shingles are n-grams over "action_type/action_label" tokens, query
+    shingles are the lowercased tokens of every query issued in the session.
+    """
+    labels = [
+        f"{action['action_type']}/{action['action_label']}"
+        for action in session["actions"]
+    ]
+    shingles = set()
+    for i in range(max(len(labels) - ngram + 1, 1)):
+        shingles.add("a:" + " ".join(labels[i : i + ngram]))
+    for action in session["actions"]:
+        for query in action_queries(action):
+            shingles.update("q:" + token for token in query.lower().split())
+    shingles.discard("a:")
+    return shingles
+
+
+class LSHIndex:
+    """
+    Incremental MinHash/LSH index persisted to a directory.
+
+    The index directory holds ``params.json``, one "session_id<TAB>size<TAB>mtime_ns"
+    line per session in ``ids.txt`` and the uint32 signatures in ``signatures.bin``.
+    New and re-indexed sessions are appended, so the index can grow with every
+    generation job; a later entry of a session replaces its earlier one on load.
+    """
+
+    def __init__(self, num_perm=128, bands=32, seed=1, max_bucket_size=MAX_BUCKET_SIZE):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.seed = seed
+        self.max_bucket_size = max_bucket_size
+        rng = random.Random(seed)
+        self._permutations = [
+            (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        self.ids = []
+        self.stats = []
+        self.signatures = array("I")
+        self._positions = {}
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+        self._persisted = 0
+        self._replaced = []
+        # Sessions without shingles all share this signature; they are kept out of the buckets
+        self._empty_signature = array("I", self.signature(()))
+
+    def signature(self, shingles):
+        hashes = [_shingle_hash(shingle) for shingle in shingles] or [0]
+        return [
+            min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes)
+            for a, b in self._permutations
+        ]
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [
+            tuple(signature[band * rows : (band + 1) * rows])
+            for band in range(self.bands)
+        ]
+
+    def __contains__(self, session_id):
+        return session_id in self._positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_signature(self, session_id):
+        return self._signature_at(self._positions[session_id])
+
+    def get_stat(self, session_id):
+        return self.stats[self._positions[session_id]]
+
+    def _signature_at(self, position):
+        start = position * self.num_perm
+        return self.signatures[start : start + self.num_perm]
+
+    def _bucket(self, position, signature):
+        if array("I", signature) == self._empty_signature:
+            return
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].append(position)
+
+    def add(self, session_id, signature, stat=None):
+        """Add a session, or replace its signature if it is already indexed."""
+        position = self._positions.get(session_id)
+        if position is None:
+            position = len(self.ids)
+            self.ids.append(session_id)
+            self.stats.append(stat)
+            self._positions[session_id] = position
+            self.signatures.extend(signature)
+        else:
+            for band, key in enumerate(self._band_keys(self._signature_at(position))):
+                bucket = self._buckets[band].get(key)
+                if bucket is not None and position in bucket:
+                    bucket.remove(position)
+                    if not bucket:
+                        del self._buckets[band][key]
+            start = position * self.num_perm
+            self.signatures[start : start + self.num_perm] = array("I", signature)
+            self.stats[position] = stat
+            if position < self._persisted:
+                self._replaced.append(position)
+        self._bucket(position, signature)
+        return position
+
+    def query(self, signature, threshold=0.0):
+        """Return (session_id, similarity) pairs for indexed sessions sharing a band with the signature."""
+        candidates = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self._buckets[band].get(key, ()))
+        results = []
+        for position in candidates:
+            similarity = self.similarity(signature, self._signature_at(position))
+            if similarity >= threshold:
+                results.append((self.ids[position], similarity))
+        return sorted(results, key=lambda item: -item[1])
+
+    def similarity(self, signature1, signature2):
+        matches = sum(1 for x, y in zip(signature1, signature2) if x == y)
+        return matches / self.num_perm
+
+    def _first_shared_band(self, first, second):
+        signature1, signature2 = self._signature_at(first), self._signature_at(second)
+        for band, (key1, key2) in enumerate(
+            zip(self._band_keys(signature1), self._band_keys(signature2))
+        ):
+            size = len(self._buckets[band].get(key1, ()))
+            if key1 == key2 and 2 <= size <= self.max_bucket_size:
+                return band
+        return None
+
+    def candidate_pairs(self, session_ids=None):
+        """
+        Yield candidate (position1, position2) pairs, optionally restricted to pairs
+        involving the given sessions.
+
+        A pair is yielded from the first band its signatures share, so no set of seen
+        pairs is kept. Buckets holding more than ``max_bucket_size`` sessions are
+        skipped, as they only arise from degenerate sessions sharing most shingles.
+        """
+        if session_ids is None:
+            for band, buckets in enumerate(self._buckets):
+                for positions in buckets.values():
+                    if not 2 <= len(positions) <= self.max_bucket_size:
+                        continue
+                    for i, first in enumerate(positions):
+                        for second in positions[i + 1 :]:
+                            if self._first_shared_band(first, second) == band:
+                                yield min(first, second), max(first, second)
+            return
+
+        # Only the buckets of the given sessions are visited
+        restrict = {self._positions[session_id] for session_id in session_ids}
+        for first in sorted(restrict):
+            for band, key in enumerate(self._band_keys(self._signature_at(first))):
+                positions = self._buckets[band].get(key, ())
+                if len(positions) > self.max_bucket_size:
+                    continue
+                for second in positions:
+                    # A pair of two given sessions is yielded from its smaller position
+                    if second == first or (second in restrict and second < first):
+                        continue
+                    if self._first_shared_band(first, second) == band:
+                        yield min(first, second), max(first, second)
+
+    def near_duplicates(self, threshold, session_ids=None):
+        pairs = []
+        for first, second in self.candidate_pairs(session_ids):
+            similarity = self.similarity(
+                self._signature_at(first), self._signature_at(second)
+            )
+            if similarity >= threshold:
+                pairs.append((self.ids[first], self.ids[second], similarity))
+        return pairs
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, "params.json"), "w") as file:
+            json.dump(
+                {"num_perm": self.num_perm, "bands": self.bands, "seed": self.seed},
+                file,
+            )
+        # Only the sessions added or replaced since the last save are appended
+        positions = self._replaced + list(range(self._persisted, len(self.ids)))
+        with open(os.path.join(index_dir, "ids.txt"), "a", encoding="utf-8") as file:
+            for position in positions:
+                size, mtime_ns = self.stats[position] or ("", "")
+                file.write(f"{self.ids[position]}\t{size}\t{mtime_ns}\n")
+        with open(os.path.join(index_dir, "signatures.bin"), "ab") as file:
+            for position in positions:
+                self._signature_at(position).tofile(file)
+        self._persisted = len(self.ids)
+        self._replaced = []
+
+    @classmethod
+    def load(cls, index_dir, num_perm=128, bands=32, seed=1):
+        params_path = os.path.join(index_dir, "params.json")
+        if not os.path.exists(params_path):
+            return cls(num_perm, bands, seed)
+        with open(params_path, "r") as file:
+            index = cls(**json.load(file))
+        with open(os.path.join(index_dir, "ids.txt"), "r", encoding="utf-8") as file:
+            entries = [line.rstrip("\n").split("\t") for line in file if line.strip()]
+        signatures = array("I")
+        with open(os.path.join(index_dir, "signatures.bin"), "rb") as file:
+            signatures.frombytes(file.read())
+        for position, entry in enumerate(entries):
+            # Entries written before the file stats were recorded have none
+            stat = (int(entry[1]), int(entry[2])) if len(entry) == 3 and entry[1] else None
+            start = position * index.num_perm
+            index.add(entry[0], signatures[start : start + index.num_perm], stat)
+        index._persisted = len(index.ids)
+        index._replaced = []
+        return index
+
+
+def cluster_near_duplicates(pairs):
+    """Group near-duplicate pairs into connected clusters with a union-find."""
+    parent = {}
+
+    def find(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for first, second, _ in pairs:
+        root1, root2 = find(first), find(second)
+        if root1 != root2:
+            parent[max(root1, root2)] = min(root1, root2)
+
+    clusters = defaultdict(list)
+    for node in parent:
+        clusters[find(node)].append(node)
+    return sorted(
+        (sorted(members) for members in clusters.values()),
+        key=lambda members: -len(members),
+    )
+
+
+# Function to index every session JSON file of the given directories and report near-duplicates
+def detect_near_duplicates(
+    directories, index_dir, report_path, threshold=0.8, new_only=False
+):
+    """
+    Parameters:
+    - directories: Mapping of dataset label to a directory of session JSON files.
+    - index_dir: Directory of the persistent LSH index; created if missing.
+    - report_path: CSV file receiving one row per session in a near-duplicate cluster.
+    - threshold: Minimum estimated Jaccard similarity of a near-duplicate pair.
+    - new_only: Only report pairs involving sessions added or re-indexed in this run.
+    """
+    index = LSHIndex.load(index_dir)
+    added = []
+    for label, directory in directories.items():
+        with os.scandir(directory) as entries:
+            files = sorted(
+                (entry.name, entry.stat()) for entry in entries if entry.name.endswith(".json")
+            )
+        for filename, file_stat in files:
+            session_id = f"{label}/{filename[: -len('.json')]}"
+            stat = (file_stat.st_size, file_stat.st_mtime_ns)
+            # Files rewritten since they were indexed are indexed again
+            if session_id in index and index.get_stat(session_id) == stat:
+                continue
+            session = read_session(os.path.join(directory, filename))
+            index.add(session_id, index.signature(session_shingles(session)), stat)
+            added.append(session_id)
+    index.save(index_dir)
+    print(f"Indexed {len(added)} new or changed sessions ({len(index)} in total).")
+
+    pairs = index.near_duplicates(threshold, added if new_only else None)
+    clusters = cluster_near_duplicates(pairs)
+
+    best_match = {}
+    for first, second, similarity in pairs:
+        for node, other in ((first, second), (second, first)):
+            if node not in best_match or similarity > best_match[node][1]:
+                best_match[node] = (other, similarity)
+
+    if os.path.dirname(report_path):
+        os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["cluster_id", "cluster_size", "session_id", "best_match", "similarity"]
+        )
+        for cluster_id, members in enumerate(clusters):
+            for session_id in members:
+                match, similarity = best_match[session_id]
+                writer.writerow(
+                    [cluster_id, len(members), session_id, match, f"{similarity:.3f}"]
+                )
+    print(
+        f"Found {len(pairs)} near-duplicate pairs in {len(clusters)} clusters; report saved to {report_path}"
+    )
+    return clusters
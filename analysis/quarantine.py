@@ -0,0 +1,120 @@
+import json
+import os
+from collections import Counter
+from analysis.codec import SchemaError, DecodeError
+
+
+def quarantine_path(source_path):
+    """
+    Default quarantine file of an input: logs/quarantine/<input path>.quarantine.ndjson.
+
+    The name is the input's path relative to the working directory with the
+    separators replaced by "__", so inputs sharing a base name (such as
+    data/suss/sessions/ and data/econbiz/sessions/) get separate files.
+    """
+    relative = os.path.relpath(os.path.abspath(source_path))
+    parts = [part for part in relative.split(os.sep) if part not in ("", ".", "..")]
+    return os.path.join("logs", "quarantine", f"{'__'.join(parts)}.quarantine.ndjson")
+
+
+def quarantine_source(path):
+    """The source recorded in a quarantine file, or None if it has no entries."""
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                return json.loads(line).get("source")
+    return None
+
+
+def error_type(error):
+    if isinstance(error, SchemaError):
+        return "schema"
+    if isinstance(error, DecodeError):
+        return "malformed_json"
+    if isinstance(error, KeyError):
+        return "missing_field"
+    if isinstance(error, (ValueError, TypeError)):
+        return "bad_value"
+    return type(error).__name__
+
+
+class Quarantine:
+    """
+    NDJSON file of the input records an ingest could not process.
+
+    Every entry records the kind of input, the source file, the byte offset
+    (NDJSON inputs, in the decompressed stream) or line number (CSV inputs),
+    the error type and message and the raw record. Entries are written to a
+    temporary file that replaces the quarantine file in close(), so the
+    previous file is readable until the run has finished. A run that
+    quarantines nothing removes the previous file only if it was written
+    for the same source; a run that fails keeps it.
+    close() prints the number of records per error type.
+    """
+
+    def __init__(self, path, kind, source=None):
+        self.path = path
+        self.kind = kind
+        self.source = source
+        self.counts = Counter()
+        self.file = None
+        self.temporary_path = f"{path}.tmp.{os.getpid()}"
+
+    def add(self, error_type, message, record, offset=None, line=None):
+        if self.file is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.temporary_path, "w", encoding="utf-8")
+        if isinstance(record, bytes):
+            record = record.decode("utf-8", errors="replace")
+        entry = {
+            "kind": self.kind,
+            "source": self.source,
+            "offset": offset,
+            "line": line,
+            "error": error_type,
+            "message": message,
+            "record": record.rstrip("\r\n") if isinstance(record, str) else record,
+        }
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.counts[error_type] += 1
+
+    def add_error(self, error, record, offset=None, line=None):
+        self.add(error_type(error), str(error), record, offset, line)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.replace(self.temporary_path, self.path)
+        elif os.path.exists(self.path) and quarantine_source(self.path) == self.source:
+            # Superseded by this run; the file of another input is left alone
+            os.remove(self.path)
+        if self.counts:
+            summary = ", ".join(f"{name}={count}" for name, count in self.counts.most_common())
+            print(
+                f"Quarantined {sum(self.counts.values())} records of {self.source} "
+                f"to {self.path}: {summary}"
+            )
+        return self.counts
+
+    def __enter__(self):
+        return self
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.temporary_path)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+
+def read_quarantine(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
@@ -0,0 +1,172 @@
+import csv
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from analysis.codec import read_session
+from analysis.utils import action_queries
+
+
+REFORMULATION_TYPES = (
+    "repeat",
+    "specialization",
+    "generalization",
+    "substitution",
+    "new",
+)
+
+
+def edit_distance(source, target):
+    """
+    Levenshtein distance between two strings or token sequences.
+
+    Uses the bit-parallel algorithm of Myers (1999) in Hyyrö's formulation:
+    the shorter sequence is the pattern, one DP column is held in two bit
+    vectors and every element of the longer sequence updates the column with
+    a constant number of integer operations. Python integers are unbounded,
+    so patterns longer than a machine word need no blocking.
+    """
+    if len(source) < len(target):
+        source, target = target, source
+    length = len(target)
+    if not length:
+        return len(source)
+
+    match_masks = {}
+    for position, item in enumerate(target):
+        match_masks[item] = match_masks.get(item, 0) | (1 << position)
+
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+    positive, negative = full, 0
+    score = length
+    for item in source:
+        match = match_masks.get(item, 0)
+        vertical = match | negative
+        horizontal = (((match & positive) + positive) ^ positive) | match
+        positive_horizontal = negative | ~(horizontal | positive)
+        negative_horizontal = positive & horizontal
+        if positive_horizontal & last:
+            score += 1
+        elif negative_horizontal & last:
+            score -= 1
+        positive_horizontal = (positive_horizontal << 1) | 1
+        negative_horizontal = negative_horizontal << 1
+        positive = (negative_horizontal | ~(vertical | positive_horizontal)) & full
+        negative = positive_horizontal & vertical & full
+    return score
+
+
+def classify_reformulation(previous, current):
+    """
+    Classify a consecutive query pair.
+
+    Returns (type, character distance, token distance). Queries are compared
+    lowercased and whitespace-normalized; a specialization adds terms to the
+    previous query, a generalization removes terms, a substitution replaces
+    some terms while keeping at least one (or is a small spelling change),
+    and a new query shares no terms with the previous one.
+    """
+    previous = " ".join(previous.lower().split())
+    current = " ".join(current.lower().split())
+    previous_terms = previous.split()
+    current_terms = current.split()
+    char_distance = edit_distance(previous, current)
+    token_distance = edit_distance(previous_terms, current_terms)
+
+    if char_distance == 0 or previous_terms == current_terms:
+        reformulation = "repeat"
+    elif set(previous_terms) < set(current_terms):
+        reformulation = "specialization"
+    elif set(current_terms) < set(previous_terms):
+        reformulation = "generalization"
+    elif set(previous_terms) & set(current_terms) or char_distance <= max(
+        2, len(previous) // 5
+    ):
+        reformulation = "substitution"
+    else:
+        reformulation = "new"
+    return reformulation, char_distance, token_distance
+
+
+# Function to list the consecutive query pairs of a session
+def session_query_pairs(session):
+    queries = [
+        query for action in session["actions"] for query in action_queries(action)
+    ]
+    return list(zip(queries, queries[1:]))
+
+
+# Function to classify a batch of session files (runs in a worker process)
+def _classify_files(file_paths):
+    rows = []
+    cache = {}
+    for file_path in file_paths:
+        session = read_session(file_path)
+        session_id = session.get(
+            "session_id", os.path.basename(file_path)[: -len(".json")]
+        )
+        for previous, current in session_query_pairs(session):
+            pair = (previous, current)
+            if pair not in cache:
+                cache[pair] = classify_reformulation(previous, current)
+            reformulation, char_distance, token_distance = cache[pair]
+            rows.append(
+                (session_id, previous, current, reformulation, char_distance, token_distance)
+            )
+    return rows
+
+
+def analyze_reformulations(
+    data_directory, dataset_name, batch_size=1000, max_workers=None
+):
+    """
+    Classify every consecutive query pair of a dataset.
+
+    Session files are processed in batches on a process pool. The pairs are
+    written to logs/<dataset>/query_reformulations.csv and the share of each
+    reformulation type to metrics/<dataset>/reformulations_<dataset>.csv.
+    """
+    file_paths = sorted(
+        os.path.join(data_directory, filename)
+        for filename in os.listdir(data_directory)
+        if filename.endswith(".json")
+    )
+    batches = [
+        file_paths[start : start + batch_size]
+        for start in range(0, len(file_paths), batch_size)
+    ]
+
+    pairs_path = f"logs/{dataset_name}/query_reformulations.csv"
+    os.makedirs(os.path.dirname(pairs_path), exist_ok=True)
+    counts = Counter()
+    with open(pairs_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            [
+                "session_id",
+                "previous_query",
+                "query",
+                "reformulation",
+                "char_distance",
+                "token_distance",
+            ]
+        )
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for rows in executor.map(_classify_files, batches):
+                writer.writerows(rows)
+                counts.update(row[3] for row in rows)
+    print(f"Query reformulations saved to {pairs_path}")
+
+    summary_path = f"metrics/{dataset_name}/reformulations_{dataset_name}.csv"
+    os.makedirs(os.path.dirname(summary_path), exist_ok=True)
+    total = sum(counts.values())
+    with open(summary_path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["reformulation", "count", "share"])
+        for reformulation in REFORMULATION_TYPES:
+            count = counts[reformulation]
+            writer.writerow(
+                [reformulation, count, f"{count / total:.4f}" if total else "0"]
+            )
+    print(f"Reformulation summary saved to {summary_path}")
+    return counts
@@ -0,0 +1,393 @@
+import os
+import socket
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+from analysis.codec import DecodeError, dumps, loads, read_session
+from analysis.data_processing import (
+    add_session_to_topology_stats,
+    compute_session_metrics,
+    new_topology_stats,
+    topology_stats_to_dataframe,
+)
+from analysis.session_analysis import categorize_session
+from analysis.session_model import SessionStore
+from analysis.sketches import QuantileSketch
+from analysis.utils import timestamp_to_epoch_ms
+
+
+class ResidentDataset:
+    """
+    A directory of session JSON files kept in memory in compact form.
+
+    Per-session summaries (start, end, action count, user, session type) are
+    computed once at load time, so the comparison queries only scan arrays.
+    Files that cannot be read (malformed or half-written) are skipped and
+    listed in ``errors`` until they change.
+    """
+
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.generation = 0
+        self.store = SessionStore()
+        self.files = {}
+        self.summaries = []
+        self.errors = {}
+
+    def _scan(self):
+        if not os.path.isdir(self.directory):
+            return {}
+        return {
+            entry.name: entry.stat().st_mtime_ns
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".json") and entry.is_file()
+        }
+
+    def _read_files(self, filenames, errors):
+        """Decode session files, recording the ones that cannot be read in ``errors``."""
+        sessions = []
+        for filename in filenames:
+            try:
+                sessions.append((filename, read_session(os.path.join(self.directory, filename))))
+            except (OSError, DecodeError) as error:
+                errors[filename] = str(error)
+                print(f"Skipping unreadable session file {filename} of {self.name}: {error}")
+        return sessions
+
+    def _add_sessions(self, store, summaries, sessions, errors):
+        for filename, data in sessions:
+            count = len(store.sessions)
+            try:
+                session = store.session_from_dict(data)
+                summary = {
+                    "session_id": session.get("session_id", filename[: -len(".json")]),
+                    "start_ms": session.start_ms,
+                    "end_ms": session.end_ms,
+                    "actions": len(session),
+                    "user_id": session.user_id,
+                    "session_type": categorize_session(session),
+                }
+            except (KeyError, ValueError, TypeError) as error:
+                # E.g. a timestamp in another format; the partly added session is dropped
+                del store.sessions[count:]
+                errors[filename] = f"{type(error).__name__}: {error}"
+                print(f"Skipping unreadable session file {filename} of {self.name}: {error}")
+                continue
+            summaries.append(summary)
+
+    def reload(self):
+        """
+        Load new session files; rebuild from scratch if files changed or disappeared.
+
+        Files are decoded, and a rebuilt store filled, without holding the
+        lock; the new state is swapped in under the lock and only then is
+        ``generation`` bumped, so cached results never outlive their data.
+        """
+        files = self._scan()
+        with self.lock:
+            known = dict(self.files)
+        changed = any(files.get(filename) != mtime for filename, mtime in known.items())
+        if changed:
+            errors = {}
+            store, summaries = SessionStore(), []
+            self._add_sessions(store, summaries, self._read_files(sorted(files), errors), errors)
+            with self.lock:
+                self.store, self.summaries = store, summaries
+                self.files, self.errors = files, errors
+                self.generation += 1
+            return True
+        new_files = sorted(set(files) - set(known))
+        if not new_files:
+            return False
+        errors = {}
+        sessions = self._read_files(new_files, errors)
+        with self.lock:
+            self._add_sessions(self.store, self.summaries, sessions, errors)
+            self.files.update((filename, files[filename]) for filename in new_files)
+            self.errors.update(errors)
+            self.generation += 1
+        return True
+
+    def select(self, filters):
+        """Return (summary, session) pairs matching the query filters."""
+        session_type = filters.get("session_type")
+        user_id = filters.get("user_id")
+        start_ms = filters.get("start_ms")
+        end_ms = filters.get("end_ms")
+        min_actions = filters.get("min_actions", 0)
+        selected = []
+        for summary, session in zip(self.summaries, self.store.sessions):
+            if session_type and summary["session_type"] != session_type:
+                continue
+            if user_id is not None and str(summary["user_id"]) != user_id:
+                continue
+            if start_ms is not None and summary["start_ms"] < start_ms:
+                continue
+            if end_ms is not None and summary["start_ms"] >= end_ms:
+                continue
+            if summary["actions"] < min_actions:
+                continue
+            selected.append((summary, session))
+        return selected
+
+
+# Function to summarize a list of numbers the way the compare_* functions print them
+def _describe(values):
+    if not values:
+        return {"average": 0, "max": 0, "min": 0}
+    return {
+        "average": sum(values) / len(values),
+        "max": max(values),
+        "min": min(values),
+    }
+
+
+def query_sessions(selected):
+    return {"sessions": len(selected)}
+
+
+def query_length(selected):
+    return _describe(
+        [summary["end_ms"] - summary["start_ms"] for summary, _ in selected]
+    )
+
+
+def query_actions(selected):
+    return _describe([summary["actions"] for summary, _ in selected])
+
+
+def query_users(selected):
+    return {"unique_users": len({summary["user_id"] for summary, _ in selected})}
+
+
+def query_distribution(selected):
+    counts = Counter()
+    for _, session in selected:
+        labels = session.store.vocabulary.labels
+        counts.update(labels[code] for code in session.label_codes)
+    return dict(counts.most_common())
+
+
+def query_topology(selected):
+    stats = new_topology_stats()
+    for _, session in selected:
+        add_session_to_topology_stats(stats, session)
+    return topology_stats_to_dataframe(stats).to_dict("records")
+
+
+def query_metrics(selected):
+    fields = [
+        "session_duration",
+        "query_count",
+        "query_lengths_chars",
+        "query_lengths_terms",
+        "term_diversity",
+        "search_operators_share",
+    ]
+    sketches = {field: QuantileSketch() for field in fields}
+    for _, session in selected:
+        session_metrics = compute_session_metrics(session)
+        for field in fields:
+            value = session_metrics[field]
+            if isinstance(value, list):
+                sketches[field].update(value)
+            else:
+                sketches[field].add(value)
+    return {
+        field: {
+            "Mean": sketch.mean(),
+            "Median": sketch.quantile(0.5),
+            "SD": sketch.stdev(),
+        }
+        for field, sketch in sketches.items()
+    }
+
+
+QUERIES = {
+    "/sessions": query_sessions,
+    "/length": query_length,
+    "/actions": query_actions,
+    "/users": query_users,
+    "/distribution": query_distribution,
+    "/topology": query_topology,
+    "/metrics": query_metrics,
+}
+
+
+def parse_filters(params):
+    filters = {}
+    if "session_type" in params:
+        filters["session_type"] = params["session_type"][0]
+    if "user_id" in params:
+        filters["user_id"] = params["user_id"][0]
+    if "start_date" in params:
+        filters["start_ms"] = timestamp_to_epoch_ms(params["start_date"][0])
+    if "end_date" in params:
+        filters["end_ms"] = timestamp_to_epoch_ms(params["end_date"][0])
+    if "min_actions" in params:
+        filters["min_actions"] = int(params["min_actions"][0])
+    return filters
+
+
+class AnalysisService:
+    """Resident datasets plus an LRU cache of query results keyed by dataset generation."""
+
+    def __init__(self, datasets, cache_size=1024):
+        self.datasets = {
+            name: ResidentDataset(name, directory)
+            for name, directory in datasets.items()
+        }
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+
+    def reload(self):
+        return [name for name, dataset in self.datasets.items() if dataset.reload()]
+
+    def describe(self):
+        return {
+            name: {
+                "directory": dataset.directory,
+                "sessions": len(dataset.summaries),
+                "unreadable_files": sorted(dataset.errors),
+                "generation": dataset.generation,
+            }
+            for name, dataset in self.datasets.items()
+        }
+
+    def query(self, path, params):
+        if path == "/datasets":
+            return self.describe()
+        if path not in QUERIES:
+            raise KeyError(path)
+        names = params.get("dataset") or list(self.datasets)
+        filters = parse_filters(params)
+        results = {}
+        for name in names:
+            dataset = self.datasets[name]
+            # The generation is read under the dataset lock, so it matches the data queried
+            with dataset.lock:
+                key = (path, name, dataset.generation, tuple(sorted(filters.items())))
+                with self.cache_lock:
+                    cached = key in self.cache
+                    if cached:
+                        self.cache.move_to_end(key)
+                        results[name] = self.cache[key]
+                if cached:
+                    continue
+                result = QUERIES[path](dataset.select(filters))
+            with self.cache_lock:
+                self.cache[key] = result
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            results[name] = result
+        return results
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            started = time.perf_counter()
+            result = self.service.query(url.path, parse_qs(url.query))
+            body = {"result": result, "elapsed_ms": (time.perf_counter() - started) * 1000}
+            status = 200
+        except KeyError as error:
+            body, status = {"error": f"Unknown path or dataset: {error}"}, 404
+        except DecodeError as error:
+            # A session file the server could not read, not a bad request
+            body, status = {"error": f"Unreadable session data: {error}"}, 500
+        except ValueError as error:
+            body, status = {"error": str(error)}, 400
+        except Exception as error:
+            traceback.print_exc()
+            body, status = {"error": f"{type(error).__name__}: {error}"}, 500
+        payload = dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self):
+        # Unix socket clients have no host address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("", 0)
+
+
+def create_server(service, host="127.0.0.1", port=8765, socket_path=None):
+    """Create an HTTP server for the service on a localhost port or a Unix socket."""
+    handler = type("Handler", (AnalysisRequestHandler,), {"service": service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _watch(service, interval, stop_event):
+    while not stop_event.wait(interval):
+        try:
+            reloaded = service.reload()
+        except Exception:
+            # Keep watching; the next pass retries
+            traceback.print_exc()
+            continue
+        if reloaded:
+            print(f"Reloaded datasets: {', '.join(reloaded)}")
+
+
+# Function to load the datasets once and serve queries until interrupted
+def serve(datasets, host="127.0.0.1", port=8765, socket_path=None, reload_interval=5):
+    service = AnalysisService(datasets)
+    service.reload()
+    for name, info in service.describe().items():
+        print(f"Loaded {info['sessions']} sessions for {name}.")
+
+    server = create_server(service, host, port, socket_path)
+    stop_event = threading.Event()
+    watcher = threading.Thread(
+        target=_watch, args=(service, reload_interval, stop_event), daemon=True
+    )
+    watcher.start()
+    address = socket_path or f"http://{server.server_address[0]}:{server.server_address[1]}"
+    print(f"Serving analysis queries on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+    return service
+
+
+# Function to query a running server over its Unix socket (HTTP servers can use any HTTP client)
+def query_unix_socket(socket_path, path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(f"GET {path} HTTP/1.0\r\nHost: localhost\r\n\r\n".encode("ascii"))
+        response = b""
+        while chunk := client.recv(65536):
+            response += chunk
+    return loads(response.split(b"\r\n\r\n", 1)[1])
@@ -1,20 +1,19 @@
-import json
 import os
 import pandas as pd
+from analysis.session_model import as_dict
+from analysis.sketches import HyperLogLog
+from analysis.writer import AsyncWriter
 
 
-def save_sessions_to_json(sessions, output_dir):
+def save_sessions_to_json(sessions, output_dir, compact=False):
     print("Starting to save sessions to JSON files...")
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    for session_id, session_data in sessions.items():
-        # Remove 'has_click' key from session_data before saving
-        if "has_click" in session_data:
-            del session_data["has_click"]
-        file_path = os.path.join(output_dir, f"{session_id}.json")
-        with open(file_path, "w") as json_file:
-            json.dump(session_data, json_file, indent=4)
-        print(f"Saved session {session_id} to JSON.")
+    with AsyncWriter(compact=compact, label="sessions") as writer:
+        for session_id, session_data in sessions.items():
+            # Remove 'has_click' key from session_data before saving
+            if "has_click" in session_data:
+                del session_data["has_click"]
+            file_path = os.path.join(output_dir, f"{session_id}.json")
+            writer.write_json(file_path, as_dict(session_data))
     print("Finished saving all sessions.")
 
 
@@ -91,14 +90,23 @@ def compare_actions_per_session(event_df1, event_df2):
     print("Min actions per session in Dataset 2:", actions_per_session2.min())
 
 
+# Tables are DataFrames with a user_id column, sql_store.DatasetView objects or user HyperLogLogs
 def compare_unique_users(table_df1, table_df2):
-    unique_users1 = table_df1["user_id"].nunique()
-    unique_users2 = table_df2["user_id"].nunique()
+    unique_users1 = _count_unique_users(table_df1)
+    unique_users2 = _count_unique_users(table_df2)
 
     print("Number of unique users in Dataset 1:", unique_users1)
     print("Number of unique users in Dataset 2:", unique_users2)
 
 
+def _count_unique_users(table):
+    if isinstance(table, HyperLogLog):
+        return table.count()
+    if hasattr(table, "unique_users"):
+        return table.unique_users()
+    return table["user_id"].nunique()
+
+
 # Function to calculate the number of tokens in each query
 def calculate_query_tokens(actions):
     tokens_per_query = []
@@ -0,0 +1,284 @@
+import json
+import mmap
+import os
+from collections import OrderedDict
+from analysis.codec import decode_session, dumps, loads
+from analysis.compression import open_input
+
+
+CONTAINER_MARKER = "container.json"
+DEFAULT_MAX_SHARD_BYTES = 256 * 1024 * 1024
+INDEX_FLUSH_RECORDS = 1024  # Index entries are written in batches, after the data they point to
+OPEN_CONTAINERS = 8  # Containers kept open by open_container
+
+
+def is_container(path):
+    return os.path.isfile(os.path.join(path, CONTAINER_MARKER))
+
+
+def _shard_name(shard):
+    return f"shard-{shard:05d}.jsonl"
+
+
+def _index_name(shard):
+    return f"shard-{shard:05d}.idx"
+
+
+class SessionContainerWriter:
+    """
+    Append sessions to size-capped JSONL shards with a sidecar offset index.
+
+    Each shard ``shard-NNNNN.jsonl`` holds one compact JSON session per line
+    and ``shard-NNNNN.idx`` lists ``session_id<TAB>offset<TAB>length`` for
+    every line. Appending a session id again supersedes the earlier copy.
+    Reopening a container continues its last shard; bytes written after the
+    last indexed record (an interrupted append) are truncated. Index entries
+    are only written once the data they point to has been flushed, so an
+    entry never points past the end of its shard.
+    """
+
+    def __init__(self, path, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        marker = os.path.join(path, CONTAINER_MARKER)
+        if os.path.exists(marker):
+            with open(marker, "r") as file:
+                max_shard_bytes = json.load(file)["max_shard_bytes"]
+        else:
+            with open(marker, "w") as file:
+                json.dump({"format": 1, "max_shard_bytes": max_shard_bytes}, file)
+        self.max_shard_bytes = max_shard_bytes
+
+        shards = sorted(
+            int(name[6:11]) for name in os.listdir(path) if name.endswith(".jsonl")
+        )
+        self.shard = shards[-1] if shards else 0
+        self._open_shard(truncate_to_index=bool(shards))
+
+    def _open_shard(self, truncate_to_index=False):
+        shard_path = os.path.join(self.path, _shard_name(self.shard))
+        index_path = os.path.join(self.path, _index_name(self.shard))
+        end = 0
+        if truncate_to_index and os.path.exists(index_path):
+            size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+            with open(index_path, "r", encoding="utf-8") as file:
+                lines = file.readlines()
+            # Entries of a crash before the data reached the file are dropped
+            valid = []
+            for line in lines:
+                if not line.endswith("\n"):
+                    break
+                _, offset, length = line.rstrip("\n").rsplit("\t", 2)
+                if int(offset) + int(length) > size:
+                    break
+                valid.append(line)
+                end = max(end, int(offset) + int(length))
+            if len(valid) < len(lines):
+                with open(index_path, "w", encoding="utf-8") as file:
+                    file.writelines(valid)
+        self.data = open(shard_path, "ab")
+        self.data.truncate(end)
+        self.data.seek(end)
+        self.offset = end
+        self.index = open(index_path, "a", encoding="utf-8")
+        self.pending = []
+
+    def _flush_index(self):
+        self.data.flush()
+        self.index.writelines(self.pending)
+        self.index.flush()
+        self.pending = []
+
+    def append(self, session, session_id=None):
+        session_id = str(session_id if session_id is not None else session["session_id"])
+        if "\t" in session_id or "\n" in session_id:
+            raise ValueError(f"Session id cannot contain tabs or newlines: {session_id!r}")
+        line = dumps(session) + b"\n"
+        if self.offset and self.offset + len(line) > self.max_shard_bytes:
+            self.close()
+            self.shard += 1
+            self._open_shard()
+        self.data.write(line)
+        self.pending.append(f"{session_id}\t{self.offset}\t{len(line)}\n")
+        self.offset += len(line)
+        if len(self.pending) >= INDEX_FLUSH_RECORDS:
+            self._flush_index()
+
+    def close(self):
+        # Data first, so an index entry never points past the end of its shard
+        self._flush_index()
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+class SessionContainer:
+    """
+    Read access to a session container: get by id through mmap, or iterate in file order.
+
+    Sessions are decoded with ``decoder``; pass decode_raw_session for
+    containers of raw EconBiz sessions.
+    """
+
+    def __init__(self, path, decoder=decode_session):
+        if not is_container(path):
+            raise FileNotFoundError(f"Not a session container: {path}")
+        self.path = path
+        self.decoder = decoder
+        self.locations = {}
+        self.shards = sorted(
+            int(name[6:11]) for name in os.listdir(path) if name.endswith(".jsonl")
+        )
+        for shard in self.shards:
+            index_path = os.path.join(path, _index_name(shard))
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    session_id, offset, length = line.rstrip("\n").rsplit("\t", 2)
+                    self.locations[session_id] = (shard, int(offset), int(length))
+        self._maps = {}
+
+    def _map(self, shard):
+        mapped = self._maps.get(shard)
+        if mapped is None:
+            with open(os.path.join(self.path, _shard_name(shard)), "rb") as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[shard] = mapped
+        return mapped
+
+    def get(self, session_id):
+        shard, offset, length = self.locations[str(session_id)]
+        return self.decoder(self._map(shard)[offset : offset + length])
+
+    def __getitem__(self, session_id):
+        return self.get(session_id)
+
+    def __contains__(self, session_id):
+        return str(session_id) in self.locations
+
+    def __len__(self):
+        return len(self.locations)
+
+    def ids(self):
+        return list(self.locations)
+
+    def __iter__(self):
+        """Yield (session_id, session) in file order, skipping superseded copies."""
+        current = {
+            (shard, offset): session_id
+            for session_id, (shard, offset, _) in self.locations.items()
+        }
+        for shard in self.shards:
+            offset = 0
+            with open(os.path.join(self.path, _shard_name(shard)), "rb", buffering=1 << 20) as file:
+                for line in file:
+                    session_id = current.get((shard, offset))
+                    offset += len(line)
+                    if session_id is not None:
+                        yield session_id, self.decoder(line)
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+_open_containers = OrderedDict()  # (path, decoder) -> (index signature, SessionContainer)
+
+
+def _index_signature(path):
+    signature = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".idx"):
+            stat = os.stat(os.path.join(path, name))
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def open_container(path, decoder=decode_session):
+    """
+    Return an open SessionContainer for repeated lookups, reusing it across calls.
+
+    The offset index is parsed once per container; it is reloaded when an
+    index file has changed since. The least recently used containers beyond
+    OPEN_CONTAINERS are closed.
+    """
+    key = (os.path.abspath(path), decoder)
+    signature = _index_signature(path)
+    cached = _open_containers.get(key)
+    if cached is not None and cached[0] == signature:
+        _open_containers.move_to_end(key)
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    container = SessionContainer(path, decoder)
+    _open_containers[key] = (signature, container)
+    _open_containers.move_to_end(key)
+    while len(_open_containers) > OPEN_CONTAINERS:
+        _, (_, evicted) = _open_containers.popitem(last=False)
+        evicted.close()
+    return container
+
+
+def close_containers():
+    while _open_containers:
+        _, (_, container) = _open_containers.popitem()
+        container.close()
+
+
+def iter_sessions(source, decoder=decode_session, session_ids=None):
+    """
+    Yield (name, session) for a session container or a directory of session JSON files.
+
+    For directories the name is the file name without ".json" and the files
+    are visited in os.listdir order, as the per-directory loops did. With
+    ``session_ids`` (e.g. the matches of an inverted index query) only those
+    sessions are read, by id.
+    """
+    if session_ids is not None:
+        if is_container(source):
+            with SessionContainer(source, decoder) as container:
+                for session_id in session_ids:
+                    yield session_id, container.get(session_id)
+            return
+        for session_id in session_ids:
+            with open_input(os.path.join(source, f"{session_id}.json"), "rb") as file:
+                yield session_id, decoder(file.read())
+        return
+    if is_container(source):
+        yield from SessionContainer(source, decoder)
+        return
+    for filename in os.listdir(source):
+        if filename.endswith(".json"):
+            with open_input(os.path.join(source, filename), "rb") as file:
+                yield filename[: -len(".json")], decoder(file.read())
+
+
+# Function to pack a directory of session JSON files into a container
+def pack_sessions(directory, container_path, max_shard_bytes=DEFAULT_MAX_SHARD_BYTES):
+    count = 0
+    with SessionContainerWriter(container_path, max_shard_bytes) as writer:
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".json"):
+                # Passed through untyped, so fields outside the schemas are kept
+                with open_input(os.path.join(directory, filename), "rb") as file:
+                    session = loads(file.read())
+                # Session files are named after their session id
+                writer.append(session, filename[: -len(".json")])
+                count += 1
+    print(f"Packed {count} sessions from {directory} into {container_path}")
+    return count
@@ -1,6 +1,8 @@
 import openai
-from analysis.utils import load_env_vars, get_mapping
-from analysis.data_processing import session_to_human_readable
+import re
+from analysis.utils import load_env_vars
+from analysis.data_processing import ACTION_LINE, session_to_human_readable
+from analysis.taxonomy import compile_taxonomy, remap_session_types
 
 action_mapping = {
     "AdvancedSearch": ["goto_advanced_search", "search_advanced"],
@@ -32,37 +34,420 @@ action_mapping = {
 }
 
 
-def generate_synthetic_action(
-    synthetic_topic, original_session, action_mappings=action_mapping
-):
-    openai.api_key = load_env_vars()
-    system_prompt = {
+END_MARKER = "END"
+# Topology categories whose actions end a session, so generation stops at them
+TERMINAL_CATEGORIES = ("Drop-off",)
+
+
+# Function to collect the known action labels from the action_mapping.csv rows and the mapping above
+def action_vocabulary(action_mappings, action_mapping=action_mapping):
+    vocabulary = set()
+    for row in action_mappings:
+        if isinstance(row, dict):
+            vocabulary.update(
+                row[key] for key in ("action_label", "mapping_action_label") if row.get(key)
+            )
+    for labels in action_mapping.values():
+        vocabulary.update(labels)
+    return vocabulary
+
+
+class StreamingActionParser:
+    """
+    Parse a streamed completion into validated action lines as they arrive.
+
+    Text is fed chunk by chunk; every complete line is matched against the
+    human-readable action format. Prompts carry sessions remapped to SUSS
+    labels (remap_session_types), which the model writes under "Action
+    Type", with the interaction ("click", "submit") under "Action Label";
+    so the action type must be in the vocabulary, and the action label in
+    ``action_labels`` when given (an empty vocabulary or set of labels
+    accepts everything). Parsing is done
+    once the model writes the end marker, emits an action from
+    ``terminal_actions``, or repeats a block of up to ``max_period`` actions
+    ``max_repeats`` times in a row; the repeated copies are dropped.
+    """
+
+    def __init__(
+        self, vocabulary=(), terminal_actions=(), max_period=3, max_repeats=3, action_labels=()
+    ):
+        self.vocabulary = set(vocabulary)
+        self.action_labels = set(action_labels)
+        self.terminal_actions = set(terminal_actions)
+        self.max_period = max_period
+        self.max_repeats = max_repeats
+        self.buffer = ""
+        self.lines = []
+        self.actions = []
+        self.invalid_lines = []
+        self.done = False
+        self.stop_reason = None
+
+    def feed(self, text):
+        if self.done or not text:
+            return self.done
+        self.buffer += text
+        *complete, self.buffer = self.buffer.split("\n")
+        for line in complete:
+            self._line(line)
+            if self.done:
+                break
+        return self.done
+
+    def finish(self):
+        if not self.done and self.buffer:
+            self._line(self.buffer)
+        self.buffer = ""
+        if self.stop_reason is None:
+            self.stop_reason = "end of stream"
+        return self.lines
+
+    def _line(self, line):
+        line = line.strip()
+        if not line:
+            return
+        if line.strip("*.# ").upper() == END_MARKER:
+            self.done, self.stop_reason = True, "end marker"
+            return
+        match = ACTION_LINE.match(line)
+        if not match:
+            # Prose around the list is not an action; only count lines that look like one
+            if "Action Type:" in line:
+                self.invalid_lines.append(line)
+            return
+        _, action_type, action_label, _, params = match.groups()
+        if (self.vocabulary and action_type not in self.vocabulary) or (
+            self.action_labels and action_label not in self.action_labels
+        ):
+            self.invalid_lines.append(line)
+            return
+        self.lines.append(line)
+        self.actions.append((action_type, action_label, params))
+        if action_type in self.terminal_actions or action_label in self.terminal_actions:
+            self.done, self.stop_reason = True, "terminal action"
+        elif self._drop_repetition():
+            self.done, self.stop_reason = True, "repetition"
+
+    def _drop_repetition(self):
+        actions = self.actions
+        for period in range(1, self.max_period + 1):
+            span = period * self.max_repeats
+            if len(actions) < span:
+                break
+            block = actions[-period:]
+            if all(actions[-span + i] == block[i % period] for i in range(span)):
+                keep = len(actions) - span + period
+                del self.actions[keep:]
+                del self.lines[keep:]
+                return True
+        return False
+
+    @property
+    def invalid_share(self):
+        total = len(self.lines) + len(self.invalid_lines)
+        return len(self.invalid_lines) / total if total else 1.0
+
+
+SYSTEM_PROMPT = "You are an intelligent assistant trained to generate synthetic user actions based on historical data of interactions with a digital library. Your responses should reflect plausible user actions that align with the given context of search and interaction patterns within an academic database. The list of actions the user can perform includes: "
+PACKED_INSTRUCTIONS = f" \n You will receive several numbered sessions, each with its own query. For every session, write a line '=== SESSION n ===' with its number, followed only by the list of actions the user takes in the following format: \n Time spent: time_spent seconds; Action Type: action_type; Action Label: action_label; Params: params \n Note that you need to stop the search is the user information intent has been fulfilled. Each search action is done using only one search term at a time \n Write {END_MARKER} on its own line when a session ends, and answer every session in order."
+SESSION_HEADER = re.compile(r"^[=#*\s]*SESSION\s+(\d+)[=#*:\s]*$", re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English prompts
+    return len(text) // 4 + 1
+
+
+def system_message(action_mappings, instructions=""):
+    return {
         "role": "system",
-        "content": "You are an intelligent assistant trained to generate synthetic user actions based on historical data of interactions with a digital library. Your responses should reflect plausible user actions that align with the given context of search and interaction patterns within an academic database. The list of actions the user can perform includes: "
-        + ", ".join([mapping["action_label"] for mapping in action_mappings]),
+        "content": SYSTEM_PROMPT
+        + ", ".join([mapping["action_label"] for mapping in action_mappings])
+        + instructions,
     }
 
+
+def _count_request(report, messages):
+    if report is not None:
+        report["requests"] = report.get("requests", 0) + 1
+        report["input_tokens"] = report.get("input_tokens", 0) + sum(
+            estimate_tokens(message["content"]) for message in messages
+        )
+
+
+# Function to stream a chat completion into feed() until it reports that parsing is done
+def _stream_completion(client, messages, feed, model, max_tokens):
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=0.2,
+        max_tokens=max_tokens,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and feed(chunk.choices[0].delta.content):
+                break
+    finally:
+        # Closing the stream stops generation, so no tokens are spent after the end
+        stream.close()
+
+
+def generate_synthetic_action(
+    synthetic_topic,
+    original_session,
+    action_mappings=action_mapping,
+    vocabulary=None,
+    terminal_actions=(),
+    max_invalid_share=0.3,
+    max_retries=2,
+    model="gpt-4",
+    max_tokens=2000,
+    client=None,
+    report=None,
+):
+    """
+    Generate the synthetic actions for a topic, streaming and validating the completion.
+
+    The completion is parsed line by line while it streams (see
+    StreamingActionParser) and the stream is closed as soon as the session
+    has ended. If more than ``max_invalid_share`` of the action lines fail
+    validation the request is retried, up to ``max_retries`` times; the
+    attempt with the lowest share of invalid lines is kept. Returns the valid action
+    lines as text for human_readable_to_session.
+    """
+    client = client or openai.OpenAI(api_key=load_env_vars())
+    if vocabulary is None:
+        vocabulary = action_vocabulary(action_mappings)
+    system_prompt = system_message(action_mappings)
+
     few_shot_messages = [system_prompt]
     current_action_prompt = {
         "role": "user",
-        "content": f"Query: {synthetic_topic} \n Context: {synthetic_topic}, Session: \n {original_session} \n The response should contain only a list of actions the user takes in the following format: \n Time spent: time_spent seconds; Action Type: action_type; Action Label: action_label, Params: params \n Note that you need to stop the search is the user information intent has been fulfilled. Each search action is done using only one search term at a time \n Response:",
+        "content": f"Query: {synthetic_topic} \n Context: {synthetic_topic}, Session: \n {original_session} \n The response should contain only a list of actions the user takes in the following format: \n Time spent: time_spent seconds; Action Type: action_type; Action Label: action_label; Params: params \n Note that you need to stop the search is the user information intent has been fulfilled. Each search action is done using only one search term at a time \n Write {END_MARKER} on its own line when the session ends. \n Response:",
     }
     few_shot_messages.append(current_action_prompt)
 
-    response = openai.ChatCompletion.create(
-        model="gpt-4", messages=few_shot_messages, temperature=0.2, max_tokens=2000
+    best = None
+    for _ in range(max_retries + 1):
+        parser = StreamingActionParser(vocabulary, terminal_actions)
+        _count_request(report, few_shot_messages)
+        _stream_completion(client, few_shot_messages, parser.feed, model, max_tokens)
+        parser.finish()
+        if best is None or parser.invalid_share < best.invalid_share:
+            best = parser
+        if parser.lines and parser.invalid_share <= max_invalid_share:
+            break
+    return "\n".join(best.lines)
+
+
+class PackedActionParser:
+    """
+    Split a streamed multi-session completion by its '=== SESSION n ===' headers.
+
+    The lines under each header go to that session's StreamingActionParser.
+    Lines outside a known session are ignored. Parsing is done once every
+    session has ended.
+    """
+
+    def __init__(self, parsers):
+        self.parsers = parsers
+        self.seen = set()
+        self.current = None
+        self.buffer = ""
+
+    def feed(self, text):
+        if not text:
+            return False
+        self.buffer += text
+        *complete, self.buffer = self.buffer.split("\n")
+        for line in complete:
+            self._line(line)
+        return self.done
+
+    def _line(self, line):
+        match = SESSION_HEADER.match(line)
+        if match:
+            number = int(match.group(1)) - 1
+            self.current = number if 0 <= number < len(self.parsers) else None
+            if self.current is not None:
+                self.seen.add(self.current)
+            return
+        if self.current is not None:
+            self.parsers[self.current].feed(line + "\n")
+
+    @property
+    def done(self):
+        return all(parser.done for parser in self.parsers)
+
+    def finish(self):
+        if self.buffer:
+            self._line(self.buffer)
+            self.buffer = ""
+        for parser in self.parsers:
+            parser.finish()
+
+
+# Function to group prompts into requests under an input token budget
+def pack_prompts(prompt_tokens, prefix_tokens, token_budget, max_sessions):
+    batches, batch, used = [], [], prefix_tokens
+    for index, tokens in enumerate(prompt_tokens):
+        if batch and (used + tokens > token_budget or len(batch) == max_sessions):
+            batches.append(batch)
+            batch, used = [], prefix_tokens
+        batch.append(index)
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def generate_synthetic_actions_packed(
+    prompts,
+    action_mappings=action_mapping,
+    vocabulary=None,
+    terminal_actions=(),
+    max_invalid_share=0.3,
+    token_budget=6000,
+    max_sessions=8,
+    model="gpt-4",
+    max_tokens_per_session=2000,
+    client=None,
+    report=None,
+):
+    """
+    Generate the synthetic actions of several (topic, session text) prompts with few requests.
+
+    Prompts are packed into requests of at most ``max_sessions`` sessions and
+    ``token_budget`` estimated input tokens; the completion of a request may
+    use ``max_tokens_per_session`` tokens per packed session, the limit of a
+    single-session request. The system message with the
+    action list and the output format is the same for every request, so
+    providers can cache it as a shared prefix. The streamed completion is
+    split by session headers and every session is validated on its own; a
+    session that is missing, empty or has more than ``max_invalid_share``
+    invalid lines falls back to a single-session request. Returns one text
+    per prompt, in order.
+    """
+    client = client or openai.OpenAI(api_key=load_env_vars())
+    if vocabulary is None:
+        vocabulary = action_vocabulary(action_mappings)
+    system_prompt = system_message(action_mappings, PACKED_INSTRUCTIONS)
+    blocks = [
+        f"Query: {topic} \n Context: {topic}, Session: \n {session_text}\n"
+        for topic, session_text in prompts
+    ]
+    batches = pack_prompts(
+        [estimate_tokens(block) for block in blocks],
+        estimate_tokens(system_prompt["content"]),
+        token_budget,
+        max_sessions,
     )
 
-    return response.choices[0].message.content
+    results = [None] * len(prompts)
+    for batch in batches:
+        parsers = [StreamingActionParser(vocabulary, terminal_actions) for _ in batch]
+        packed = PackedActionParser(parsers)
+        messages = [
+            system_prompt,
+            {
+                "role": "user",
+                "content": "".join(
+                    f"### SESSION {number} ###\n{blocks[index]}"
+                    for number, index in enumerate(batch, 1)
+                )
+                + "Response:",
+            },
+        ]
+        _count_request(report, messages)
+        _stream_completion(
+            client, messages, packed.feed, model, max_tokens_per_session * len(batch)
+        )
+        packed.finish()
+        for number, (index, parser) in enumerate(zip(batch, parsers)):
+            if (
+                number in packed.seen
+                and parser.lines
+                and parser.invalid_share <= max_invalid_share
+            ):
+                results[index] = "\n".join(parser.lines)
+                continue
+            if report is not None:
+                report["fallbacks"] = report.get("fallbacks", 0) + 1
+            topic, session_text = prompts[index]
+            results[index] = generate_synthetic_action(
+                topic,
+                session_text,
+                action_mappings,
+                vocabulary=vocabulary,
+                terminal_actions=terminal_actions,
+                max_invalid_share=max_invalid_share,
+                model=model,
+                max_tokens=max_tokens_per_session,
+                client=client,
+                report=report,
+            )
+    if report is not None:
+        report["sessions"] = report.get("sessions", 0) + len(prompts)
+    return results
 
 
 def create_synthetic_session(
-    original_session, synthetic_topic, action_mappings, action_mapping=action_mapping
+    original_session,
+    synthetic_topic,
+    action_mappings,
+    action_mapping=action_mapping,
+    taxonomy=None,
+    seed=None,
+    terminal_actions=None,
+    client=None,
 ):
-    for action in original_session["actions"]:
-        action["action_type"] = get_mapping(action["action_type"], action_mapping)
+    if taxonomy is None:
+        taxonomy = compile_taxonomy(action_mapping=action_mapping, csv_rows=action_mappings)
+    if terminal_actions is None:
+        terminal_actions = taxonomy.labels_in(TERMINAL_CATEGORIES)
+    # The remapped copy leaves original_session untouched
+    remapped_session = remap_session_types(original_session, taxonomy, seed)
 
     synthetic_response = generate_synthetic_action(
-        synthetic_topic, session_to_human_readable(original_session), action_mappings
+        synthetic_topic,
+        session_to_human_readable(remapped_session),
+        action_mappings,
+        terminal_actions=terminal_actions,
+        client=client,
     )
     return synthetic_response
+
+
+def create_synthetic_sessions(
+    original_sessions,
+    synthetic_topics,
+    action_mappings,
+    action_mapping=action_mapping,
+    taxonomy=None,
+    seeds=None,
+    token_budget=6000,
+    max_sessions=8,
+    report=None,
+    terminal_actions=None,
+    client=None,
+):
+    """Packed counterpart of create_synthetic_session for lists of sessions and topics."""
+    if taxonomy is None:
+        taxonomy = compile_taxonomy(action_mapping=action_mapping, csv_rows=action_mappings)
+    if terminal_actions is None:
+        terminal_actions = taxonomy.labels_in(TERMINAL_CATEGORIES)
+    seeds = seeds or [None] * len(original_sessions)
+    prompts = [
+        (topic, session_to_human_readable(remap_session_types(session, taxonomy, seed)))
+        for session, topic, seed in zip(original_sessions, synthetic_topics, seeds)
+    ]
+    return generate_synthetic_actions_packed(
+        prompts,
+        action_mappings,
+        terminal_actions=terminal_actions,
+        token_budget=token_budget,
+        max_sessions=max_sessions,
+        client=client,
+        report=report,
+    )
@@ -0,0 +1,351 @@
+import json
+import math
+import os
+import sys
+from array import array
+from analysis.codec import read_session
+from analysis.utils import timestamp_to_epoch_ms, epoch_ms_to_timestamp
+
+
+MISSING = -(2**63)  # Sentinel for absent integer fields
+ACTION_KEYS = (
+    "action_id",
+    "timestamp",
+    "action_type",
+    "action_label",
+    "action_length",
+    "params",
+    "origin_action",
+)
+
+
+class Vocabulary:
+    """Interned label vocabulary mapping strings to dense integer codes."""
+
+    __slots__ = ("codes", "labels")
+
+    def __init__(self, labels=()):
+        self.codes = {}
+        self.labels = []
+        for label in labels:
+            self.code(label)
+
+    def code(self, label):
+        code = self.codes.get(label)
+        if code is None:
+            code = len(self.labels)
+            label = sys.intern(label)
+            self.codes[label] = code
+            self.labels.append(label)
+        return code
+
+    def label(self, code):
+        return self.labels[code]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.codes
+
+
+class ParamsBuffer:
+    """Append-only byte buffer holding the encoded params of every action."""
+
+    __slots__ = ("data",)
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def append(self, params):
+        # Empty strings take no space; other strings and JSON values carry a one-byte tag
+        if params == "":
+            return len(self.data), 0
+        if isinstance(params, str):
+            encoded = b"s" + params.encode("utf-8")
+        else:
+            encoded = b"j" + json.dumps(params, separators=(",", ":")).encode("utf-8")
+        offset = len(self.data)
+        self.data += encoded
+        return offset, len(encoded)
+
+    def get(self, offset, length):
+        if not length:
+            return ""
+        encoded = bytes(self.data[offset : offset + length])
+        if encoded[:1] == b"s":
+            return encoded[1:].decode("utf-8")
+        return json.loads(encoded[1:])
+
+    def raw(self, offset, length):
+        return bytes(self.data[offset : offset + length])
+
+
+class SessionStore:
+    """Shared vocabulary and params buffer for a set of compact sessions."""
+
+    __slots__ = ("vocabulary", "params", "sessions")
+
+    def __init__(self):
+        self.vocabulary = Vocabulary()
+        self.params = ParamsBuffer()
+        self.sessions = []
+
+    def new_session(self, session_id=None, session_length=0, user_id=-1):
+        session = Session(self, session_id, session_length, user_id)
+        self.sessions.append(session)
+        return session
+
+    def session_from_dict(self, data):
+        session = self.new_session(
+            data.get("session_id"), data.get("session_length", 0), data.get("user_id", -1)
+        )
+        session["start_date"] = data.get("start_date")
+        session["end_date"] = data.get("end_date")
+        for action in data["actions"]:
+            session.append_action(action)
+        return session
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class Session:
+    """
+    Compact session with struct-of-arrays action columns.
+
+    Timestamps are integer epoch milliseconds, action types, labels and origins
+    are codes into the store's vocabulary and params are offsets into its
+    shared buffer. The session behaves like the JSON session dict (read-only
+    mapping access and ``session["actions"]``), so the analysis functions accept
+    it unchanged; ``to_dict`` returns the JSON shape.
+    """
+
+    __slots__ = (
+        "store",
+        "session_id",
+        "session_length",
+        "user_id",
+        "start_ms",
+        "end_ms",
+        "has_click",
+        "action_ids",
+        "timestamps",
+        "type_codes",
+        "label_codes",
+        "origin_codes",
+        "lengths",
+        "param_offsets",
+        "param_lengths",
+    )
+
+    def __init__(self, store, session_id=None, session_length=0, user_id=-1):
+        self.store = store
+        self.session_id = session_id
+        self.session_length = session_length
+        self.user_id = user_id
+        self.start_ms = MISSING
+        self.end_ms = MISSING
+        self.has_click = False
+        self.action_ids = array("q")
+        self.timestamps = array("q")
+        self.type_codes = array("i")
+        self.label_codes = array("i")
+        self.origin_codes = array("i")
+        self.lengths = array("d")
+        self.param_offsets = array("q")
+        self.param_lengths = array("i")
+
+    def append_action(self, action):
+        vocabulary = self.store.vocabulary
+        action_id = action.get("action_id")
+        self.action_ids.append(MISSING if action_id is None else action_id)
+        self.timestamps.append(timestamp_to_epoch_ms(action["timestamp"]))
+        self.type_codes.append(vocabulary.code(action["action_type"]))
+        self.label_codes.append(vocabulary.code(action["action_label"]))
+        origin = action.get("origin_action")
+        self.origin_codes.append(-1 if origin is None else vocabulary.code(origin))
+        length = action.get("action_length")
+        self.lengths.append(math.nan if length is None else length)
+        offset, size = self.store.params.append(action.get("params", ""))
+        self.param_offsets.append(offset)
+        self.param_lengths.append(size)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, key):
+        if key == "actions":
+            return ActionList(self)
+        if key == "session_id":
+            if self.session_id is None:
+                raise KeyError(key)
+            return self.session_id
+        if key == "session_length":
+            return self.session_length
+        if key == "user_id":
+            return self.user_id
+        if key == "start_date":
+            return None if self.start_ms == MISSING else epoch_ms_to_timestamp(self.start_ms)
+        if key == "end_date":
+            return None if self.end_ms == MISSING else epoch_ms_to_timestamp(self.end_ms)
+        if key == "has_click":
+            return self.has_click
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in ("start_date", "end_date"):
+            value = MISSING if value is None else timestamp_to_epoch_ms(value)
+            setattr(self, "start_ms" if key == "start_date" else "end_ms", value)
+        elif key in ("session_id", "session_length", "user_id", "has_click"):
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = ["session_length", "user_id", "start_date", "end_date", "actions"]
+        if self.session_id is not None:
+            keys.insert(0, "session_id")
+        return keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def to_dict(self):
+        return {
+            key: (
+                [action.to_dict() for action in self["actions"]]
+                if key == "actions"
+                else self[key]
+            )
+            for key in self.keys()
+        }
+
+
+class ActionList:
+    """Sequence view over the actions of a compact session."""
+
+    __slots__ = ("session",)
+
+    def __init__(self, session):
+        self.session = session
+
+    def __len__(self):
+        return len(self.session)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ActionView(self.session, i) for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("action index out of range")
+        return ActionView(self.session, index)
+
+    def __iter__(self):
+        session = self.session
+        return (ActionView(session, index) for index in range(len(session)))
+
+    def append(self, action):
+        self.session.append_action(action)
+
+
+class ActionView:
+    """Dict-like view of a single action of a compact session."""
+
+    __slots__ = ("session", "index")
+
+    def __init__(self, session, index):
+        self.session = session
+        self.index = index
+
+    def __getitem__(self, key):
+        session, index = self.session, self.index
+        vocabulary = session.store.vocabulary
+        if key == "action_type":
+            return vocabulary.labels[session.type_codes[index]]
+        if key == "action_label":
+            return vocabulary.labels[session.label_codes[index]]
+        if key == "params":
+            return session.store.params.get(
+                session.param_offsets[index], session.param_lengths[index]
+            )
+        if key == "timestamp":
+            return epoch_ms_to_timestamp(session.timestamps[index])
+        if key == "action_id" and session.action_ids[index] != MISSING:
+            return session.action_ids[index]
+        if key == "action_length" and not math.isnan(session.lengths[index]):
+            length = session.lengths[index]
+            return int(length) if length.is_integer() else length
+        if key == "origin_action" and session.origin_codes[index] >= 0:
+            return vocabulary.labels[session.origin_codes[index]]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        session, index = self.session, self.index
+        present = {
+            "action_id": session.action_ids[index] != MISSING,
+            "action_length": not math.isnan(session.lengths[index]),
+            "origin_action": session.origin_codes[index] >= 0,
+        }
+        return [key for key in ACTION_KEYS if present.get(key, True)]
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def _values(self):
+        session, index = self.session, self.index
+        return (
+            session.action_ids[index],
+            session.timestamps[index],
+            session.type_codes[index],
+            session.label_codes[index],
+            session.origin_codes[index],
+            None if math.isnan(session.lengths[index]) else session.lengths[index],
+            session.store.params.raw(
+                session.param_offsets[index], session.param_lengths[index]
+            ),
+        )
+
+    def __eq__(self, other):
+        if isinstance(other, ActionView):
+            if other.session is self.session and other.index == self.index:
+                return True
+            if other.session.store is self.session.store:
+                return self._values() == other._values()
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+
+def as_dict(session):
+    """Return the JSON dict shape of a session, whether it is compact or already a dict."""
+    return session.to_dict() if isinstance(session, Session) else session
+
+
+# Function to load every session JSON file of a directory into a compact store
+def load_compact_sessions(directory, store=None):
+    store = store if store is not None else SessionStore()
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".json"):
+            store.session_from_dict(read_session(os.path.join(directory, filename)))
+    return store
@@ -0,0 +1,189 @@
+import csv
+import heapq
+import os
+from collections import OrderedDict
+from analysis.codec import dumps, loads
+from analysis.compression import open_input
+from analysis.utils import timestamp_to_epoch_ms
+
+
+DEFAULT_INACTIVITY_TIMEOUT_MINUTES = 30
+DEFAULT_SPLIT_HORIZON_MINUTES = 24 * 60
+
+
+# Function to stream (timestamp_ms, key, session_id, event, metadata) tuples from a time-ordered NDJSON log
+def iter_ndjson_events(file_path, key_field="session_id"):
+    with open_input(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = loads(line)
+            session_id = record["session_id"]
+            key = record.get(key_field, session_id)
+            metadata = {k: v for k, v in record.items() if k != "events"}
+            for event in record.get("events", []):
+                yield event["cts"], key, session_id, event, metadata
+
+
+# Function to stream (timestamp_ms, key, session_id, row, None) tuples from a time-ordered SUSS CSV log
+def iter_csv_events(file_path, key_field="session_id"):
+    with open_input(file_path, "r", encoding="utf-8", newline="") as file:
+        for row in csv.DictReader(file):
+            timestamp_ms = timestamp_to_epoch_ms(row["date"])
+            yield timestamp_ms, row[key_field], row["session_id"], row, None
+
+
+def merge_event_streams(streams):
+    """Merge time-ordered event streams into a single time-ordered stream."""
+    return heapq.merge(*streams, key=lambda item: item[0])
+
+
+def sessionize(
+    events,
+    inactivity_timeout_minutes,
+    report,
+    split_horizon_minutes=DEFAULT_SPLIT_HORIZON_MINUTES,
+):
+    """
+    Re-split a time-ordered event stream into sessions using an inactivity timeout.
+
+    Sessions are keyed by the stream key (session or user id) and closed as soon as
+    the stream has advanced past their last event by more than the timeout, so only
+    the currently active sessions are held in memory. To count and name the pieces
+    of a split session, an original session id is remembered until the stream has
+    advanced ``split_horizon_minutes`` past its last event; an id that reappears
+    after that is counted as a new session.
+
+    Parameters:
+    - events: Iterable of (timestamp_ms, key, session_id, record, metadata) tuples in time order.
+    - inactivity_timeout_minutes: Gap after which the next event of a key starts a new session.
+    - report: Dictionary updated in place with event and session counts.
+    - split_horizon_minutes: How long an original session id is remembered after its last event.
+
+    Yields (new_session_id, start_ms, end_ms, records, metadata) for every closed session.
+    """
+    timeout_ms = int(inactivity_timeout_minutes * 60 * 1000)
+    horizon_ms = max(int(split_horizon_minutes * 60 * 1000), timeout_ms)
+    active = OrderedDict()  # key -> [start_ms, last_ms, session_id, records, metadata]
+    # Original session id -> [sessions it was split into so far, last event ms], oldest first
+    recent = OrderedDict()
+    report.update(
+        events=0,
+        out_of_order_events=0,
+        sessions_before=0,
+        sessions_after=0,
+        sessions_split=0,
+    )
+
+    def close(key, state):
+        start_ms, last_ms, session_id, records, metadata = state
+        seen = recent.get(session_id)
+        pieces = seen[0] if seen is not None else 0
+        if key == session_id and pieces == 0:
+            new_session_id = session_id
+        else:
+            new_session_id = f"{key}_{start_ms}"
+        if seen is not None:
+            seen[0] += 1
+            if seen[0] == 2:
+                report["sessions_split"] += 1
+        report["sessions_after"] += 1
+        return new_session_id, start_ms, last_ms, records, metadata
+
+    for timestamp_ms, key, session_id, record, metadata in events:
+        report["events"] += 1
+        seen = recent.get(session_id)
+        if seen is None:
+            recent[session_id] = [0, timestamp_ms]
+            report["sessions_before"] += 1
+        else:
+            seen[1] = max(seen[1], timestamp_ms)
+            recent.move_to_end(session_id)
+
+        # Active sessions are ordered by their last event, so expired ones sit at the front
+        while active:
+            oldest_key, oldest_state = next(iter(active.items()))
+            if timestamp_ms - oldest_state[1] <= timeout_ms:
+                break
+            del active[oldest_key]
+            yield close(oldest_key, oldest_state)
+
+        while recent:
+            oldest_id, (_, last_ms) = next(iter(recent.items()))
+            if timestamp_ms - last_ms <= horizon_ms:
+                break
+            del recent[oldest_id]
+
+        state = active.get(key)
+        if state is None:
+            state = [timestamp_ms, timestamp_ms, session_id, [], metadata]
+            active[key] = state
+        elif timestamp_ms < state[1]:
+            report["out_of_order_events"] += 1
+        state[1] = max(state[1], timestamp_ms)
+        state[3].append(record)
+        active.move_to_end(key)
+
+    for key, state in list(active.items()):
+        yield close(key, state)
+
+
+def print_sessionization_report(report):
+    print("Sessionization Summary:")
+    print(f"  Events processed      = {report['events']}")
+    print(f"  Out-of-order events   = {report['out_of_order_events']}")
+    print(f"  Sessions before split = {report['sessions_before']}")
+    print(f"  Sessions after split  = {report['sessions_after']}")
+    print(f"  Sessions split        = {report['sessions_split']}")
+
+
+# Function to re-split NDJSON session logs (EconBiz format) into a new NDJSON file
+def sessionize_ndjson(
+    input_paths,
+    output_path,
+    key_field="session_id",
+    inactivity_timeout_minutes=DEFAULT_INACTIVITY_TIMEOUT_MINUTES,
+):
+    report = {}
+    streams = [iter_ndjson_events(path, key_field) for path in input_paths]
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "wb") as output:
+        for session_id, _, _, events, metadata in sessionize(
+            merge_event_streams(streams), inactivity_timeout_minutes, report
+        ):
+            session = dict(metadata)
+            session["original_session_id"] = session["session_id"]
+            session["session_id"] = session_id
+            session["events"] = events
+            output.write(dumps(session) + b"\n")
+    print_sessionization_report(report)
+    return report
+
+
+# Function to re-split SUSS CSV logs into a new CSV file with rewritten session ids
+def sessionize_csv(
+    input_paths,
+    output_path,
+    key_field="session_id",
+    inactivity_timeout_minutes=DEFAULT_INACTIVITY_TIMEOUT_MINUTES,
+):
+    report = {}
+    with open_input(input_paths[0], "r", encoding="utf-8", newline="") as file:
+        fieldnames = next(csv.reader(file))
+    streams = [iter_csv_events(path, key_field) for path in input_paths]
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", newline="", encoding="utf-8") as output:
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+        for session_id, start_ms, end_ms, rows, _ in sessionize(
+            merge_event_streams(streams), inactivity_timeout_minutes, report
+        ):
+            session_length = (end_ms - start_ms) // 1000
+            for row in rows:
+                row["session_id"] = session_id
+                row["session_length"] = session_length
+                writer.writerow(row)
+    print_sessionization_report(report)
+    return report
@@ -0,0 +1,450 @@
+import base64
+import hashlib
+import heapq
+import math
+import zlib
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile/histogram sketch with logarithmic buckets (DDSketch-style).
+
+    Values are counted in buckets whose width grows geometrically, so every
+    quantile is answered within the configured relative accuracy. Two sketches
+    with the same accuracy share bucket boundaries, which makes them directly
+    mergeable and comparable bucket by bucket. Count, sum, sum of squares, min
+    and max are tracked exactly, so mean and standard deviation are exact
+    (min and max become bucket estimates once an extreme is removed from an
+    inexact sketch).
+    Until more than ``max_exact_values`` distinct values have been seen, the
+    values themselves are kept too and quantiles are exact.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_exact_values=1024):
+        self.relative_accuracy = relative_accuracy
+        self.max_exact_values = max_exact_values
+        self.exact = {}
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _key(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key):
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if self.exact is not None:
+            self.exact[value] = self.exact.get(value, 0) + count
+            if len(self.exact) > self.max_exact_values:
+                self.exact = None
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+        self.sum += value * count
+        self.sum_squares += value * value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def remove(self, value, count=1):
+        """Retract a value added earlier (bucket counts, sums and exact values)."""
+        if self.exact is not None:
+            remaining = self.exact.get(value, 0) - count
+            if remaining > 0:
+                self.exact[value] = remaining
+            else:
+                self.exact.pop(value, None)
+        buckets = self.positive if value > 0 else self.negative
+        if value:
+            key = self._key(abs(value))
+            buckets[key] = buckets.get(key, 0) - count
+            if buckets[key] <= 0:
+                del buckets[key]
+        else:
+            self.zero_count -= count
+        self.count -= count
+        self.sum -= value * count
+        self.sum_squares -= value * value * count
+        if not self.count:
+            self.min, self.max = math.inf, -math.inf
+        elif self.exact is not None:
+            self.min, self.max = min(self.exact), max(self.exact)
+        else:
+            # Without the exact values, a retracted extreme is replaced by the
+            # representative of the outermost non-empty bucket (within the accuracy)
+            if self._rank(value) <= self._rank(self.min):
+                self.min = self._lowest()
+            if self._rank(value) >= self._rank(self.max):
+                self.max = self._highest()
+
+    def _rank(self, value):
+        """Sortable position of the bucket holding a value."""
+        if value > 0:
+            return (1, self._key(value))
+        if value < 0:
+            return (-1, -self._key(-value))
+        return (0, 0)
+
+    def _lowest(self):
+        if self.negative:
+            return -self._value(max(self.negative))
+        if self.zero_count:
+            return 0
+        return self._value(min(self.positive))
+
+    def _highest(self):
+        if self.positive:
+            return self._value(max(self.positive))
+        if self.zero_count:
+            return 0
+        return -self._value(min(self.negative))
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracies")
+        if self.exact is not None and other.exact is not None:
+            for value, count in other.exact.items():
+                self.exact[value] = self.exact.get(value, 0) + count
+            if len(self.exact) > self.max_exact_values:
+                self.exact = None
+        else:
+            self.exact = None
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def items(self):
+        """Return the sketch as sorted (value, count) pairs; values are bucket representatives once inexact."""
+        if self.exact is not None:
+            return sorted(self.exact.items())
+        items = [(-self._value(key), count) for key, count in self.negative.items()]
+        if self.zero_count:
+            items.append((0.0, self.zero_count))
+        items.extend((self._value(key), count) for key, count in self.positive.items())
+        return sorted(items)
+
+    def bucket_counts(self):
+        """Return the sketch as a {bucket: count} mapping with comparable bucket ids."""
+        counts = {("-", key): count for key, count in self.negative.items()}
+        if self.zero_count:
+            counts[("0", 0)] = self.zero_count
+        counts.update((("+", key), count) for key, count in self.positive.items())
+        return counts
+
+    def _value_at_rank(self, items, rank):
+        seen = 0
+        for value, count in items:
+            seen += count
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def quantile(self, q):
+        """Quantile with linear interpolation between ranks, like pandas and statistics.median."""
+        if not self.count:
+            return 0.0
+        items = self.items()
+        position = q * (self.count - 1)
+        lower = math.floor(position)
+        lower_value = self._value_at_rank(items, lower)
+        if position == lower:
+            return lower_value
+        upper_value = self._value_at_rank(items, lower + 1)
+        return lower_value + (upper_value - lower_value) * (position - lower)
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def stdev(self):
+        """Sample standard deviation, matching statistics.stdev."""
+        if self.count < 2:
+            return 0.0
+        variance = (self.sum_squares - self.sum * self.sum / self.count) / (
+            self.count - 1
+        )
+        return math.sqrt(max(variance, 0.0))
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_exact_values": self.max_exact_values,
+            "exact": (
+                None if self.exact is None else [[v, c] for v, c in self.exact.items()]
+            ),
+            "positive": {str(key): count for key, count in self.positive.items()},
+            "negative": {str(key): count for key, count in self.negative.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "sum": self.sum,
+            "sum_squares": self.sum_squares,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["relative_accuracy"], data["max_exact_values"])
+        sketch.exact = (
+            None if data["exact"] is None else {v: c for v, c in data["exact"]}
+        )
+        sketch.positive = {int(key): count for key, count in data["positive"].items()}
+        sketch.negative = {int(key): count for key, count in data["negative"].items()}
+        sketch.zero_count = data["zero_count"]
+        sketch.count = data["count"]
+        sketch.sum = data["sum"]
+        sketch.sum_squares = data["sum_squares"]
+        sketch.min = data["min"] if data["min"] is not None else math.inf
+        sketch.max = data["max"] if data["max"] is not None else -math.inf
+        return sketch
+
+
+class HyperLogLog:
+    """
+    Mergeable distinct-count sketch (HyperLogLog with 64-bit hashes).
+
+    The sketch keeps 2**precision one-byte registers, so precision 12 uses 4 KiB
+    and has a standard error of about 1.6% (1.04 / sqrt(2**precision)).
+    Sketches with the same precision merge by taking the register maxima.
+    """
+
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode("utf-8")
+        hashed = int.from_bytes(
+            hashlib.blake2b(value, digest_size=8).digest(), "little"
+        )
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - remaining.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0**-register for register in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate for small cardinalities
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_dict(self):
+        return {
+            "precision": self.precision,
+            "registers": base64.b64encode(zlib.compress(bytes(self.registers))).decode(
+                "ascii"
+            ),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["precision"])
+        sketch.registers = bytearray(zlib.decompress(base64.b64decode(data["registers"])))
+        return sketch
+
+
+class SpaceSaving:
+    """
+    Mergeable top-k heavy-hitter sketch (Space-Saving).
+
+    At most ``capacity`` items are counted. When a new item arrives and the
+    sketch is full, it replaces the item with the smallest count and inherits
+    that count as its error, so every reported count overestimates the true
+    count by at most ``error`` (and by at most total / capacity).
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+        # Lazy min-heap of (count, item); stale entries are skipped when popped
+        self._heap = []
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counters[item][0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                del self.counters[item]
+                return count
+
+    def min_count(self):
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def add(self, item, count=1):
+        self.total += count
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+        else:
+            evicted = self._pop_min()
+            self.counters[item] = [evicted + count, evicted]
+        self._push(item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def merge(self, other):
+        """Merge another sketch; items missing from a full sketch are credited with its minimum count."""
+        self_min, other_min = self.min_count(), other.min_count()
+        merged = {}
+        for item in set(self.counters) | set(other.counters):
+            count1, error1 = self.counters.get(item, (self_min, self_min))
+            count2, error2 = other.counters.get(item, (other_min, other_min))
+            merged[item] = [count1 + count2, error1 + error2]
+        capacity = max(self.capacity, other.capacity)
+        top = heapq.nlargest(capacity, merged.items(), key=lambda entry: entry[1][0])
+        self.capacity = capacity
+        self.counters = dict(top)
+        self.total += other.total
+        self._heap = [(count, item) for item, (count, _) in self.counters.items()]
+        heapq.heapify(self._heap)
+        return self
+
+    def top(self, n=10):
+        """Return the n most frequent items as (item, count, error) triples."""
+        top = heapq.nlargest(n, self.counters.items(), key=lambda entry: entry[1][0])
+        return [(item, count, error) for item, (count, error) in top]
+
+    def to_dict(self):
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "counters": [[item, count, error] for item, (count, error) in self.counters.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["capacity"])
+        sketch.total = data["total"]
+        sketch.counters = {item: [count, error] for item, count, error in data["counters"]}
+        sketch._heap = [(count, item) for item, (count, _) in sketch.counters.items()]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+# Function to turn two sketches into aligned probability vectors over their joint buckets
+def _aligned_distributions(sketch1, sketch2):
+    counts1 = sketch1.bucket_counts()
+    counts2 = sketch2.bucket_counts()
+    buckets = set(counts1) | set(counts2)
+    p = [counts1.get(bucket, 0) / sketch1.count for bucket in buckets]
+    q = [counts2.get(bucket, 0) / sketch2.count for bucket in buckets]
+    return p, q
+
+
+def kl_divergence(sketch1, sketch2, epsilon=1e-10):
+    """KL(P || Q) in bits; empty buckets are smoothed with epsilon."""
+    if not sketch1.count or not sketch2.count:
+        return 0.0
+    p, q = _aligned_distributions(sketch1, sketch2)
+    p_total = 1 + epsilon * len(p)
+    q_total = 1 + epsilon * len(q)
+    return sum(
+        ((pi + epsilon) / p_total)
+        * math.log2(((pi + epsilon) / p_total) / ((qi + epsilon) / q_total))
+        for pi, qi in zip(p, q)
+    )
+
+
+def js_divergence(sketch1, sketch2):
+    """Jensen-Shannon divergence in bits (bounded by 1)."""
+    if not sketch1.count or not sketch2.count:
+        return 0.0
+    p, q = _aligned_distributions(sketch1, sketch2)
+    divergence = 0.0
+    for pi, qi in zip(p, q):
+        mi = (pi + qi) / 2
+        if pi:
+            divergence += 0.5 * pi * math.log2(pi / mi)
+        if qi:
+            divergence += 0.5 * qi * math.log2(qi / mi)
+    return divergence
+
+
+# Function to walk the joint support of two sketches, yielding (value, cdf1, cdf2)
+def _joint_cdf(sketch1, sketch2):
+    points = {}
+    for value, count in sketch1.items():
+        points.setdefault(value, [0, 0])[0] += count
+    for value, count in sketch2.items():
+        points.setdefault(value, [0, 0])[1] += count
+    cumulative1 = cumulative2 = 0
+    for value in sorted(points):
+        cumulative1 += points[value][0]
+        cumulative2 += points[value][1]
+        yield value, cumulative1 / sketch1.count, cumulative2 / sketch2.count
+
+
+def wasserstein_distance(sketch1, sketch2):
+    """First Wasserstein (earth mover's) distance between the two distributions."""
+    if not sketch1.count or not sketch2.count:
+        return 0.0
+    distance = 0.0
+    previous = None
+    for value, cdf1, cdf2 in _joint_cdf(sketch1, sketch2):
+        if previous is not None:
+            distance += abs(previous[1] - previous[2]) * (value - previous[0])
+        previous = (value, cdf1, cdf2)
+    return distance
+
+
+def ks_statistic(sketch1, sketch2):
+    """Two-sample Kolmogorov-Smirnov statistic (maximum CDF difference)."""
+    if not sketch1.count or not sketch2.count:
+        return 0.0
+    return max(abs(cdf1 - cdf2) for _, cdf1, cdf2 in _joint_cdf(sketch1, sketch2))
@@ -0,0 +1,327 @@
+import json
+import os
+import sqlite3
+from analysis.codec import read_session
+from analysis.session_analysis import count_queries
+from analysis.session_model import as_dict
+from analysis.utils import (
+    extract_docids,
+    extract_search_terms,
+    timestamp_to_epoch_ms,
+    epoch_ms_to_timestamp,
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    user_id TEXT,
+    start_ms INTEGER,
+    end_ms INTEGER,
+    session_length REAL,
+    n_actions INTEGER,
+    n_searches INTEGER,
+    source_path TEXT,
+    UNIQUE (dataset, session_id)
+);
+CREATE INDEX IF NOT EXISTS sessions_session_id ON sessions (session_id);
+CREATE INDEX IF NOT EXISTS sessions_user_id ON sessions (user_id);
+CREATE INDEX IF NOT EXISTS sessions_start_ms ON sessions (start_ms);
+CREATE TABLE IF NOT EXISTS actions (
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    position INTEGER NOT NULL,
+    timestamp_ms INTEGER,
+    action_type TEXT,
+    action_label TEXT,
+    action_length REAL,
+    params TEXT,
+    origin_action TEXT,
+    PRIMARY KEY (session, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS actions_timestamp ON actions (timestamp_ms);
+CREATE INDEX IF NOT EXISTS actions_label ON actions (action_label);
+CREATE TABLE IF NOT EXISTS documents (
+    docid TEXT NOT NULL,
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    PRIMARY KEY (docid, session)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS documents_session ON documents (session);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT NOT NULL,
+    session INTEGER NOT NULL REFERENCES sessions (id),
+    PRIMARY KEY (term, session)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS terms_session ON terms (session);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    session INTEGER
+);
+"""
+
+
+class SessionDatabase:
+    """Embedded SQLite store of sessions and actions with indexed point lookups."""
+
+    def __init__(self, db_path):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def upsert_session(self, dataset, session, source_path=None):
+        """Insert or replace one session with its actions, documents and terms."""
+        session = as_dict(session)
+        actions = session["actions"]
+        session_id = str(session.get("session_id") or os.path.basename(source_path or ""))
+        start_ms = (
+            timestamp_to_epoch_ms(session["start_date"]) if session.get("start_date") else None
+        )
+        end_ms = timestamp_to_epoch_ms(session["end_date"]) if session.get("end_date") else None
+        cursor = self.connection.cursor()
+        cursor.execute(
+            """
+            INSERT INTO sessions (dataset, session_id, user_id, start_ms, end_ms,
+                                  session_length, n_actions, n_searches, source_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (dataset, session_id) DO UPDATE SET
+                user_id = excluded.user_id, start_ms = excluded.start_ms,
+                end_ms = excluded.end_ms, session_length = excluded.session_length,
+                n_actions = excluded.n_actions, n_searches = excluded.n_searches,
+                source_path = excluded.source_path
+            """,
+            (
+                dataset,
+                session_id,
+                str(session.get("user_id", -1)),
+                start_ms,
+                end_ms,
+                session.get("session_length"),
+                len(actions),
+                count_queries(actions),
+                source_path,
+            ),
+        )
+        row_id = cursor.execute(
+            "SELECT id FROM sessions WHERE dataset = ? AND session_id = ?",
+            (dataset, session_id),
+        ).fetchone()[0]
+        for table in ("actions", "documents", "terms"):
+            cursor.execute(f"DELETE FROM {table} WHERE session = ?", (row_id,))
+        cursor.executemany(
+            "INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    row_id,
+                    position,
+                    timestamp_to_epoch_ms(action["timestamp"]),
+                    action["action_type"],
+                    action["action_label"],
+                    action.get("action_length"),
+                    json.dumps(action.get("params", "")),
+                    action.get("origin_action"),
+                )
+                for position, action in enumerate(actions)
+            ],
+        )
+        cursor.executemany(
+            "INSERT INTO documents VALUES (?, ?)",
+            [(docid, row_id) for docid in extract_docids(actions)],
+        )
+        cursor.executemany(
+            "INSERT INTO terms VALUES (?, ?)",
+            [(term, row_id) for term in extract_search_terms(actions)],
+        )
+        return row_id
+
+    def delete_session(self, row_id):
+        for table in ("actions", "documents", "terms"):
+            self.connection.execute(f"DELETE FROM {table} WHERE session = ?", (row_id,))
+        self.connection.execute("DELETE FROM sessions WHERE id = ?", (row_id,))
+
+    def delete_file_session(self, path, row_id):
+        """Delete the session a file was ingested as, unless another file still holds it."""
+        shared = self.connection.execute(
+            "SELECT 1 FROM files WHERE session = ? AND path != ? LIMIT 1", (row_id, path)
+        ).fetchone()
+        if shared is None:
+            self.delete_session(row_id)
+
+    def ingest_directory(self, dataset, directory):
+        """Upsert new or changed session files of a directory and drop deleted ones."""
+        # A plain prefix comparison: LIKE would treat "_" and "%" in the path as wildcards
+        prefix = os.path.join(directory, "")
+        known = {
+            path: (size, mtime_ns, row_id)
+            for path, size, mtime_ns, row_id in self.connection.execute(
+                """
+                SELECT path, size, mtime_ns, session FROM files
+                WHERE substr(path, 1, length(?)) = ?
+                """,
+                (prefix, prefix),
+            )
+            # Files of subdirectories are not scanned, so they are not this directory's
+            if os.sep not in path[len(prefix) :]
+        }
+        seen = set()
+        upserted = 0
+        with self.connection:
+            for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                path = entry.path
+                stat = entry.stat()
+                seen.add(path)
+                if known.get(path, (None, None))[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                session = read_session(path)
+                if not session.get("session_id"):
+                    session["session_id"] = entry.name[: -len(".json")]
+                if path in known:
+                    # The file may now hold another session id; drop its old session first
+                    self.delete_file_session(path, known[path][2])
+                row_id = self.upsert_session(dataset, session, path)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime_ns, row_id),
+                )
+                upserted += 1
+            deleted = set(known) - seen
+            for path in deleted:
+                self.delete_file_session(path, known[path][2])
+                self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        print(
+            f"{dataset}: {upserted} sessions upserted, {len(deleted)} removed from the database."
+        )
+        return upserted, len(deleted)
+
+    def _session_ids(self, query, parameters):
+        return [row[0] for row in self.connection.execute(query, parameters)]
+
+    def sessions_of_user(self, user_id, dataset=None):
+        return self._session_ids(
+            "SELECT session_id FROM sessions WHERE user_id = ? AND (? IS NULL OR dataset = ?)",
+            (str(user_id), dataset, dataset),
+        )
+
+    def sessions_with_document(self, docid, dataset=None):
+        return self._session_ids(
+            """
+            SELECT s.session_id FROM documents d JOIN sessions s ON s.id = d.session
+            WHERE d.docid = ? AND (? IS NULL OR s.dataset = ?)
+            """,
+            (str(docid), dataset, dataset),
+        )
+
+    def sessions_with_term(self, term, dataset=None):
+        return self._session_ids(
+            """
+            SELECT s.session_id FROM terms t JOIN sessions s ON s.id = t.session
+            WHERE t.term = ? AND (? IS NULL OR s.dataset = ?)
+            """,
+            (term.lower(), dataset, dataset),
+        )
+
+    def sessions_between(self, start_date, end_date, min_searches=0, dataset=None):
+        """Sessions starting in [start_date, end_date) with at least min_searches searches."""
+        return self._session_ids(
+            """
+            SELECT session_id FROM sessions
+            WHERE start_ms >= ? AND start_ms < ? AND n_searches >= ?
+              AND (? IS NULL OR dataset = ?)
+            """,
+            (
+                timestamp_to_epoch_ms(start_date),
+                timestamp_to_epoch_ms(end_date),
+                min_searches,
+                dataset,
+                dataset,
+            ),
+        )
+
+    def unique_users(self, dataset=None):
+        return self.connection.execute(
+            "SELECT COUNT(DISTINCT user_id) FROM sessions WHERE ? IS NULL OR dataset = ?",
+            (dataset, dataset),
+        ).fetchone()[0]
+
+    def session_count(self, dataset=None):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM sessions WHERE ? IS NULL OR dataset = ?",
+            (dataset, dataset),
+        ).fetchone()[0]
+
+    def action_counts(self, dataset=None):
+        return dict(
+            self.connection.execute(
+                """
+                SELECT a.action_label, COUNT(*) FROM actions a JOIN sessions s ON s.id = a.session
+                WHERE ? IS NULL OR s.dataset = ?
+                GROUP BY a.action_label ORDER BY COUNT(*) DESC
+                """,
+                (dataset, dataset),
+            )
+        )
+
+    def load_session(self, session_id, dataset):
+        """Rebuild the JSON dict of a stored session."""
+        row = self.connection.execute(
+            """
+            SELECT id, user_id, start_ms, end_ms, session_length FROM sessions
+            WHERE dataset = ? AND session_id = ?
+            """,
+            (dataset, session_id),
+        ).fetchone()
+        if row is None:
+            raise KeyError(session_id)
+        row_id, user_id, start_ms, end_ms, session_length = row
+        actions = [
+            {
+                "timestamp": epoch_ms_to_timestamp(timestamp_ms),
+                "action_type": action_type,
+                "action_label": action_label,
+                "action_length": action_length,
+                "params": json.loads(params),
+                "origin_action": origin_action,
+            }
+            for timestamp_ms, action_type, action_label, action_length, params, origin_action in self.connection.execute(
+                """
+                SELECT timestamp_ms, action_type, action_label, action_length, params, origin_action
+                FROM actions WHERE session = ? ORDER BY position
+                """,
+                (row_id,),
+            )
+        ]
+        return {
+            "session_id": session_id,
+            "session_length": session_length,
+            "user_id": user_id,
+            "start_date": epoch_ms_to_timestamp(start_ms) if start_ms is not None else None,
+            "end_date": epoch_ms_to_timestamp(end_ms) if end_ms is not None else None,
+            "actions": actions,
+        }
+
+    def dataset(self, name):
+        return DatasetView(self, name)
+
+
+class DatasetView:
+    """One dataset of a SessionDatabase, usable where the analyses expect a table."""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    def unique_users(self):
+        return self.database.unique_users(self.name)
+
+    def __len__(self):
+        return self.database.session_count(self.name)
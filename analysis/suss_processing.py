@@ -1,22 +1,26 @@
 import csv
-import json
-from datetime import datetime
+from analysis.compression import open_input
+from analysis.quarantine import Quarantine, quarantine_path
+from analysis.utils import timestamp_to_epoch_ms
+from analysis.session_model import as_dict
+from analysis.writer import AsyncWriter
 
-def parse_csv(file_path):
+def parse_csv_rows(rows, store=None, quarantine=None):
+    """
+    Parse SUSS CSV rows given as (line number, row dict) pairs.
+
+    With a SessionStore, sessions are built in its compact form. Rows with
+    missing columns or values that do not convert go to the quarantine (or
+    raise without one) before any session is touched.
+    """
     sessions = {}
-    with open(file_path, 'r') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
+    end_dates_ms = {}
+    for line_number, row in rows:
+        try:
             session_id = row['session_id']
-            if session_id not in sessions:
-                sessions[session_id] = {
-                    "session_id": session_id,
-                    "session_length": int(row['session_length']),
-                    "user_id": int(row['user_id']),
-                    "start_date": row['date'],
-                    "end_date": row['date'],
-                    "actions": []
-                }
+            session_length = int(row['session_length'])
+            user_id = int(row['user_id'])
+            date_ms = timestamp_to_epoch_ms(row['date'])
             action = {
                 "action_id": int(row['id']),
                 "timestamp": row['date'],
@@ -26,13 +30,49 @@ def parse_csv(file_path):
                 "params": row['params'],
                 "origin_action": row['origin_action']
             }
-            sessions[session_id]['actions'].append(action)
-            if datetime.strptime(row['date'], "%Y-%m-%d %H:%M:%S") > datetime.strptime(sessions[session_id]['end_date'], "%Y-%m-%d %H:%M:%S"):
-                sessions[session_id]['end_date'] = row['date']
+            # DictReader fills the columns of short rows with None
+            if session_id is None or None in action.values():
+                raise KeyError("row has fewer columns than the header")
+        except (KeyError, ValueError, TypeError) as error:
+            if quarantine is None:
+                raise
+            quarantine.add_error(error, row, line=line_number)
+            continue
+        if session_id not in sessions and store is not None:
+            sessions[session_id] = store.new_session(session_id, session_length, user_id)
+            sessions[session_id]['start_date'] = row['date']
+            sessions[session_id]['end_date'] = row['date']
+            end_dates_ms[session_id] = date_ms
+        elif session_id not in sessions:
+            sessions[session_id] = {
+                "session_id": session_id,
+                "session_length": session_length,
+                "user_id": user_id,
+                "start_date": row['date'],
+                "end_date": row['date'],
+                "actions": []
+            }
+            end_dates_ms[session_id] = date_ms
+        sessions[session_id]['actions'].append(action)
+        if date_ms > end_dates_ms[session_id]:
+            end_dates_ms[session_id] = date_ms
+            sessions[session_id]['end_date'] = row['date']
     return sessions
 
-def save_sessions_to_json(sessions, output_dir):
-    for session_id, session_data in sessions.items():
-        file_path = f"{output_dir}/{session_id}.json"
-        with open(file_path, 'w') as json_file:
-            json.dump(session_data, json_file, indent=4)
\ No newline at end of file
+def parse_csv(file_path, store=None, quarantine_file=None):
+    """
+    Parse the SUSS CSV log; with a SessionStore, sessions are built in its compact form.
+
+    Rows that cannot be parsed are written with their line number and error
+    to a quarantine file (see analysis/quarantine.py) and the run continues.
+    """
+    with Quarantine(
+        quarantine_file or quarantine_path(file_path), "suss_csv", file_path
+    ) as quarantine, open_input(file_path, 'r') as file:
+        reader = csv.DictReader(file)
+        return parse_csv_rows(((reader.line_num, row) for row in reader), store, quarantine)
+
+def save_sessions_to_json(sessions, output_dir, compact=False):
+    with AsyncWriter(compact=compact, label='sessions') as writer:
+        for session_id, session_data in sessions.items():
+            writer.write_json(f"{output_dir}/{session_id}.json", as_dict(session_data))
\ No newline at end of file
@@ -0,0 +1,139 @@
+import random
+from array import array
+from collections import Counter
+from analysis.session_model import Vocabulary, as_dict
+
+
+class Taxonomy:
+    """
+    Integer-coded action taxonomy compiled from the project's action vocabularies.
+
+    Every label (SUSS action labels and EconBiz event categories) gets a code in
+    one vocabulary. Three code tables are built once:
+
+    - ``topology``: label code -> topology category code (-1 if unmapped),
+    - ``remap_offsets``/``remap_targets``: CSR table of the SUSS labels an
+      EconBiz category can be remapped to,
+    - ``aliases``: label code -> canonical label code from action_mapping.csv.
+    """
+
+    def __init__(self):
+        self.vocabulary = Vocabulary()
+        self.categories = Vocabulary()
+        self.topology = array("i")
+        self.aliases = array("i")
+        self.remap_offsets = array("i", [0])
+        self.remap_targets = array("i")
+        # Labels with at most one remap candidate, resolved without drawing a random number
+        self._direct = array("i")
+
+    def code(self, label):
+        code = self.vocabulary.code(label)
+        while len(self.topology) < len(self.vocabulary):
+            self.topology.append(-1)
+            self.aliases.append(len(self.aliases))
+        return code
+
+    def encode(self, labels):
+        return array("i", [self.code(label) for label in labels])
+
+    def decode(self, codes):
+        labels = self.vocabulary.labels
+        return [labels[code] for code in codes]
+
+    def _finalize(self, candidates):
+        self.remap_offsets = array("i", [0])
+        self.remap_targets = array("i")
+        self._direct = array("i")
+        for code in range(len(self.vocabulary)):
+            targets = candidates.get(code, [])
+            self.remap_targets.extend(targets)
+            self.remap_offsets.append(len(self.remap_targets))
+            self._direct.append(targets[0] if len(targets) == 1 else code)
+
+    def remap(self, codes, seed=None):
+        """
+        Remap a column of label codes to SUSS labels, returning a new array.
+
+        Codes with several candidates draw from a random.Random(seed), so the
+        same input and seed always give the same output; the input is not modified.
+        """
+        rng = random.Random(seed)
+        offsets, targets, direct = self.remap_offsets, self.remap_targets, self._direct
+        # Codes added after compilation (unknown labels) have no candidates and stay unchanged
+        compiled = len(direct)
+        remapped = array("i", [direct[code] if code < compiled else code for code in codes])
+        for position, code in enumerate(codes):
+            if code >= compiled:
+                continue
+            start, end = offsets[code], offsets[code + 1]
+            if end - start > 1:
+                remapped[position] = targets[start + rng.randrange(end - start)]
+        return remapped
+
+    def canonical(self, codes):
+        aliases = self.aliases
+        return array("i", [aliases[code] for code in codes])
+
+    def rollup(self, codes):
+        """Map label codes to topology category codes by array lookup."""
+        topology = self.topology
+        return array("i", [topology[code] for code in codes])
+
+    def labels_in(self, categories):
+        """Labels whose topology category is one of ``categories``."""
+        wanted = {self.categories.codes[name] for name in categories if name in self.categories}
+        return {
+            label
+            for label, category in zip(self.vocabulary.labels, self.topology)
+            if category in wanted
+        }
+
+    def category_counts(self, codes):
+        counts = Counter(self.rollup(codes))
+        counts.pop(-1, None)
+        return {self.categories.label(code): count for code, count in counts.items()}
+
+
+def compile_taxonomy(action_mappings=None, action_mapping=None, csv_rows=()):
+    """
+    Compile the action vocabularies into a Taxonomy.
+
+    Parameters:
+    - action_mappings: Label -> topology category dict (defaults to data_processing.action_mappings).
+    - action_mapping: EconBiz category -> SUSS labels dict (defaults to session_generation.action_mapping).
+    - csv_rows: Rows of action_mapping.csv as returned by load_action_mappings.
+    """
+    if action_mappings is None:
+        from analysis.data_processing import action_mappings
+    if action_mapping is None:
+        from analysis.session_generation import action_mapping
+
+    taxonomy = Taxonomy()
+    for label, category in action_mappings.items():
+        code = taxonomy.code(label)
+        taxonomy.topology[code] = taxonomy.categories.code(category)
+
+    for row in csv_rows:
+        code = taxonomy.code(row["action_label"])
+        if row.get("mapping_action_label"):
+            taxonomy.aliases[code] = taxonomy.code(row["mapping_action_label"])
+
+    candidates = {}
+    for category, labels in action_mapping.items():
+        candidates[taxonomy.code(category)] = [taxonomy.code(label) for label in labels]
+
+    taxonomy._finalize(candidates)
+    return taxonomy
+
+
+def remap_session_types(session, taxonomy, seed=None):
+    """Return a copy of the session whose action types are remapped to SUSS labels."""
+    session = as_dict(session)
+    types = taxonomy.encode(action["action_type"] for action in session["actions"])
+    remapped = taxonomy.decode(taxonomy.remap(types, seed))
+    actions = [
+        dict(action, action_type=action_type)
+        for action, action_type in zip(session["actions"], remapped)
+    ]
+    return dict(session, actions=actions)
@@ -1,10 +1,17 @@
-import json
+import os
 import pandas as pd
 import re
 from dotenv import load_dotenv
 from urllib.parse import urlparse, parse_qs
 from nltk.corpus import stopwords
-from datetime import datetime
+from datetime import datetime, date
+from functools import lru_cache
+from analysis.codec import read_session
+from analysis.compression import open_input
+
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
 
 # Utility function to flatten nested dictionaries
@@ -21,7 +28,7 @@ def flatten_dict(d, parent_key="", sep="_"):
 
 # Utility function to get the number of lines in a file
 def get_num_lines(file_path):
-    with open(file_path, "r", encoding="utf-8") as f:
+    with open_input(file_path, "r", encoding="utf-8") as f:
         return sum(1 for line in f)
 
 
@@ -62,8 +69,68 @@ def standardize_query(query):
     return re.sub(r"\s+", " ", query).strip()
 
 
+QUERY_LABELS = ("query_form", "searchterm_1", "searchterm_2", "searchterm_3", "searchterm_4")
+
+
+# Function to return the document id viewed by an action, or None
+def action_docid(action):
+    params = action.get("params", "")
+    if isinstance(params, dict):
+        return str(params["docid"]) if params.get("docid") else None
+    if action["action_label"] == "view_record" or (
+        action["action_type"] == "extraction" and action["action_label"] == "docid"
+    ):
+        return params or None
+    return None
+
+
+# Function to return the normalized queries carried by an action
+def action_queries(action):
+    params = action.get("params", "")
+    if isinstance(params, dict):
+        queries = [
+            str(value)
+            for key, value in params.items()
+            if key.startswith(("searchterm", "query"))
+        ]
+    elif action["action_label"] in QUERY_LABELS:
+        queries = [params]
+    else:
+        return []
+    return [standardize_query(query) for query in queries if query]
+
+
+def extract_docids(actions):
+    return {docid for docid in map(action_docid, actions) if docid is not None}
+
+
+def extract_session_queries(actions):
+    return [query for action in actions for query in action_queries(action)]
+
+
+# Function to extract the normalized search terms of a session
+def extract_search_terms(actions):
+    terms = set()
+    for query in extract_session_queries(actions):
+        terms.update(query.lower().split())
+    return terms
+
+
+# Function to load the English stopwords once; without the nltk data no words are filtered
+@lru_cache(maxsize=None)
+def _stop_words():
+    try:
+        return frozenset(stopwords.words("english"))
+    except LookupError:
+        print(
+            "The nltk stopwords corpus is missing (python -m nltk.downloader stopwords); "
+            "queries are rewritten without removing stopwords."
+        )
+        return frozenset()
+
+
 def rewrite_query(query):
-    stop_words = set(stopwords.words("english"))
+    stop_words = _stop_words()
     words = query.split()
     filtered_words = [word for word in words if word.lower() not in stop_words]
     rewritten_query = " ".join(filtered_words)
@@ -72,7 +139,44 @@ def rewrite_query(query):
 
 def parse_date(date_str):
     """Parse a date string into a datetime object."""
-    return datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+    return datetime.strptime(date_str, DATETIME_FORMAT)
+
+
+@lru_cache(maxsize=65536)
+def _epoch_days(date_str):
+    return date.fromisoformat(date_str).toordinal() - EPOCH_ORDINAL
+
+
+@lru_cache(maxsize=65536)
+def _date_string(epoch_days):
+    return date.fromordinal(epoch_days + EPOCH_ORDINAL).isoformat()
+
+
+def timestamp_to_epoch_ms(timestamp_str):
+    """Convert a "%Y-%m-%d %H:%M:%S" UTC timestamp into integer epoch milliseconds."""
+    # Slicing the fixed-width format with a per-day cache avoids a strptime per record
+    if len(timestamp_str) != 19 or timestamp_str[10] != " ":
+        timestamp = datetime.strptime(timestamp_str, DATETIME_FORMAT)
+        return (
+            (timestamp.toordinal() - EPOCH_ORDINAL) * 86400
+            + timestamp.hour * 3600
+            + timestamp.minute * 60
+            + timestamp.second
+        ) * 1000
+    return (
+        _epoch_days(timestamp_str[:10]) * 86400
+        + int(timestamp_str[11:13]) * 3600
+        + int(timestamp_str[14:16]) * 60
+        + int(timestamp_str[17:19])
+    ) * 1000
+
+
+def epoch_ms_to_timestamp(epoch_ms):
+    """Format integer epoch milliseconds as a "%Y-%m-%d %H:%M:%S" UTC timestamp."""
+    days, seconds = divmod(int(epoch_ms // 1000), 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{_date_string(days)} {hours:02d}:{minutes:02d}:{seconds:02d}"
 
 
 # Load environment variables
@@ -81,9 +185,13 @@ def load_env_vars():
     return os.getenv("OPENAI_API_KEY")
 
 
-def load_session(file_path):
-    with open(file_path, "r") as file:
-        return json.load(file)
+def load_session(file_path, session_id=None):
+    # With a session id, file_path is a session container and the session is read by offset
+    if session_id is not None:
+        from analysis.session_container import open_container
+
+        return open_container(file_path).get(session_id)
+    return read_session(file_path)
 
 
 def get_mapping(action, action_mapping):
@@ -97,10 +205,9 @@ def get_mapping(action, action_mapping):
 
 
 def calculate_session_duration(session):
-    start_date = datetime.strptime(session["start_date"], "%Y-%m-%d %H:%M:%S")
-    end_date = datetime.strptime(session["end_date"], "%Y-%m-%d %H:%M:%S")
-    duration = end_date - start_date
-    return duration.total_seconds() / 60  # Convert to minutes
+    start_ms = timestamp_to_epoch_ms(session["start_date"])
+    end_ms = timestamp_to_epoch_ms(session["end_date"])
+    return (end_ms - start_ms) / 60000  # Convert to minutes
 
 
 def minutes_to_hh_mm(minutes):
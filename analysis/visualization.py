@@ -1,38 +1,77 @@
+import colorsys
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+
+# Always render off-screen; the analysis servers have no display
+matplotlib.use("Agg")
+
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
-from analysis.utils import remove_extreme_outliers
+from analysis.box_stats import (
+    BOXPLOT_METRICS,
+    box_sketches_path,
+    box_stats,
+    build_box_sketches_from_csv,
+    load_box_sketches,
+)
+
+
+# Bump to redraw every figure after a change to the plotting code or style
+FIGURE_STYLE_VERSION = 1
 
 
 def generate_boxplots(csv_file_path, output_image_path):
-    df = pd.read_csv(csv_file_path)
-    max_search_duration = 2000
-    df = df[df["search_duration"] <= max_search_duration]
+    """
+    Draw the session analysis boxplots from per-session-type quantile sketches.
+
+    The sketches written by process_sessions_to_csv next to the CSV are used
+    when present; otherwise the CSV is streamed row by row into sketches.
+    """
+    sketches_path = box_sketches_path(csv_file_path)
+    if os.path.exists(sketches_path) and os.path.getmtime(
+        sketches_path
+    ) >= os.path.getmtime(csv_file_path):
+        box_sketches = load_box_sketches(sketches_path)
+    else:
+        box_sketches = build_box_sketches_from_csv(csv_file_path)
     sns.set(style="ticks", rc={"axes.facecolor": (0, 0, 0, 0)})
     session_colors = {"Exploratory": "#e67e22", "Lookup": "#2980b9"}
+    # Dark gray for box edges, whiskers and medians, as seaborn derives it from the palette
+    line_color = str(
+        min(
+            colorsys.rgb_to_hls(*matplotlib.colors.to_rgb(color))[1]
+            for color in session_colors.values()
+        )
+        * 0.6
+    )
     fig, axes = plt.subplots(2, 2, figsize=(15, 10))
-    plot_configs = [
-        ("search_depth", "Average search depth (pages)"),
-        ("search_duration", "Search duration (seconds)"),
-        ("results_pageviews", "Results pageviews per search"),
-        ("query_length", "Query length (words)"),
-    ]
-    for metric, title in plot_configs:
-        filtered_df = remove_extreme_outliers(df, metric, "session_type")
-        ax = axes[
-            plot_configs.index((metric, title)) // 2,
-            plot_configs.index((metric, title)) % 2,
+    session_types = box_sketches["order"]
+    for index, (metric, title) in enumerate(BOXPLOT_METRICS):
+        ax = axes[index // 2, index % 2]
+        stats = [
+            box_stats(box_sketches["sketches"][metric][session_type], session_type)
+            for session_type in session_types
         ]
-        sns.boxplot(
-            ax=ax,
-            x=metric,
-            y="session_type",
-            hue="session_type",
-            data=filtered_df,
-            palette=session_colors,
+        boxes = ax.bxp(
+            stats,
+            positions=range(len(stats)),
+            widths=0.8,
+            vert=False,
+            patch_artist=True,
             showfliers=False,
-            legend=False,
+            boxprops={"edgecolor": line_color},
+            whiskerprops={"color": line_color},
+            capprops={"color": line_color},
+            medianprops={"color": line_color},
         )
+        for box, session_type in zip(boxes["boxes"], session_types):
+            box.set_facecolor(session_colors.get(session_type, "#95a5a6"))
+        ax.set_ylim(len(stats) - 0.5, -0.5)
         ax.set_title(title)
         ax.set_ylabel("")
         ax.set_xlabel("")
@@ -41,29 +80,63 @@ def generate_boxplots(csv_file_path, output_image_path):
     plt.close()
 
 
-def compare_action_distribution(event_df1, event_df2):
-    action_dist1 = event_df1["action"].value_counts()
-    action_dist2 = event_df2["action"].value_counts()
+def compare_action_distribution(
+    event_df1,
+    event_df2,
+    output_image_path="metrics/action_distribution_comparison.png",
+):
+    action_dist1 = event_df1["action"].value_counts().to_dict()
+    action_dist2 = event_df2["action"].value_counts().to_dict()
+    render_figures(
+        [
+            (
+                plot_action_distribution,
+                {
+                    "action_counts1": action_dist1,
+                    "action_counts2": action_dist2,
+                    "output_image_path": output_image_path,
+                },
+            )
+        ],
+        max_workers=1,
+    )
+
 
+def plot_action_distribution(action_counts1, action_counts2, output_image_path):
     action_dist = pd.DataFrame(
-        {"Dataset 1": action_dist1, "Dataset 2": action_dist2}
+        {"Dataset 1": pd.Series(action_counts1), "Dataset 2": pd.Series(action_counts2)}
     ).fillna(0)
 
     action_dist.plot(kind="bar", figsize=(15, 7))
     plt.title("Action Distribution Comparison")
     plt.xlabel("Action")
     plt.ylabel("Count")
-    plt.show()
+    plt.tight_layout()
+    plt.savefig(output_image_path)
+    plt.close()
+
+
+# Function to turn a {value: count} histogram (or raw values) into hist() values and weights
+def _histogram_counts(counts):
+    if not isinstance(counts, dict):
+        counts = Counter(counts)
+    values = sorted(counts)
+    return values, [counts[value] for value in values]
 
 
 def plot_query_distribution(
-    all_capped_query_counts, datasets_name, colors, edgecolors, labels
+    all_capped_query_counts,
+    datasets_name,
+    colors,
+    edgecolors,
+    labels,
+    output_image_path="metrics/combined_query_distribution.png",
 ):
     """
     Plots the distribution of queries per user for each dataset.
 
     Parameters:
-    - all_capped_query_counts: List of lists containing the capped query counts for each dataset.
+    - all_capped_query_counts: Per dataset, a {capped query count: sessions} histogram (or a list of capped counts).
     - datasets_name: List of dataset names.
     - colors: List of colors for each dataset.
     - edgecolors: List of edge colors for each dataset.
@@ -73,8 +146,10 @@ def plot_query_distribution(
     bins = range(1, 12)  # Adjust as necessary
 
     for i, dataset in enumerate(datasets_name):
+        values, weights = _histogram_counts(all_capped_query_counts[i])
         plt.hist(
-            all_capped_query_counts[i],
+            values,
+            weights=weights,
             bins=bins,
             edgecolor=edgecolors[i],
             color=colors[i],
@@ -90,18 +165,23 @@ def plot_query_distribution(
     plt.xticks(range(1, 12))
     plt.legend()
     plt.tight_layout()
-    plt.savefig("metrics/combined_query_distribution.png")
+    plt.savefig(output_image_path)
     plt.close()
 
 
 def plot_tokens_per_query_distribution(
-    all_capped_tokens_per_query, datasets_name, colors, edgecolors, labels
+    all_capped_tokens_per_query,
+    datasets_name,
+    colors,
+    edgecolors,
+    labels,
+    output_image_path="metrics/combined_tokens_per_query_distribution.png",
 ):
     """
     Plots the distribution of query lengths by the number of tokens for each dataset.
 
     Parameters:
-    - all_capped_tokens_per_query: List of lists containing the capped tokens per query for each dataset.
+    - all_capped_tokens_per_query: Per dataset, a {capped token count: queries} histogram (or a list of capped counts).
     - datasets_name: List of dataset names.
     - colors: List of colors for each dataset.
     - edgecolors: List of edge colors for each dataset.
@@ -111,8 +191,10 @@ def plot_tokens_per_query_distribution(
     bins = range(1, 23)  # Adjust as necessary
 
     for i, dataset in enumerate(datasets_name):
+        values, weights = _histogram_counts(all_capped_tokens_per_query[i])
         plt.hist(
-            all_capped_tokens_per_query[i],
+            values,
+            weights=weights,
             bins=bins,
             edgecolor=edgecolors[i],
             color=colors[i],
@@ -128,5 +210,77 @@ def plot_tokens_per_query_distribution(
     plt.xticks(ticks=range(1, 22), labels=[str(i) for i in range(1, 21)] + ["20+"])
     plt.legend()
     plt.tight_layout()
-    plt.savefig("metrics/combined_tokens_per_query_distribution.png")
+    plt.savefig(output_image_path)
     plt.close()
+
+
+def _file_digest(file_path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def figure_hash(function, kwargs, input_paths=()):
+    """Hash of a figure's plotting function, arguments, input files and style version."""
+    payload = json.dumps(
+        {
+            "figure": function.__name__,
+            "style": FIGURE_STYLE_VERSION,
+            "arguments": kwargs,
+            "inputs": [_file_digest(path) for path in input_paths],
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _render(function, kwargs):
+    function(**kwargs)
+    return kwargs["output_image_path"]
+
+
+def render_figures(jobs, max_workers=None):
+    """
+    Render independent figures in a process pool, skipping unchanged ones.
+
+    Each job is (function, kwargs) or (function, kwargs, input_paths); kwargs
+    must contain output_image_path. A figure is redrawn only if its image is
+    missing or the hash of its arguments, input files and style version differs
+    from the one stored next to the image in "<image>.hash".
+    """
+    pending = []
+    for job in jobs:
+        function, kwargs = job[0], job[1]
+        input_paths = job[2] if len(job) > 2 else ()
+        output_image_path = kwargs["output_image_path"]
+        digest = figure_hash(function, kwargs, input_paths)
+        hash_path = f"{output_image_path}.hash"
+        if os.path.exists(output_image_path) and os.path.exists(hash_path):
+            with open(hash_path, "r") as file:
+                if file.read() == digest:
+                    print(f"Skipping {output_image_path}, its inputs have not changed.")
+                    continue
+        os.makedirs(os.path.dirname(output_image_path) or ".", exist_ok=True)
+        pending.append((function, kwargs, hash_path, digest))
+
+    if len(pending) == 1 or max_workers == 1:
+        rendered = [_render(function, kwargs) for function, kwargs, _, _ in pending]
+    elif pending:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_render, function, kwargs)
+                for function, kwargs, _, _ in pending
+            ]
+            rendered = [future.result() for future in futures]
+    else:
+        rendered = []
+
+    for _, _, hash_path, digest in pending:
+        with open(hash_path, "w") as file:
+            file.write(digest)
+    for output_image_path in rendered:
+        print(f"Figure saved to {output_image_path}")
+    return rendered
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from analysis.codec import dumps
+
+
+class AsyncWriter:
+    """
+    Write-behind writer for many small output files.
+
+    Files are encoded and written on a thread pool while the producer keeps
+    parsing or generating. At most ``max_pending`` writes are queued; further
+    submissions block until a write finishes (backpressure). Every file is
+    written to a temporary file in the target directory and renamed into
+    place, so readers never see partial files. Directories are created once.
+    With ``fsync=True`` the written files and their directories are synced in
+    groups of ``fsync_group`` files instead of one sync per file.
+
+    Data passed to write_json must not be modified after submission.
+    """
+
+    def __init__(
+        self,
+        max_workers=4,
+        max_pending=1024,
+        compact=True,
+        fsync=False,
+        fsync_group=256,
+        progress_every=10.0,
+        label="files",
+    ):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.compact = compact
+        self.fsync = fsync
+        self.fsync_group = fsync_group
+        self.progress_every = progress_every
+        self.label = label
+        self.lock = threading.Lock()
+        self.directories = set()
+        self.unsynced = []
+        self.written = 0
+        self.error = None
+        self.started = time.monotonic()
+        self.last_report = self.started
+
+    def _ensure_directory(self, directory):
+        if directory in self.directories:
+            return
+        os.makedirs(directory or ".", exist_ok=True)
+        with self.lock:
+            self.directories.add(directory)
+
+    def _write(self, file_path, payload):
+        try:
+            if not isinstance(payload, (str, bytes)):
+                payload = dumps(payload, compact=self.compact)
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            directory = os.path.dirname(file_path)
+            self._ensure_directory(directory)
+            temporary_path = os.path.join(
+                directory,
+                f".{os.path.basename(file_path)}.tmp.{threading.get_ident()}",
+            )
+            with open(temporary_path, "wb") as file:
+                file.write(payload)
+            os.replace(temporary_path, file_path)
+            self._completed(file_path)
+        except BaseException as error:
+            with self.lock:
+                if self.error is None:
+                    self.error = error
+        finally:
+            self.slots.release()
+
+    def _completed(self, file_path):
+        to_sync = None
+        with self.lock:
+            self.written += 1
+            if self.fsync:
+                self.unsynced.append(file_path)
+                if len(self.unsynced) >= self.fsync_group:
+                    to_sync, self.unsynced = self.unsynced, []
+            now = time.monotonic()
+            report = now - self.last_report >= self.progress_every
+            if report:
+                self.last_report = now
+                written = self.written
+        if report:
+            print(
+                f"Saved {written} {self.label} ({written / (now - self.started):.0f}/s)"
+            )
+        if to_sync:
+            self._sync(to_sync)
+
+    @staticmethod
+    def _sync(file_paths):
+        for file_path in file_paths:
+            file_descriptor = os.open(file_path, os.O_RDONLY)
+            try:
+                os.fsync(file_descriptor)
+            finally:
+                os.close(file_descriptor)
+        for directory in {os.path.dirname(file_path) or "." for file_path in file_paths}:
+            file_descriptor = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(file_descriptor)
+            finally:
+                os.close(file_descriptor)
+
+    def _submit(self, file_path, payload):
+        if self.error is not None:
+            raise self.error
+        self.slots.acquire()
+        self.executor.submit(self._write, file_path, payload)
+
+    def write_json(self, file_path, data):
+        self._submit(file_path, data)
+
+    def write_text(self, file_path, text):
+        self._submit(file_path, text)
+
+    def close(self):
+        """Wait for all queued writes, sync the last group and raise the first write error."""
+        self.executor.shutdown(wait=True)
+        if self.unsynced:
+            self._sync(self.unsynced)
+            self.unsynced = []
+        if self.error is not None:
+            raise self.error
+        elapsed = time.monotonic() - self.started
+        print(f"Saved {self.written} {self.label} in {elapsed:.1f}s")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)
+        return False
@@ -1,17 +1,48 @@
 import argparse
 import random
 import os
-import json
 from datetime import datetime
 
 from analysis.utils import load_session
-from analysis.session_generation import create_synthetic_session
+from analysis.session_generation import create_synthetic_session, create_synthetic_sessions
+from analysis.taxonomy import compile_taxonomy
 from analysis.suss_processing import parse_csv, save_sessions_to_json
+from analysis.sessionization import (
+    DEFAULT_INACTIVITY_TIMEOUT_MINUTES,
+    sessionize_csv,
+    sessionize_ndjson,
+)
+from analysis.near_duplicates import detect_near_duplicates
+from analysis.server import serve
+from analysis.writer import AsyncWriter
+from analysis.sql_store import SessionDatabase
+from analysis.incremental import run_incremental
+from analysis.reformulation import analyze_reformulations
+from analysis.session_container import pack_sessions
+from analysis.codec import benchmark_decoding
+from analysis.features import build_features, cluster_sessions
+from analysis.inverted_index import InvertedIndex
+from analysis.mapreduce import map_partition, reduce_partitions, run_map_reduce
+from analysis.cardinality import (
+    TIME_BUCKETS,
+    build_cardinality_sketches,
+    save_cardinality_sketches,
+    write_cardinality_report,
+)
+from analysis.cube import CUBE_DIMENSIONS, build_cube, query_cube
+from analysis.fidelity import (
+    build_metric_sketches,
+    directory_fingerprint,
+    load_metric_sketches,
+    save_metric_sketches,
+    write_fidelity_report,
+)
 from analysis.visualization import (
     compare_action_distribution,
     generate_boxplots,
     plot_query_distribution,
     plot_tokens_per_query_distribution,
+    render_figures,
 )
 from analysis.data_processing import (
     load_dataset,
@@ -19,6 +50,7 @@ from analysis.data_processing import (
     extract_table_data,
     process_large_json_to_csv_ndjson,
     parse_sessions,
+    reprocess_quarantine,
     process_sessions_to_csv,
     load_action_mappings,
     human_readable_to_session,
@@ -34,7 +66,15 @@ from analysis.session_analysis import (
 )
 
 
-def generate_synthetic_sessions():
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def generate_synthetic_sessions(seed=None, topic_index=None, pack_size=1, token_budget=6000):
+    rng = random.Random(seed)
     session_start_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print("Starting session generation at:", session_start_date)
 
@@ -43,46 +83,88 @@ def generate_synthetic_sessions():
         topics = file.readlines()
     print(f"Loaded {len(topics)} topics.")
 
+    # With an inverted index, topics are drawn in proportion to the real sessions searching for them
+    topic_weights = None
+    if topic_index:
+        index = InvertedIndex(topic_index)
+        topic_weights = [index.topic_support(topic) for topic in topics]
+        index.close()
+        if not any(topic_weights):
+            topic_weights = None
+        print(f"{sum(1 for weight in topic_weights or () if weight)} topics occur in {topic_index}.")
+
     action_mappings = load_action_mappings("data/suss/action_mapping.csv")
     print(f"Loaded {len(action_mappings)} action mappings.")
+    taxonomy = compile_taxonomy(csv_rows=action_mappings)
 
     original_sessions_dir = "data/econbiz/original_sessions/"
     synthetic_sessions_dir = "data/econbiz/synthetic_sessions/"
 
     original_files = os.listdir(original_sessions_dir)
     print(f"Found {len(original_files)} original session files to process.")
-
-    for filename in original_files:
-        print(f"Processing file: {filename}")
-        original_session = load_session(os.path.join(original_sessions_dir, filename))
-
-        synthetic_topic = random.choice(topics).strip()
+    json_subfolder_path = os.path.join(synthetic_sessions_dir, "json")
+
+    report = {}
+    # Outputs are written in the background while the next sessions are generated
+    with AsyncWriter(compact=False, label="synthetic session files") as writer:
+        # With pack_size > 1, up to pack_size sessions share one request
+        for start in range(0, len(original_files), pack_size):
+            filenames = original_files[start : start + pack_size]
+            original_sessions = [
+                load_session(os.path.join(original_sessions_dir, filename))
+                for filename in filenames
+            ]
+            synthetic_topics = []
+            for _ in filenames:
+                if topic_weights:
+                    synthetic_topics.append(rng.choices(topics, topic_weights)[0].strip())
+                else:
+                    synthetic_topics.append(rng.choice(topics).strip())
+            seeds = [
+                None if seed is None else f"{seed}:{filename}" for filename in filenames
+            ]
+
+            if pack_size > 1:
+                synthetic_sessions = create_synthetic_sessions(
+                    original_sessions,
+                    synthetic_topics,
+                    action_mappings,
+                    taxonomy=taxonomy,
+                    seeds=seeds,
+                    token_budget=token_budget,
+                    max_sessions=pack_size,
+                    report=report,
+                )
+            else:
+                synthetic_sessions = [
+                    create_synthetic_session(
+                        original_sessions[0],
+                        synthetic_topics[0],
+                        action_mappings,
+                        taxonomy=taxonomy,
+                        seed=seeds[0],
+                    )
+                ]
+
+            for filename, synthetic_session in zip(filenames, synthetic_sessions):
+                writer.write_text(
+                    os.path.join(synthetic_sessions_dir, f"synthetic_{filename}.txt"),
+                    synthetic_session,
+                )
+                session_json = human_readable_to_session(
+                    synthetic_session, session_start_date
+                )
+                writer.write_json(
+                    os.path.join(json_subfolder_path, f"synthetic_{filename}.json"),
+                    session_json,
+                )
+
+    if report:
         print(
-            f"Selected synthetic topic: {synthetic_topic[:50]}..."
-        )  # Print a portion of the topic to keep the log concise
-
-        synthetic_session = create_synthetic_session(
-            original_session, synthetic_topic, action_mappings
-        )
-
-        synthetic_file_path_txt = os.path.join(
-            synthetic_sessions_dir, f"synthetic_{filename}.txt"
+            f"Packed generation: {report['sessions']} sessions in {report['requests']} requests "
+            f"({report.get('fallbacks', 0)} single-session fallbacks), "
+            f"~{report['input_tokens'] / report['sessions']:.0f} input tokens per session."
         )
-        with open(synthetic_file_path_txt, "w") as file:
-            file.write(synthetic_session)
-        print(f"Synthetic session written to TXT: {synthetic_file_path_txt}")
-
-        session_json = human_readable_to_session(synthetic_session, session_start_date)
-        json_subfolder_path = os.path.join(synthetic_sessions_dir, "json")
-        os.makedirs(json_subfolder_path, exist_ok=True)
-
-        synthetic_file_path_json = os.path.join(
-            json_subfolder_path, f"synthetic_{filename}.json"
-        )
-        with open(synthetic_file_path_json, "w") as file:
-            json.dump(session_json, file, indent=4)
-        print(f"Synthetic session JSON stored: {synthetic_file_path_json}\n")
-
     print("All sessions processed successfully.")
 
 
@@ -107,6 +189,47 @@ def load_datasets():
     return sessions1, sessions2, events1, events2, table1, table2
 
 
+DATASET_DIRECTORIES = {
+    "suss": "data/suss/sessions/",
+    "econbiz": "data/econbiz/sessions/",
+    "synthetic": "data/econbiz/synthetic_sessions/json/",
+}
+
+
+def cardinality_sketches(dataset_name, bucket="day", precision=12):
+    sketches = build_cardinality_sketches(
+        DATASET_DIRECTORIES[dataset_name], precision, bucket
+    )
+    save_cardinality_sketches(
+        sketches, f"metrics/{dataset_name}/cardinality_sketches_{dataset_name}.json"
+    )
+    write_cardinality_report(
+        sketches, f"metrics/{dataset_name}/cardinalities_{dataset_name}.csv"
+    )
+    return sketches
+
+
+def fidelity_report(reference_dataset, candidate_dataset):
+    dataset_sketches = []
+    for dataset_name in (reference_dataset, candidate_dataset):
+        directory = DATASET_DIRECTORIES[dataset_name]
+        sketch_path = f"metrics/{dataset_name}/metric_sketches_{dataset_name}.json"
+        fingerprint = directory_fingerprint(directory)
+        sketches = None
+        # The reference sketches are reused while its session files are unchanged
+        if dataset_name == reference_dataset and os.path.exists(sketch_path):
+            sketches = load_metric_sketches(sketch_path, fingerprint)
+        if sketches is None:
+            sketches = build_metric_sketches(directory)
+            save_metric_sketches(sketches, sketch_path, fingerprint)
+        dataset_sketches.append(sketches)
+    write_fidelity_report(
+        dataset_sketches[0],
+        dataset_sketches[1],
+        f"metrics/fidelity_{reference_dataset}_vs_{candidate_dataset}.csv",
+    )
+
+
 def main():
     # Create the parser
     parser = argparse.ArgumentParser(description="Process some integers.")
@@ -179,7 +302,303 @@ def main():
         action="store_true",
         help="Process SUSS dataset CSV and save sessions to JSON",
     )
+    parser.add_argument(
+        "--sessionize",
+        action="store_true",
+        help="Re-split raw event logs into sessions using an inactivity timeout",
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="Detect near-duplicate sessions between original and synthetic sessions",
+    )
+    parser.add_argument(
+        "--similarity-threshold",
+        type=float,
+        default=0.8,
+        help="Minimum estimated Jaccard similarity of near-duplicate sessions",
+    )
+    parser.add_argument(
+        "--new-only",
+        action="store_true",
+        help="Only report near-duplicates of sessions not yet in the index",
+    )
+    parser.add_argument(
+        "--fidelity-report",
+        action="store_true",
+        help="Compare metric distributions of two datasets",
+    )
+    parser.add_argument(
+        "--reference-dataset",
+        type=str,
+        default="econbiz",
+        choices=list(DATASET_DIRECTORIES),
+        help="Dataset the fidelity report compares against",
+    )
+    parser.add_argument(
+        "--candidate-dataset",
+        type=str,
+        default="synthetic",
+        choices=list(DATASET_DIRECTORIES),
+        help="Dataset evaluated by the fidelity report",
+    )
+    parser.add_argument(
+        "--map-reduce",
+        action="store_true",
+        help="Compute session metrics with local map workers followed by a reduce step",
+    )
+    parser.add_argument(
+        "--map-partition",
+        type=int,
+        help="Run only the map step for this partition (0-based)",
+    )
+    parser.add_argument(
+        "--reduce",
+        action="store_true",
+        help="Run only the reduce step over existing partial aggregates",
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default="suss",
+        choices=list(DATASET_DIRECTORIES),
+        help="Dataset processed by the map/reduce steps",
+    )
+    parser.add_argument(
+        "--num-partitions",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of hash partitions of the sessions",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Number of local worker processes"
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        help="Shared directory for partial aggregates (default: logs/<dataset>/partials/)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Random seed for reproducible topic selection and action remapping",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the datasets in memory and answer analysis queries over HTTP",
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Host the server binds to"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port the server listens on"
+    )
+    parser.add_argument(
+        "--socket-path",
+        type=str,
+        help="Serve on this Unix socket instead of a TCP port",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=float,
+        default=5,
+        help="Seconds between checks for new or changed session files",
+    )
+    parser.add_argument(
+        "--ingest-db",
+        action="store_true",
+        help="Upsert the session directories into the embedded SQL database",
+    )
+    parser.add_argument(
+        "--db-path",
+        type=str,
+        help="Path of the SQLite session database (used by --ingest-db and --compare-users)",
+    )
+    parser.add_argument(
+        "--cardinalities",
+        action="store_true",
+        help="Estimate distinct users, documents, queries and terms with HyperLogLog sketches",
+    )
+    parser.add_argument(
+        "--time-bucket",
+        choices=list(TIME_BUCKETS),
+        default="day",
+        help="Time bucket of the cardinality estimates",
+    )
+    parser.add_argument(
+        "--hll-precision",
+        type=int,
+        default=12,
+        help="HyperLogLog precision (2**precision registers)",
+    )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Answer --compare-users from HyperLogLog sketches instead of the full tables",
+    )
+    parser.add_argument(
+        "--build-cube",
+        action="store_true",
+        help="Append new sessions to the time-bucketed metrics cube",
+    )
+    parser.add_argument(
+        "--rebuild-cube",
+        action="store_true",
+        help="Drop the cube of each dataset before --build-cube",
+    )
+    parser.add_argument(
+        "--query-cube",
+        nargs="+",
+        metavar="MEASURE",
+        help="Measures to read from the metrics cube, e.g. sessions duration_mean",
+    )
+    parser.add_argument(
+        "--group-by",
+        nargs="*",
+        default=[],
+        choices=list(CUBE_DIMENSIONS),
+        help="Cube dimensions kept by --query-cube",
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        default=[],
+        metavar="DIMENSION=VALUE",
+        help="Restrict --query-cube to a dimension value (repeatable, comma-separated values)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update the metric outputs of --dataset for new, changed and deleted session files only",
+    )
+    parser.add_argument(
+        "--reformulations",
+        action="store_true",
+        help="Classify consecutive query pairs of --dataset by edit distance",
+    )
+    parser.add_argument(
+        "--pack-sessions",
+        action="store_true",
+        help="Pack the session files of --dataset into a sharded JSONL container",
+    )
+    parser.add_argument(
+        "--container-path",
+        type=str,
+        help="Container directory for --pack-sessions (default: <session directory>.container)",
+    )
+    parser.add_argument(
+        "--benchmark-codec",
+        action="store_true",
+        help="Time decoding the session files of --dataset with each available JSON decoder",
+    )
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="Update the inverted index of query terms and document ids for every dataset",
+    )
+    parser.add_argument(
+        "--merge-index",
+        action="store_true",
+        help="Merge all segments of the inverted index of --dataset",
+    )
+    parser.add_argument(
+        "--index-query",
+        type=str,
+        help="Boolean query (term:, doc:, AND, OR, NOT) over the inverted index of --dataset",
+    )
+    parser.add_argument(
+        "--session-ids-file",
+        type=str,
+        metavar="PATH",
+        help="Compute the session metrics and topology table of --dataset for the session ids "
+        "listed in PATH (one per line, e.g. logs/<dataset>/index_matches.txt), "
+        "saved under metrics/<dataset>_subset/",
+    )
+    parser.add_argument(
+        "--build-features",
+        action="store_true",
+        help="Extract the memory-mapped per-session feature matrix of every dataset",
+    )
+    parser.add_argument(
+        "--cluster-sessions",
+        type=int,
+        metavar="K",
+        help="Cluster the feature matrix of --dataset into K clusters with mini-batch k-means",
+    )
+    parser.add_argument(
+        "--feature-columns",
+        type=str,
+        nargs="+",
+        help="Column name prefixes used for clustering, e.g. category: transition: (default: all)",
+    )
+    parser.add_argument(
+        "--cluster-batch-size",
+        type=int,
+        default=1024,
+        help="Sessions per mini-batch in --cluster-sessions",
+    )
+    parser.add_argument(
+        "--cluster-iterations",
+        type=int,
+        default=100,
+        help="Number of mini-batches in --cluster-sessions",
+    )
+    parser.add_argument(
+        "--topic-index",
+        type=str,
+        help="Inverted index directory used to weight topics in --generate-synthetic",
+    )
+    parser.add_argument(
+        "--pack-prompts",
+        type=positive_int,
+        default=1,
+        help="Maximum number of sessions packed into one request by --generate-synthetic",
+    )
+    parser.add_argument(
+        "--prompt-token-budget",
+        type=int,
+        default=6000,
+        help="Estimated input token budget of a packed --generate-synthetic request",
+    )
+    parser.add_argument(
+        "--max-shard-mb",
+        type=int,
+        default=256,
+        help="Maximum size of a container shard in MB",
+    )
     parser.add_argument("--csv-file-path", type=str, help="Path to the SUSS CSV file")
+    parser.add_argument(
+        "--json-file-path", type=str, help="Path to the EconBiz NDJSON file"
+    )
+    parser.add_argument(
+        "--reprocess-quarantine",
+        type=str,
+        metavar="PATH",
+        help="Parse only the records of a quarantine file and merge their sessions into the "
+        "sessions saved in --output-dir",
+    )
+    parser.add_argument(
+        "--input-paths",
+        type=str,
+        nargs="+",
+        help="Time-ordered NDJSON or CSV event logs to merge and sessionize",
+    )
+    parser.add_argument(
+        "--output-path", type=str, help="Path of the sessionized output file"
+    )
+    parser.add_argument(
+        "--session-key",
+        type=str,
+        default="session_id",
+        help="Field used to group events into sessions (session_id or user_id)",
+    )
+    parser.add_argument(
+        "--inactivity-timeout",
+        type=float,
+        default=DEFAULT_INACTIVITY_TIMEOUT_MINUTES,
+        help="Inactivity timeout in minutes after which a new session starts",
+    )
     parser.add_argument(
         "--output-dir",
         type=str,
@@ -192,7 +611,7 @@ def main():
     args = parser.parse_args()
 
     # '--json-to-csv' (for EconBiz data)
-    if args.process_json_to_csv:
+    if args.json_to_csv:
         file_path = "data/econbiz/sessions.json"
         output_csv_path = "data/econbiz/sessions.csv"
         process_large_json_to_csv_ndjson(file_path, output_csv_path)
@@ -202,7 +621,18 @@ def main():
     if args.generate_boxplots:
         csv_file_path = "logs/suss/sessions_analysis.csv"
         output_image_path = "metrics/sessions_analysis_suss.png"
-        generate_boxplots(csv_file_path, output_image_path)
+        render_figures(
+            [
+                (
+                    generate_boxplots,
+                    {
+                        "csv_file_path": csv_file_path,
+                        "output_image_path": output_image_path,
+                    },
+                    [csv_file_path],
+                )
+            ]
+        )
         print("Boxplots generated.")
 
     # '--process-sessions'
@@ -212,23 +642,205 @@ def main():
                 "Both --json-file-path and --output-dir are required for session processing."
             )
             return
-        parse_sessions(args.json_file_path)
-        save_sessions_to_json(args.json_file_path, args.output_dir)
+        sessions = parse_sessions(args.json_file_path)
+        save_sessions_to_json(sessions, args.output_dir)
         print("Session processing completed.")
 
     # '--process-classification'
-    if args.process_sessions:
+    if args.process_classification:
         directory = "data/suss/sessions/"
         csv_file_path = "logs/suss/sessions_analysis.csv"
         process_sessions_to_csv(directory, csv_file_path)
 
-    # '--generate'
-    if args.generate:
-        generate_synthetic_sessions()
+    # '--generate-synthetic'
+    if args.generate_synthetic:
+        generate_synthetic_sessions(
+            args.seed, args.topic_index, args.pack_prompts, args.prompt_token_budget
+        )
 
     if args.process_suss and args.csv_file_path and args.output_dir:
         process_suss(args.csv_file_path, args.output_dir)
 
+    # '--reprocess-quarantine'
+    if args.reprocess_quarantine:
+        if not args.output_dir:
+            print("--output-dir is required for reprocessing a quarantine file.")
+            return
+        sessions = reprocess_quarantine(args.reprocess_quarantine, output_dir=args.output_dir)
+        save_sessions_to_json(sessions, args.output_dir)
+
+    # '--sessionize'
+    if args.sessionize:
+        if not args.input_paths or not args.output_path:
+            print("Both --input-paths and --output-path are required for sessionizing.")
+            return
+        if args.input_paths[0].endswith(".csv"):
+            sessionize_csv(
+                args.input_paths,
+                args.output_path,
+                args.session_key,
+                args.inactivity_timeout,
+            )
+        else:
+            sessionize_ndjson(
+                args.input_paths,
+                args.output_path,
+                args.session_key,
+                args.inactivity_timeout,
+            )
+        print("Sessionization completed.")
+
+    # '--near-duplicates'
+    if args.near_duplicates:
+        directories = {
+            "original": "data/econbiz/original_sessions/",
+            "synthetic": "data/econbiz/synthetic_sessions/json/",
+        }
+        detect_near_duplicates(
+            directories,
+            "logs/econbiz/lsh_index/",
+            "metrics/econbiz/near_duplicates.csv",
+            args.similarity_threshold,
+            args.new_only,
+        )
+
+    # '--fidelity-report'
+    if args.fidelity_report:
+        fidelity_report(args.reference_dataset, args.candidate_dataset)
+
+    # '--map-reduce', '--map-partition', '--reduce'
+    if args.map_reduce or args.map_partition is not None or args.reduce:
+        data_directory = DATASET_DIRECTORIES[args.dataset]
+        work_dir = args.work_dir or f"logs/{args.dataset}/partials/"
+        if args.map_reduce:
+            run_map_reduce(
+                data_directory,
+                args.dataset,
+                args.num_partitions,
+                work_dir,
+                args.workers,
+            )
+        if args.map_partition is not None:
+            map_partition(
+                data_directory,
+                args.dataset,
+                args.map_partition,
+                args.num_partitions,
+                work_dir,
+            )
+        if args.reduce:
+            reduce_partitions(args.dataset, args.num_partitions, work_dir)
+        print("Map/reduce processing completed.")
+
+    if args.incremental:
+        run_incremental(DATASET_DIRECTORIES[args.dataset], args.dataset)
+
+    if args.reformulations:
+        analyze_reformulations(
+            DATASET_DIRECTORIES[args.dataset], args.dataset, max_workers=args.workers
+        )
+
+    if args.pack_sessions:
+        directory = DATASET_DIRECTORIES[args.dataset]
+        pack_sessions(
+            directory,
+            args.container_path or f"{directory.rstrip('/')}.container",
+            args.max_shard_mb * 1024 * 1024,
+        )
+
+    if args.build_index:
+        for dataset_name, directory in DATASET_DIRECTORIES.items():
+            if os.path.isdir(directory):
+                index = InvertedIndex(f"logs/{dataset_name}/index/")
+                index.update(directory)
+                index.close()
+
+    if args.merge_index:
+        index = InvertedIndex(f"logs/{args.dataset}/index/")
+        index.merge()
+        index.close()
+
+    if args.index_query:
+        index = InvertedIndex(f"logs/{args.dataset}/index/")
+        matches = index.search(args.index_query)
+        index.close()
+        matches_path = f"logs/{args.dataset}/index_matches.txt"
+        with open(matches_path, "w", encoding="utf-8") as file:
+            file.writelines(f"{session_id}\n" for session_id in matches)
+        print(f"{len(matches)} sessions match {args.index_query!r}; ids saved to {matches_path}")
+
+    if args.session_ids_file:
+        with open(args.session_ids_file, "r", encoding="utf-8") as file:
+            session_ids = [line.strip() for line in file if line.strip()]
+        data_directory = DATASET_DIRECTORIES[args.dataset]
+        # A separate name, so the metrics and sketches of the whole dataset are kept
+        subset_name = f"{args.dataset}_subset"
+        output_directory = f"metrics/{subset_name}/"
+        os.makedirs(output_directory, exist_ok=True)
+        process_sessions(data_directory, subset_name, session_ids)
+        stats_df = categorize_and_compute_stats(data_directory, subset_name, session_ids)
+        stats_df.to_csv(
+            f"{output_directory}topology_interaction_{subset_name}.csv", index=False
+        )
+        print(f"Metrics of {len(session_ids)} sessions saved to {output_directory}")
+
+    if args.build_features:
+        for dataset_name, directory in DATASET_DIRECTORIES.items():
+            if os.path.isdir(directory):
+                build_features(directory, f"logs/{dataset_name}/features/")
+
+    if args.cluster_sessions:
+        cluster_sessions(
+            f"logs/{args.dataset}/features/",
+            args.cluster_sessions,
+            f"metrics/{args.dataset}/session_clusters_{args.dataset}.csv",
+            args.feature_columns,
+            args.cluster_batch_size,
+            args.cluster_iterations,
+            args.seed if args.seed is not None else 0,
+        )
+
+    if args.benchmark_codec:
+        benchmark_decoding(DATASET_DIRECTORIES[args.dataset])
+
+    # '--serve'
+    if args.serve:
+        serve(
+            DATASET_DIRECTORIES,
+            args.host,
+            args.port,
+            args.socket_path,
+            args.reload_interval,
+        )
+
+    if args.ingest_db:
+        database = SessionDatabase(args.db_path or "logs/sessions.db")
+        for dataset, directory in DATASET_DIRECTORIES.items():
+            if os.path.isdir(directory):
+                database.ingest_directory(dataset, directory)
+        database.close()
+
+    if args.cardinalities:
+        for dataset_name, directory in DATASET_DIRECTORIES.items():
+            if os.path.isdir(directory):
+                cardinality_sketches(dataset_name, args.time_bucket, args.hll_precision)
+
+    if args.build_cube:
+        for dataset_name, directory in DATASET_DIRECTORIES.items():
+            if os.path.isdir(directory):
+                build_cube(directory, dataset_name, rebuild=args.rebuild_cube)
+
+    if args.query_cube:
+        filters = {}
+        for item in args.filter:
+            dimension, value = item.split("=", 1)
+            values = [int(v) if dimension == "hour" else v for v in value.split(",")]
+            filters[dimension] = values
+        columns = args.group_by + args.query_cube
+        print("\t".join(columns))
+        for row in query_cube(args.query_cube, args.group_by, filters):
+            print("\t".join(str(row[column]) for column in columns))
+
     # '--compare-XXXX'
     if args.compare_sessions:
         sessions1, sessions2, events1, events2, table1, table2 = load_datasets()
@@ -243,8 +855,22 @@ def main():
         compare_actions_per_session(events1, events2)
 
     if args.compare_users:
-        sessions1, sessions2, events1, events2, table1, table2 = load_datasets()
-        compare_unique_users(table1, table2)
+        if args.db_path:
+            database = SessionDatabase(args.db_path)
+            compare_unique_users(database.dataset("suss"), database.dataset("econbiz"))
+            database.close()
+        elif args.approximate:
+            compare_unique_users(
+                *(
+                    cardinality_sketches(dataset_name, precision=args.hll_precision)[
+                        "total"
+                    ]["users"]
+                    for dataset_name in ("suss", "econbiz")
+                )
+            )
+        else:
+            sessions1, sessions2, events1, events2, table1, table2 = load_datasets()
+            compare_unique_users(table1, table2)
 
     if args.compare_distribution:
         sessions1, sessions2, events1, events2, table1, table2 = load_datasets()
@@ -259,8 +885,8 @@ def main():
     if args.visualize:
         datasets = {"suss": "data/suss/sessions/", "econbiz": "data/econbiz/sessions/"}
         # Initialize as lists of lists for each dataset
-        all_capped_query_counts = [[] for _ in datasets]
-        all_capped_tokens_per_query = [[] for _ in datasets]
+        all_capped_query_counts = [{} for _ in datasets]
+        all_capped_tokens_per_query = [{} for _ in datasets]
 
         i = 0
         for dataset_name, data_directory in datasets.items():
@@ -289,11 +915,31 @@ def main():
         edgecolors = ["#16a085", "#c0392b"]
         labels = ["SUSS", "EconBiz"]
 
-        plot_query_distribution(
-            all_capped_query_counts, datasets_name, colors, edgecolors, labels
-        )
-        plot_tokens_per_query_distribution(
-            all_capped_tokens_per_query, datasets_name, colors, edgecolors, labels
+        style = {
+            "datasets_name": datasets_name,
+            "colors": colors,
+            "edgecolors": edgecolors,
+            "labels": labels,
+        }
+        render_figures(
+            [
+                (
+                    plot_query_distribution,
+                    dict(
+                        style,
+                        all_capped_query_counts=all_capped_query_counts,
+                        output_image_path="metrics/combined_query_distribution.png",
+                    ),
+                ),
+                (
+                    plot_tokens_per_query_distribution,
+                    dict(
+                        style,
+                        all_capped_tokens_per_query=all_capped_tokens_per_query,
+                        output_image_path="metrics/combined_tokens_per_query_distribution.png",
+                    ),
+                ),
+            ]
         )
         print("Visualization completed.")
 
@@ -0,0 +1,153 @@
+import json
+
+import pytest
+
+from analysis import codec
+from analysis.data_processing import load_dataset
+
+SUSS_SESSION = {
+    "session_id": "s3",
+    "session_length": 3,
+    "user_id": 4,
+    "start_date": "2024-02-11 05:00:00",
+    "end_date": "2024-02-11 05:00:03",
+    "actions": [
+        {
+            "action_id": 0,
+            "timestamp": "2024-02-11 05:00:00",
+            "action_type": "search",
+            "action_label": "search_query",
+            "action_length": 3,
+            "params": "labour market",
+            "origin_action": "",
+        }
+    ],
+}
+
+ECONBIZ_RAW_SESSION = {
+    "session_id": "e1",
+    "user_id": "u7",
+    "has_duplicate_pids": 0,
+    "supports_beacon": True,
+    "n_errors": 0,
+    "browser": "firefox",
+    "events": [
+        {"cts": 1.0e12, "category": "SearchBox", "action": "submit", "params": "q=tax"},
+        {
+            "cts": 1000000004000,
+            "category": "RecordMLT",
+            "action": "view",
+            "data": None,
+            "referrer": "search",
+        },
+        {
+            "cts": 1000000009000,
+            "category": "RecordMLT",
+            "action": "view",
+            "data": {"record_ids": [1, 2]},
+            "page_view_id": "p1",
+        },
+    ],
+}
+
+SYNTHETIC_SESSION = {
+    "session_length": 12.5,
+    "user_id": -1,
+    "start_date": "2024-01-01 00:00:00",
+    "end_date": "2024-01-01 00:00:12",
+    "model": "generator",
+    "actions": [
+        {
+            "timestamp": "2024-01-01 00:00:05",
+            "action_type": "search",
+            "action_label": "search_query",
+            "params": {"query": "inflation"},
+            "confidence": 0.5,
+        },
+        {
+            "timestamp": "2024-01-01 00:00:12",
+            "action_type": "extraction",
+            "action_label": "goto_home",
+            "params": {},
+        },
+    ],
+}
+
+
+@pytest.fixture(params=["msgspec", "json"])
+def backend(request, monkeypatch):
+    """Decode through msgspec, or through the stdlib fallback with its schema check."""
+    if request.param == "msgspec":
+        if codec.msgspec is None:
+            pytest.skip("msgspec is not installed")
+    else:
+        monkeypatch.setattr(codec, "_decoders", {})
+        monkeypatch.setattr(codec, "_checkers", {})
+    return request.param
+
+
+def _without(session, *fields):
+    return {key: value for key, value in session.items() if key not in fields}
+
+
+def test_decode_suss_session(backend):
+    assert codec.decode_session(json.dumps(SUSS_SESSION)) == SUSS_SESSION
+
+
+def test_decode_econbiz_raw_session_keeps_unknown_fields(backend):
+    decoded = codec.decode_raw_session(json.dumps(ECONBIZ_RAW_SESSION).encode("utf-8"))
+    assert decoded == ECONBIZ_RAW_SESSION
+    assert codec.decode_raw_sessions(json.dumps([ECONBIZ_RAW_SESSION])) == [decoded]
+
+
+def test_raw_session_fields_are_still_checked(backend):
+    event = {"cts": "yesterday", "category": "SearchBox", "action": "submit"}
+    with pytest.raises(codec.SchemaError):
+        codec.decode_raw_session(json.dumps({"session_id": "e1", "events": [event]}))
+    with pytest.raises(codec.SchemaError):
+        codec.decode_raw_session(json.dumps({"user_id": "u7"}))
+
+
+def test_load_dataset_keeps_user_ids(backend, tmp_path):
+    directory = tmp_path / "sessions"
+    directory.mkdir()
+    (directory / "export.json").write_text(json.dumps([ECONBIZ_RAW_SESSION]))
+    # A single record, as one line of an NDJSON log
+    (directory / "record.json").write_text(json.dumps(ECONBIZ_RAW_SESSION) + "\n")
+    sessions = load_dataset(str(directory), quarantine_file=str(tmp_path / "quarantine"))
+    assert [session["user_id"] for session in sessions] == ["u7", "u7"]
+    assert sessions[0]["events"][1]["referrer"] == "search"
+
+
+def test_decode_synthetic_session_drops_unknown_fields(backend):
+    decoded = codec.decode_session(json.dumps(SYNTHETIC_SESSION))
+    assert decoded == {
+        **_without(SYNTHETIC_SESSION, "model"),
+        "actions": [
+            _without(SYNTHETIC_SESSION["actions"][0], "confidence"),
+            SYNTHETIC_SESSION["actions"][1],
+        ],
+    }
+
+
+def test_backends_agree(monkeypatch):
+    if codec.msgspec is None:
+        pytest.skip("msgspec is not installed")
+    payloads = [json.dumps(session) for session in (SUSS_SESSION, SYNTHETIC_SESSION)]
+    typed = [codec.decode_session(payload) for payload in payloads]
+    monkeypatch.setattr(codec, "_decoders", {})
+    assert [codec.decode_session(payload) for payload in payloads] == typed
+
+
+@pytest.mark.parametrize(
+    "payload, error",
+    [
+        ('{"actions": [', codec.DecodeError),
+        ('{"session_length": 1}', codec.SchemaError),
+        ('{"actions": [{"timestamp": 1, "action_type": "a", "action_label": "b"}]}', codec.SchemaError),
+        ('{"actions": [], "user_id": true}', codec.SchemaError),
+    ],
+)
+def test_decode_rejects_invalid_sessions(backend, payload, error):
+    with pytest.raises(error):
+        codec.decode_session(payload)
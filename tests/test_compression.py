@@ -0,0 +1,45 @@
+import struct
+
+import pytest
+
+from analysis import compression
+
+zstandard = pytest.importorskip("zstandard")
+
+LINES = "".join(f'{{"session_id": "s{number}", "actions": []}}\n' for number in range(2000))
+
+
+def write_frames(path, chunks, suffix=b""):
+    compressor = zstandard.ZstdCompressor()
+    frames = b"".join(compressor.compress(chunk.encode()) for chunk in chunks)
+    path.write_bytes(frames + suffix)
+    return str(path)
+
+
+def read_with_threads(file_path, monkeypatch):
+    """Read the file with 4 threads and report whether it went through the thread pool."""
+    readers = []
+
+    class RecordingReader(compression.ParallelDecompressReader):
+        def __init__(self, *args, **kwargs):
+            readers.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(compression, "ParallelDecompressReader", RecordingReader)
+    with compression.open_input(file_path, threads=4) as file:
+        return file.read(), bool(readers)
+
+
+def test_single_frame_is_streamed(tmp_path, monkeypatch):
+    # A skippable frame after the data frame does not make it multi-frame
+    skippable = struct.pack("<II", compression.ZSTD_SKIPPABLE_MAGIC, 3) + b"abc"
+    file_path = write_frames(tmp_path / "single.zst", [LINES], suffix=skippable)
+    assert not compression._is_multi_frame_zstd(file_path)
+    assert read_with_threads(file_path, monkeypatch) == (LINES, False)
+
+
+def test_multiple_frames_are_decompressed_in_parallel(tmp_path, monkeypatch):
+    half = len(LINES) // 2
+    file_path = write_frames(tmp_path / "multi.zst", [LINES[:half], LINES[half:]])
+    assert compression._is_multi_frame_zstd(file_path)
+    assert read_with_threads(file_path, monkeypatch) == (LINES, True)
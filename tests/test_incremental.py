@@ -0,0 +1,118 @@
+import csv
+import json
+import os
+from collections import Counter
+
+from analysis import incremental
+from analysis.data_processing import process_sessions
+from analysis.incremental import run_incremental
+
+
+def session(session_id, seconds, query):
+    return {
+        "session_id": session_id,
+        "session_length": seconds,
+        "user_id": 1,
+        "start_date": "2024-01-01 00:00:00",
+        "end_date": f"2024-01-01 00:00:{seconds:02d}",
+        "actions": [
+            {
+                "action_id": 0,
+                "timestamp": "2024-01-01 00:00:00",
+                "action_type": "search",
+                "action_label": "query_form",
+                "action_length": seconds,
+                "params": query,
+                "origin_action": "",
+            },
+            {
+                "action_id": 1,
+                "timestamp": f"2024-01-01 00:00:{seconds:02d}",
+                "action_type": "extraction",
+                "action_label": "view_record",
+                "action_length": 0,
+                "params": "10011380001",
+                "origin_action": "",
+            },
+        ],
+    }
+
+
+def write(directory, session_id, seconds, query, mtime_s):
+    file_path = os.path.join(directory, f"{session_id}.json")
+    with open(file_path, "w") as file:
+        json.dump(session(session_id, seconds, query), file)
+    os.utime(file_path, (mtime_s, mtime_s))
+
+
+def csv_rows():
+    with open("logs/suss/sessions_analysis.csv", newline="") as file:
+        return Counter(tuple(row) for row in csv.reader(file))
+
+
+def shard_reads(monkeypatch):
+    reads = []
+    load_json = incremental._load_json
+
+    def counting_load_json(file_path, default):
+        if os.sep + "contributions" + os.sep in file_path:
+            reads.append(file_path)
+        return load_json(file_path, default)
+
+    monkeypatch.setattr(incremental, "_load_json", counting_load_json)
+    return reads
+
+
+def test_incremental_csv_matches_a_full_rewrite(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    directory = str(tmp_path / "sessions")
+    os.mkdir(directory)
+    for number in range(6):
+        write(directory, f"s{number}", number + 1, f"tax {number}", 1)
+    run_incremental(directory, "suss")
+
+    # Adding files only reads the shards of the new files
+    reads = shard_reads(monkeypatch)
+    write(directory, "s6", 7, "wage", 2)
+    run_incremental(directory, "suss")
+    assert len(reads) == 1
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+
+    # A changed and a deleted file are filtered out of the CSV
+    write(directory, "s2", 9, "inflation", 3)
+    os.remove(os.path.join(directory, "s4.json"))
+    run_incremental(directory, "suss")
+    updated = csv_rows()
+
+    os.remove("logs/suss/sessions_analysis.csv")
+    run_incremental(directory, "suss")
+    assert updated == csv_rows()
+    assert sum(updated.values()) == 7  # The header and six sessions
+
+
+def test_csv_rewritten_elsewhere_is_rebuilt(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    directory = str(tmp_path / "sessions")
+    os.mkdir(directory)
+    write(directory, "s0", 1, "tax", 1)
+    run_incremental(directory, "suss")
+    expected = csv_rows()
+    with open("logs/suss/sessions_analysis.csv", "w") as file:
+        file.write("session_id\nother\n")
+    run_incremental(directory, "suss")
+    assert csv_rows() == expected
+
+
+def test_process_sessions_overwrites_the_metrics_summary(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    directory = str(tmp_path / "sessions")
+    os.mkdir(directory)
+    write(directory, "s0", 1, "tax", 1)
+    os.makedirs("metrics/suss")
+    summary = "metrics/suss/session_metrics_suss.txt"
+    with open(summary, "w") as file:
+        file.write("stale\n")
+    process_sessions(directory, "suss")
+    with open(summary) as file:
+        assert file.read().startswith("Session Metrics Summary:")
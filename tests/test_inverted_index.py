@@ -0,0 +1,105 @@
+import json
+import os
+import random
+
+import pytest
+
+from analysis.inverted_index import InvertedIndex, session_keys
+
+TERMS = ["inflation", "tax", "labour", "market", "bank", "germany", "trade", "wage"]
+DOCIDS = [str(10011380000 + number) for number in range(12)]
+
+
+def random_session(rng):
+    actions = []
+    for _ in range(rng.randint(0, 5)):
+        if rng.random() < 0.5:
+            query = " ".join(rng.sample(TERMS, rng.randint(1, 3)))
+            actions.append(
+                {
+                    "timestamp": "2024-01-01 00:00:00",
+                    "action_type": "search",
+                    "action_label": "query_form",
+                    "params": query,
+                }
+            )
+        else:
+            actions.append(
+                {
+                    "timestamp": "2024-01-01 00:00:00",
+                    "action_type": "extraction",
+                    "action_label": "view_record",
+                    "params": rng.choice(DOCIDS),
+                }
+            )
+    return {"session_length": 0, "user_id": -1, "actions": actions}
+
+
+class Corpus:
+    """Session files on disk plus the keys of each, to answer queries by brute force."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.sessions = {}
+        self.writes = 0
+
+    def write(self, session_id, session):
+        file_path = os.path.join(self.directory, f"{session_id}.json")
+        with open(file_path, "w") as file:
+            json.dump(session, file)
+        # A distinct mtime for every write, so rewrites are seen as changes
+        self.writes += 1
+        os.utime(file_path, ns=(self.writes * 10**9, self.writes * 10**9))
+        self.sessions[session_id] = session_keys(session)
+
+    def delete(self, session_id):
+        os.remove(os.path.join(self.directory, f"{session_id}.json"))
+        del self.sessions[session_id]
+
+    def matching(self, key):
+        return {session_id for session_id, keys in self.sessions.items() if key in keys}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_matches_brute_force_after_updates_deletes_and_merges(tmp_path, seed):
+    rng = random.Random(seed)
+    data_directory = tmp_path / "sessions"
+    data_directory.mkdir()
+    corpus = Corpus(str(data_directory))
+    index_directory = str(tmp_path / "index")
+    next_id = 0
+
+    for _ in range(12):
+        for _ in range(rng.randint(0, 15)):
+            corpus.write(f"s{next_id}", random_session(rng))
+            next_id += 1
+        live = sorted(corpus.sessions)
+        for session_id in rng.sample(live, min(len(live), rng.randint(0, 4))):
+            if rng.random() < 0.5:
+                corpus.delete(session_id)
+            else:
+                corpus.write(session_id, random_session(rng))
+
+        index = InvertedIndex(index_directory, merge_factor=rng.randint(2, 4))
+        index.update(str(data_directory), segment_sessions=rng.randint(1, 6))
+        if rng.random() < 0.3:
+            index.merge(rng.choice([None, 2]))
+        index.close()
+
+        # A fresh instance reads everything back from disk
+        index = InvertedIndex(index_directory)
+        assert len(index) == len(corpus.sessions)
+        for term in TERMS:
+            assert set(index.sessions_with_term(term)) == corpus.matching(f"term:{term}")
+        for docid in DOCIDS:
+            assert set(index.sessions_with_document(docid)) == corpus.matching(f"doc:{docid}")
+
+        first, second = rng.sample(TERMS, 2)
+        docid = rng.choice(DOCIDS)
+        expected = (
+            corpus.matching(f"term:{first}") | corpus.matching(f"doc:{docid}")
+        ) - corpus.matching(f"term:{second}")
+        matches = index.search(f"(term:{first} OR doc:{docid}) AND NOT {second}")
+        assert len(matches) == len(set(matches))
+        assert set(matches) == expected
+        index.close()
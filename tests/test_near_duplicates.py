@@ -0,0 +1,114 @@
+import csv
+import json
+import os
+import random
+
+from analysis.near_duplicates import LSHIndex, detect_near_duplicates, session_shingles
+
+LABELS = ["query_form", "view_record", "goto_home", "export_bib", "goto_advanced_search"]
+
+
+def random_session(rng):
+    actions = [
+        {
+            "timestamp": "2024-01-01 00:00:00",
+            "action_type": "search",
+            "action_label": rng.choice(LABELS),
+            "params": rng.choice(["tax", "wage", "inflation"]),
+        }
+        for _ in range(rng.randint(0, 6))
+    ]
+    return {"session_length": 0, "user_id": -1, "actions": actions}
+
+
+def brute_force_pairs(index, threshold, session_ids=None):
+    """Every pair sharing a band that is not oversized, found by comparing all pairs."""
+    pairs = set()
+    for first in range(len(index)):
+        for second in range(first + 1, len(index)):
+            if session_ids is not None and not {index.ids[first], index.ids[second]} & session_ids:
+                continue
+            if index._first_shared_band(first, second) is None:
+                continue
+            similarity = index.similarity(index._signature_at(first), index._signature_at(second))
+            if similarity >= threshold:
+                pairs.add((index.ids[first], index.ids[second], similarity))
+    return pairs
+
+
+def test_candidate_pairs_match_brute_force():
+    rng = random.Random(3)
+    index = LSHIndex(num_perm=16, bands=8, max_bucket_size=6)
+    for number in range(80):
+        index.add(f"s{number}", index.signature(session_shingles(random_session(rng))))
+    # Rewritten sessions replace their signature
+    for number in range(0, 80, 7):
+        index.add(f"s{number}", index.signature(session_shingles(random_session(rng))))
+
+    pairs = index.near_duplicates(0.5)
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == brute_force_pairs(index, 0.5)
+
+    new = {f"s{number}" for number in range(60, 80)}
+    pairs = index.near_duplicates(0.5, new)
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == brute_force_pairs(index, 0.5, new)
+
+
+def test_empty_sessions_and_oversized_buckets_are_not_paired():
+    index = LSHIndex(num_perm=16, bands=8, max_bucket_size=3)
+    empty = index.signature(session_shingles({"actions": []}))
+    for number in range(5):
+        index.add(f"empty{number}", empty)
+    same = index.signature({"a:search/query_form"})
+    for number in range(4):
+        index.add(f"same{number}", same)
+    assert index.near_duplicates(0.0) == []
+    assert index.near_duplicates(0.0, {"empty0", "same0"}) == []
+
+
+def write_session(directory, name, session, mtime_s):
+    file_path = os.path.join(directory, f"{name}.json")
+    with open(file_path, "w") as file:
+        json.dump(session, file)
+    os.utime(file_path, (mtime_s, mtime_s))
+
+
+def reported_pairs(report_path):
+    with open(report_path, newline="") as file:
+        return {(row["session_id"], row["best_match"]) for row in csv.DictReader(file)}
+
+
+def session_with(action_type, action_label, params):
+    action = {
+        "timestamp": "2024-01-01 00:00:00",
+        "action_type": action_type,
+        "action_label": action_label,
+        "params": params,
+    }
+    return {"session_length": 0, "user_id": -1, "actions": [action]}
+
+
+def test_changed_files_are_indexed_again(tmp_path):
+    directory = tmp_path / "sessions"
+    directory.mkdir()
+    index_dir = str(tmp_path / "index")
+    report_path = str(tmp_path / "report.csv")
+    first = session_with("search", "query_form", "inflation")
+    other = session_with("extraction", "export_mail", "")
+    write_session(str(directory), "a", first, 1)
+    write_session(str(directory), "b", other, 1)
+    detect_near_duplicates({"x": str(directory)}, index_dir, report_path, new_only=True)
+    assert reported_pairs(report_path) == set()
+
+    # "b" is rewritten as a copy of "a"
+    write_session(str(directory), "b", first, 2)
+    detect_near_duplicates({"x": str(directory)}, index_dir, report_path, new_only=True)
+    assert reported_pairs(report_path) == {("x/a", "x/b"), ("x/b", "x/a")}
+
+    # The replacement survives a reload, and unchanged files are not indexed again
+    index = LSHIndex.load(index_dir)
+    assert len(index) == 2
+    assert list(index.get_signature("x/b")) == list(index.get_signature("x/a"))
+    detect_near_duplicates({"x": str(directory)}, index_dir, report_path, new_only=True)
+    assert reported_pairs(report_path) == set()
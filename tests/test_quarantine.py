@@ -0,0 +1,136 @@
+import json
+import os
+
+from analysis.codec import read_session
+from analysis.data_processing import parse_sessions, reprocess_quarantine
+from analysis.quarantine import Quarantine, quarantine_path, read_quarantine
+from analysis.session_analysis import save_sessions_to_json
+from analysis.suss_processing import parse_csv
+
+CSV_HEADER = (
+    "id,session_id,session_length,user_id,date,mapping_type,mapping_action_label,"
+    "action_length,params,origin_action\n"
+)
+CSV_ROWS = [
+    "0,s1,30,4,2024-02-11 05:00:10,search,query_form,10,tax,\n",
+    "1,s1,30,4,2024-02-11 05:00:00,extraction,view_record,{length},101,\n",
+    "2,s1,30,4,2024-02-11 05:00:30,extraction,goto_home,0,,\n",
+]
+
+
+def saved_sessions(directory):
+    return {
+        filename[: -len(".json")]: read_session(os.path.join(directory, filename))
+        for filename in sorted(os.listdir(directory))
+    }
+
+
+def fix_quarantine(path, fix):
+    entries = read_quarantine(path)
+    with open(path, "w", encoding="utf-8") as file:
+        for entry in entries:
+            entry["record"] = fix(entry["record"])
+            file.write(json.dumps(entry) + "\n")
+
+
+def parse_fix_reprocess(tmp_path, write_input, parse, fix):
+    """Parse a broken input, fix its quarantine and reprocess it, then parse the fixed input."""
+    output_dir = tmp_path / "sessions"
+    output_dir.mkdir()
+    quarantine_file = str(tmp_path / "input.quarantine.ndjson")
+    input_path = write_input(broken=True)
+    save_sessions_to_json(parse(input_path, quarantine_file=quarantine_file), str(output_dir))
+    assert len(read_quarantine(quarantine_file)) == 1
+
+    fix_quarantine(quarantine_file, fix)
+    sessions = reprocess_quarantine(quarantine_file, output_dir=str(output_dir))
+    save_sessions_to_json(sessions, str(output_dir))
+    assert not os.path.exists(quarantine_file)
+
+    expected_dir = tmp_path / "expected"
+    expected_dir.mkdir()
+    fixed_path = write_input(broken=False)
+    save_sessions_to_json(parse(fixed_path, quarantine_file=quarantine_file), str(expected_dir))
+    return saved_sessions(str(output_dir)), saved_sessions(str(expected_dir))
+
+
+def test_suss_round_trip_merges_into_saved_session(tmp_path):
+    def write_input(broken):
+        path = tmp_path / ("broken.csv" if broken else "fixed.csv")
+        rows = [row.format(length="ten" if broken else 10) for row in CSV_ROWS]
+        path.write_text(CSV_HEADER + "".join(rows))
+        return str(path)
+
+    def fix(record):
+        return dict(record, action_length="10")
+
+    reprocessed, expected = parse_fix_reprocess(tmp_path, write_input, parse_csv, fix)
+    assert reprocessed == expected
+    assert [action["action_id"] for action in reprocessed["s1"]["actions"]] == [0, 1, 2]
+    assert reprocessed["s1"]["start_date"] == "2024-02-11 05:00:10"
+    assert reprocessed["s1"]["end_date"] == "2024-02-11 05:00:30"
+
+
+def test_econbiz_round_trip_merges_into_saved_session(tmp_path):
+    def line(events):
+        return json.dumps({"session_id": "e1", "events": events}) + "\n"
+
+    click = {"cts": 1700000000000, "category": "SearchHit", "action": "click"}
+    later = [
+        {"cts": 1700000005000, "category": "RecordView", "action": "view"},
+        {"cts": 1700000009000, "category": "PageView", "action": "view", "page_view_id": "p"},
+    ]
+
+    def write_input(broken):
+        path = tmp_path / ("broken.ndjson" if broken else "fixed.ndjson")
+        broken_event = {"cts": 1700000005000, "action": "view"} if broken else later[0]
+        path.write_text(line([click]) + line([broken_event, later[1]]))
+        return str(path)
+
+    def fix(record):
+        session = json.loads(record)
+        session["events"][0]["category"] = "RecordView"
+        return json.dumps(session)
+
+    reprocessed, expected = parse_fix_reprocess(tmp_path, write_input, parse_sessions, fix)
+    assert reprocessed == expected
+    assert [action["action_length"] for action in reprocessed["e1"]["actions"]] == [0, 5, 4]
+    assert reprocessed["e1"]["session_length"] == 9
+
+
+def test_quarantine_keeps_previous_file_until_closed(tmp_path):
+    path = str(tmp_path / "input.quarantine.ndjson")
+    with Quarantine(path, "suss_csv") as quarantine:
+        quarantine.add("bad_value", "first run", {"id": "1"}, line=2)
+    with Quarantine(path, "suss_csv") as quarantine:
+        quarantine.add("bad_value", "second run", {"id": "1"}, line=2)
+        assert read_quarantine(path)[0]["message"] == "first run"
+    assert read_quarantine(path)[0]["message"] == "second run"
+
+    try:
+        with Quarantine(path, "suss_csv") as quarantine:
+            quarantine.add("bad_value", "failed run", {"id": "1"}, line=2)
+            raise RuntimeError("parser crashed")
+    except RuntimeError:
+        pass
+    assert read_quarantine(path)[0]["message"] == "second run"
+    assert os.listdir(tmp_path) == ["input.quarantine.ndjson"]
+
+
+def test_inputs_with_the_same_base_name_get_separate_quarantine_files():
+    assert quarantine_path("data/suss/sessions/") != quarantine_path("data/econbiz/sessions/")
+    assert quarantine_path("data/econbiz/sessions/") == quarantine_path(
+        os.path.abspath("data/econbiz/sessions")
+    )
+
+
+def test_clean_run_only_removes_the_quarantine_of_its_own_source(tmp_path):
+    path = str(tmp_path / "sessions.quarantine.ndjson")
+    with Quarantine(path, "dataset_file", "data/suss/sessions/") as quarantine:
+        quarantine.add("schema", "bad session", {"id": "1"}, line=0)
+    with Quarantine(path, "dataset_file", "data/econbiz/sessions/"):
+        pass
+    assert read_quarantine(path)[0]["source"] == "data/suss/sessions/"
+    with Quarantine(path, "dataset_file", "data/suss/sessions/"):
+        pass
+    assert not os.path.exists(path)
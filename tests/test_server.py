@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+
+from analysis.server import AnalysisService, _watch
+
+
+def session(session_id):
+    return {
+        "session_id": session_id,
+        "session_length": 5,
+        "user_id": 1,
+        "start_date": "2024-01-01 00:00:00",
+        "end_date": "2024-01-01 00:00:05",
+        "actions": [
+            {
+                "timestamp": "2024-01-01 00:00:05",
+                "action_type": "search",
+                "action_label": "query_form",
+                "params": "tax",
+            }
+        ],
+    }
+
+
+def write(directory, filename, text, mtime_s):
+    file_path = os.path.join(directory, filename)
+    with open(file_path, "w") as file:
+        file.write(text)
+    os.utime(file_path, (mtime_s, mtime_s))
+
+
+def test_reload_skips_unreadable_files_until_they_are_fixed(tmp_path):
+    directory = str(tmp_path)
+    write(directory, "a.json", json.dumps(session("a")), 1)
+    write(directory, "b.json", '{"session_id": "b", "actions": [', 1)
+    service = AnalysisService({"suss": directory})
+    assert service.reload() == ["suss"]
+    info = service.describe()["suss"]
+    assert info["sessions"] == 1
+    assert info["unreadable_files"] == ["b.json"]
+    assert service.query("/sessions", {}) == {"suss": {"sessions": 1}}
+
+    # The half-written file is completed
+    write(directory, "b.json", json.dumps(session("b")), 2)
+    assert service.reload() == ["suss"]
+    assert service.describe()["suss"]["unreadable_files"] == []
+    assert service.query("/sessions", {}) == {"suss": {"sessions": 2}}
+
+    # A new file with a timestamp the store cannot parse is skipped on the incremental path
+    bad = dict(session("c"), actions=[dict(session("c")["actions"][0], timestamp="soon")])
+    write(directory, "c.json", json.dumps(bad), 2)
+    assert service.reload() == ["suss"]
+    assert service.query("/sessions", {}) == {"suss": {"sessions": 2}}
+    assert service.describe()["suss"]["unreadable_files"] == ["c.json"]
+
+
+def test_watcher_survives_a_failing_reload():
+    calls = []
+    stop_event = threading.Event()
+
+    class Service:
+        def reload(self):
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RuntimeError("disk went away")
+            stop_event.set()
+            return []
+
+    _watch(Service(), 0.001, stop_event)
+    assert calls == [0, 1]
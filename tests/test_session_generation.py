@@ -0,0 +1,182 @@
+import glob
+import os
+
+from analysis.data_processing import action_mappings
+from analysis.session_generation import (
+    StreamingActionParser,
+    action_vocabulary,
+    create_synthetic_sessions,
+    generate_synthetic_actions_packed,
+)
+
+# SUSS labels, which remapped sessions carry as their action types
+VOCABULARY = {"search", "goto_home", "view_record", "export_bib"}
+SAMPLE_DIRECTORY = os.path.join(
+    os.path.dirname(__file__), "..", "data", "econbiz", "synthetic_sessions"
+)
+
+
+def action_line(action_type, action_label, params="", seconds=5):
+    line = f"Time spent: {seconds} seconds; Action Type: {action_type}; Action Label: {action_label}"
+    return f"{line}; Params: {params}" if params else line
+
+
+def feed_in_chunks(parser, text, size):
+    for start in range(0, len(text), size):
+        if parser.feed(text[start : start + size]):
+            break
+    return parser.finish()
+
+
+def test_parser_keeps_valid_lines_until_end_marker():
+    text = "\n".join(
+        [
+            "Here are the actions:",
+            action_line("search", "submit", 'searchterm_1: "inflation"'),
+            # A made-up type is rejected, whatever its label
+            action_line("search_with_magic", "click"),
+            action_line("view_record", "click", 'docid: "10011380001"'),
+            "Action Type: missing the time spent",
+            "**END**",
+            action_line("search", "submit", "after the end"),
+        ]
+    )
+    for size in (1, 7, 64, len(text)):
+        parser = StreamingActionParser(VOCABULARY)
+        lines = feed_in_chunks(parser, text, size)
+        assert lines == [
+            action_line("search", "submit", 'searchterm_1: "inflation"'),
+            action_line("view_record", "click", 'docid: "10011380001"'),
+        ]
+        assert parser.actions == [
+            ("search", "submit", 'searchterm_1: "inflation"'),
+            ("view_record", "click", 'docid: "10011380001"'),
+        ]
+        assert parser.invalid_lines == [
+            action_line("search_with_magic", "click"),
+            "Action Type: missing the time spent",
+        ]
+        assert parser.stop_reason == "end marker"
+
+
+def test_parser_checks_action_labels_when_given():
+    parser = StreamingActionParser(VOCABULARY, action_labels={"click", "submit"})
+    text = action_line("search", "submit") + "\n" + action_line("search", "teleport") + "\n"
+    feed_in_chunks(parser, text, 5)
+    assert parser.actions == [("search", "submit", None)]
+    assert parser.invalid_lines == [action_line("search", "teleport")]
+    assert parser.stop_reason == "end of stream"
+
+
+def test_parser_accepts_the_generated_sample():
+    # Every type of the sample is a SUSS label of the topology mapping
+    vocabulary = action_vocabulary([{"action_label": label} for label in action_mappings])
+    (sample_path,) = glob.glob(os.path.join(SAMPLE_DIRECTORY, "*.txt"))
+    with open(sample_path, "r", encoding="utf-8") as file:
+        text = file.read()
+    parser = StreamingActionParser(vocabulary)
+    lines = feed_in_chunks(parser, text, 16)
+    assert lines == text.strip().split("\n")
+    assert parser.invalid_share == 0
+
+
+def test_parser_stops_on_repetition_and_drops_the_copies():
+    block = [action_line("search", "submit", "tax"), action_line("goto_home", "click")]
+    text = "\n".join([action_line("view_record", "click", "1")] + block * 4) + "\n"
+    parser = StreamingActionParser(VOCABULARY, max_period=2, max_repeats=3)
+    lines = feed_in_chunks(parser, text, 11)
+    assert parser.stop_reason == "repetition"
+    assert lines == [action_line("view_record", "click", "1")] + block
+
+
+def test_parser_stops_on_terminal_action_and_without_vocabulary_accepts_all():
+    parser = StreamingActionParser(terminal_actions={"export_bib"})
+    text = "\n".join(
+        [
+            action_line("made_up", "click"),
+            action_line("export_bib", "click"),
+            action_line("search", "submit"),
+        ]
+    )
+    lines = feed_in_chunks(parser, text, 3)
+    assert lines == [action_line("made_up", "click"), action_line("export_bib", "click")]
+    assert parser.stop_reason == "terminal action"
+    assert parser.invalid_share == 0
+
+
+def stream_chunk(text):
+    delta = type("Delta", (), {"content": text})()
+    return type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})()]})()
+
+
+class FakeStream(list):
+    def close(self):
+        pass
+
+
+class FakeCompletions:
+    """Streams canned completions in small chunks and records the request arguments."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        text = self.responses.pop(0)
+        return FakeStream(stream_chunk(text[start : start + 9]) for start in range(0, len(text), 9))
+
+
+def test_packed_generation_scales_completion_limit_with_batch():
+    prompts = [(f"topic {number}", action_line("search", "submit")) for number in (1, 2, 3)]
+    response = "".join(
+        f"=== SESSION {number} ===\n{action_line('search', 'submit', f'topic {number}')}\nEND\n"
+        for number in (1, 2, 3)
+    )
+    completions = FakeCompletions([response])
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    results = generate_synthetic_actions_packed(
+        prompts,
+        action_mappings=[],
+        vocabulary=VOCABULARY,
+        max_sessions=3,
+        max_tokens_per_session=500,
+        client=client,
+    )
+    assert [request["max_tokens"] for request in completions.requests] == [1500]
+    assert results == [
+        action_line("search", "submit", f"topic {number}") for number in (1, 2, 3)
+    ]
+
+
+def test_synthetic_sessions_stop_at_drop_off_actions():
+    session = {
+        "start_date": "2024-01-01 00:00:00",
+        "actions": [
+            {
+                "timestamp": "2024-01-01 00:00:01",
+                "action_type": "SearchSubmit",
+                "action_label": "submit",
+                "params": "tax",
+            },
+        ],
+    }
+    response = (
+        "=== SESSION 1 ===\n"
+        + "\n".join(
+            [
+                action_line("search", "submit", "tax"),
+                action_line("purge_history", "click"),
+                action_line("goto_home", "click"),
+            ]
+        )
+        + "\n"
+    )
+    completions = FakeCompletions([response])
+    client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    rows = [{"action_label": label} for label in action_mappings]
+    (result,) = create_synthetic_sessions([session], ["tax"], rows, client=client)
+    assert len(completions.requests) == 1
+    assert result == "\n".join(
+        [action_line("search", "submit", "tax"), action_line("purge_history", "click")]
+    )
@@ -0,0 +1,43 @@
+import pytest
+
+from analysis import utils
+from analysis.heavy_hitters import normalize_query
+
+
+class FakeStopwords:
+    def __init__(self, words):
+        self._words = words
+        self.calls = 0
+
+    def words(self, language):
+        self.calls += 1
+        if self._words is None:
+            raise LookupError("Resource stopwords not found.")
+        return self._words
+
+
+@pytest.fixture
+def fake_stopwords(monkeypatch):
+    def install(words):
+        fake = FakeStopwords(words)
+        monkeypatch.setattr(utils, "stopwords", fake)
+        utils._stop_words.cache_clear()
+        return fake
+
+    yield install
+    utils._stop_words.cache_clear()
+
+
+def test_stopwords_are_loaded_once(fake_stopwords):
+    fake = fake_stopwords(["the", "of"])
+    assert normalize_query("The Economics of Tax") == "economics tax"
+    assert normalize_query("History of the Euro") == "history euro"
+    assert fake.calls == 1
+
+
+def test_queries_are_kept_without_the_nltk_data(fake_stopwords, capsys):
+    fake = fake_stopwords(None)
+    assert normalize_query("The Economics of Tax") == "the economics of tax"
+    assert normalize_query("History of the Euro") == "history of the euro"
+    assert fake.calls == 1
+    assert "stopwords corpus is missing" in capsys.readouterr().out